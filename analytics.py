@@ -0,0 +1,389 @@
+"""Conversation funnel analytics from an append-only event log.
+
+Every state a conversation callback moves a chat to, and every generation it
+runs (singleflight hooks), becomes a row of analytics_events. Handlers only
+append to an in-memory buffer; a background thread inserts the buffer in
+batches every ANALYTICS_FLUSH_SECONDS, so an update never waits on disk.
+
+rollup() folds the events after analytics_rollup.last_event_id into small
+tables, so its cost depends on the new events only:
+
+    analytics_chats      the state each chat is in and since when
+    analytics_reached    which chats ever reached which state
+    analytics_counts     reached/converted per state, calls/errors per generation
+    analytics_durations  log-scale histograms of time in state and generation time
+
+A job rolls up every ANALYTICS_ROLLUP_MINUTES; /funnel (admins) and the
+/analytics/funnel route of the Flask app report from the rollups. Conversion
+of a FUNNEL state is the share of chats that reached it and later reached the
+next one; "idle" counts chats sitting in a state for ANALYTICS_IDLE_HOURS.
+"""
+import os
+import math
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from telegram import Update
+from telegram.ext import CallbackContext, CommandHandler, ConversationHandler, Dispatcher
+from database import DB_PATH, current_tenant
+from singleflight import generation_flight
+from utils import is_admin
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_FLUSH_SECONDS = float(os.getenv('ANALYTICS_FLUSH_SECONDS', '2'))
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', '500'))
+# Events kept in memory if the database can't keep up; older ones are dropped
+ANALYTICS_MAX_BUFFER = int(os.getenv('ANALYTICS_MAX_BUFFER', '50000'))
+ANALYTICS_ROLLUP_MINUTES = float(os.getenv('ANALYTICS_ROLLUP_MINUTES', '5'))
+ANALYTICS_IDLE_HOURS = float(os.getenv('ANALYTICS_IDLE_HOURS', '24'))
+ROLLUP_BATCH_SIZE = 5000
+# Histogram buckets per doubling of the duration: percentiles within ~19%
+BUCKETS_PER_DOUBLING = 4
+
+# The content plan path, in order
+FUNNEL = [
+    'SUBSCRIPTION_CHECK', 'MAIN_MENU', 'TOPIC', 'AUDIENCE', 'MONETIZATION', 'PRODUCT_DETAILS',
+    'PREFERENCES', 'STYLE', 'EMOTIONS', 'EXAMPLES', 'POST_NUMBER',
+]
+NEXT_STATE = dict(zip(FUNNEL, FUNNEL[1:]))
+
+# (tenant_id, chat_id, kind, name, ok, ms, created_at)
+Event = Tuple[str, int, str, str, Optional[int], Optional[int], float]
+
+class EventLog:
+    """Buffered appends to analytics_events."""
+
+    def __init__(self, db_path: str = DB_PATH, flush_seconds: float = ANALYTICS_FLUSH_SECONDS,
+                 batch_size: int = ANALYTICS_BATCH_SIZE, max_buffer: int = ANALYTICS_MAX_BUFFER):
+        self.db_path = db_path
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer: List[Event] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, chat_id: int, kind: str, name: str, ok: Optional[bool] = None,
+               ms: Optional[int] = None) -> None:
+        event = (current_tenant(), chat_id, kind, name, None if ok is None else int(ok), ms, time.time())
+        with self._lock:
+            self._buffer.append(event)
+            if len(self._buffer) > self.max_buffer:
+                del self._buffer[:len(self._buffer) - self.max_buffer]
+                metrics.incr('analytics.dropped')
+            full = len(self._buffer) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='analytics-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Insert the buffered events now. Returns how many."""
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if not events:
+            return 0
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA synchronous = NORMAL')
+            with conn:
+                conn.executemany('''
+                    INSERT INTO analytics_events (tenant_id, chat_id, kind, name, ok, ms, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', events)
+        except Exception as e:
+            logger.error(f"Error writing {len(events)} analytics events: {e}")
+            with self._lock:
+                # Retried with the next flush, within the buffer cap
+                self._buffer[:0] = events[-self.max_buffer:]
+            return 0
+        finally:
+            if conn:
+                conn.close()
+        metrics.incr('analytics.events', len(events))
+        return len(events)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+event_log = EventLog()
+atexit.register(event_log.flush)
+
+def _bucket(seconds: float) -> int:
+    return int(BUCKETS_PER_DOUBLING * math.log2(max(seconds, 0.0) * 1000 + 1))
+
+def _bucket_seconds(bucket: int) -> float:
+    """Upper edge of a bucket."""
+    return (2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING) - 1) / 1000
+
+def track(conversation: ConversationHandler, state_names: Dict[Any, str]) -> ConversationHandler:
+    """Record the state every callback of the conversation moves its chat to."""
+    def wrap(callback: Callable) -> Callable:
+        @wraps(callback)
+        def tracked(update: Update, context: CallbackContext):
+            new_state = callback(update, context)
+            chat = update.effective_chat if isinstance(update, Update) else None
+            # None keeps the state; a run_async callback returns its real state here too
+            if chat is not None and new_state is not None:
+                name = 'END' if new_state == ConversationHandler.END else state_names.get(new_state, str(new_state))
+                event_log.record(chat.id, 'state', name)
+            return new_state
+        return tracked
+
+    groups = [conversation.entry_points, conversation.fallbacks, *conversation.states.values()]
+    for handlers in groups:
+        for handler in handlers:
+            handler.callback = wrap(handler.callback)
+    return conversation
+
+def _record_generation(chat_id: int, key: str, error: Optional[Exception], seconds: float) -> None:
+    # 'post:3' -> 'post'
+    event_log.record(chat_id, 'generation', key.split(':')[0], ok=error is None, ms=int(seconds * 1000))
+
+def _fold(conn, events: List[tuple]) -> None:
+    """Add `events` (ordered by id) to the rollup tables."""
+    chats: Dict[Tuple[str, int], Optional[Tuple[str, float]]] = {}
+    counts: Counter = Counter()
+    errors: Counter = Counter()
+    durations: Counter = Counter()
+
+    def reach(tenant_id: str, state: str, chat_id: int) -> None:
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO analytics_reached (tenant_id, state, chat_id) VALUES (?, ?, ?)',
+            (tenant_id, state, chat_id)
+        )
+        if not cursor.rowcount:
+            return
+        counts[tenant_id, f'reached:{state}'] += 1
+        previous = next((s for s, following in NEXT_STATE.items() if following == state), None)
+        if previous and conn.execute(
+            'SELECT 1 FROM analytics_reached WHERE tenant_id = ? AND state = ? AND chat_id = ?',
+            (tenant_id, previous, chat_id)
+        ).fetchone():
+            counts[tenant_id, f'converted:{previous}'] += 1
+
+    for _, tenant_id, chat_id, kind, name, ok, ms, created_at in events:
+        if kind == 'generation':
+            counts[tenant_id, f'generation:{name}'] += 1
+            errors[tenant_id, f'generation:{name}'] += 0 if ok else 1
+            durations[tenant_id, f'generation:{name}', _bucket((ms or 0) / 1000)] += 1
+            continue
+        key = (tenant_id, chat_id)
+        if key not in chats:
+            chats[key] = conn.execute(
+                'SELECT state, entered_at FROM analytics_chats WHERE tenant_id = ? AND chat_id = ?', key
+            ).fetchone()
+        current = chats[key]
+        if current and current[0] == name:
+            continue
+        if current:
+            durations[tenant_id, f'state:{current[0]}', _bucket(created_at - current[1])] += 1
+        chats[key] = (name, created_at)
+        counts[tenant_id, f'entered:{name}'] += 1
+        reach(tenant_id, name, chat_id)
+
+    conn.executemany(
+        'INSERT OR REPLACE INTO analytics_chats (tenant_id, chat_id, state, entered_at) VALUES (?, ?, ?, ?)',
+        [(tenant_id, chat_id, *state) for (tenant_id, chat_id), state in chats.items() if state]
+    )
+    conn.executemany('''
+        INSERT INTO analytics_counts (tenant_id, metric, count, errors) VALUES (?, ?, ?, ?)
+        ON CONFLICT (tenant_id, metric) DO UPDATE SET
+            count = count + excluded.count, errors = errors + excluded.errors
+    ''', [(tenant_id, metric, count, errors[tenant_id, metric]) for (tenant_id, metric), count in counts.items()])
+    conn.executemany('''
+        INSERT INTO analytics_durations (tenant_id, metric, bucket, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (tenant_id, metric, bucket) DO UPDATE SET count = count + excluded.count
+    ''', [(*key, count) for key, count in durations.items()])
+
+def rollup(db_path: str = DB_PATH, batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """Fold the events logged since the last rollup in. Returns how many.
+
+    Each batch is one IMMEDIATE transaction that reads and moves the
+    watermark, so rollups running at once never count an event twice.
+    """
+    event_log.flush()
+    total = 0
+    conn = None
+    try:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                last_id = conn.execute('SELECT last_event_id FROM analytics_rollup WHERE id = 1').fetchone()[0]
+                events = conn.execute('''
+                    SELECT id, tenant_id, chat_id, kind, name, ok, ms, created_at FROM analytics_events
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (last_id, batch_size)).fetchall()
+                if events:
+                    _fold(conn, events)
+                    conn.execute(
+                        'UPDATE analytics_rollup SET last_event_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1',
+                        (events[-1][0],)
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            total += len(events)
+            if len(events) < batch_size:
+                break
+    finally:
+        if conn:
+            conn.close()
+    if total:
+        metrics.incr('analytics.rolled_up', total)
+    return total
+
+def _percentile(histogram: Dict[int, int], percent: float) -> Optional[float]:
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= total * percent / 100:
+            return round(_bucket_seconds(bucket), 3)
+    return None
+
+def funnel_report(tenant_id: str = '', db_path: str = DB_PATH,
+                  idle_hours: float = ANALYTICS_IDLE_HOURS) -> Dict[str, Any]:
+    """Per-state conversion, time in state and idle chats, and generation error rates, from the rollups."""
+    conn = None
+    try:
+        conn = sqlite3.connect(db_path, timeout=30)
+        counts = {
+            metric: (count, failed) for metric, count, failed in conn.execute(
+                'SELECT metric, count, errors FROM analytics_counts WHERE tenant_id = ?', (tenant_id,)
+            )
+        }
+        histograms: Dict[str, Dict[int, int]] = {}
+        for metric, bucket, count in conn.execute(
+            'SELECT metric, bucket, count FROM analytics_durations WHERE tenant_id = ?', (tenant_id,)
+        ):
+            histograms.setdefault(metric, {})[bucket] = count
+        idle = dict(conn.execute('''
+            SELECT state, COUNT(*) FROM analytics_chats
+            WHERE tenant_id = ? AND state != 'END' AND entered_at < ? GROUP BY state
+        ''', (tenant_id, time.time() - idle_hours * 3600)).fetchall())
+        last_event_id, updated_at = conn.execute(
+            'SELECT last_event_id, updated_at FROM analytics_rollup WHERE id = 1'
+        ).fetchone()
+    finally:
+        if conn:
+            conn.close()
+
+    seen_states = {metric.split(':', 1)[1] for metric in counts if metric.startswith('reached:')}
+    states = []
+    for state in FUNNEL + sorted(seen_states - set(FUNNEL) - {'END'}):
+        reached = counts.get(f'reached:{state}', (0, 0))[0]
+        converted = counts.get(f'converted:{state}', (0, 0))[0]
+        durations = histograms.get(f'state:{state}', {})
+        states.append({
+            'state': state,
+            'reached': reached,
+            'entered': counts.get(f'entered:{state}', (0, 0))[0],
+            'conversion': round(converted / reached, 3) if reached and state in NEXT_STATE else None,
+            'time_p50_s': _percentile(durations, 50),
+            'time_p90_s': _percentile(durations, 90),
+            'idle': idle.get(state, 0),
+        })
+    generations = []
+    for metric in sorted(m for m in counts if m.startswith('generation:')):
+        calls, failed = counts[metric]
+        generations.append({
+            'kind': metric.split(':', 1)[1],
+            'calls': calls,
+            'errors': failed,
+            'error_rate': round(failed / calls, 3) if calls else None,
+            'p50_s': _percentile(histograms.get(metric, {}), 50),
+            'p90_s': _percentile(histograms.get(metric, {}), 90),
+        })
+    return {
+        'tenant': tenant_id,
+        'rolled_up_to_event': last_event_id,
+        'updated_at': updated_at,
+        'idle_hours': idle_hours,
+        'states': states,
+        'generations': generations,
+    }
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '—'
+    if seconds < 60:
+        return f"{seconds:.0f} с" if seconds >= 10 else f"{seconds:.1f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = ["📊 Воронка диалога", ""]
+    for state in report['states']:
+        if not state['reached']:
+            continue
+        conversion = f" → {state['conversion'] * 100:.0f}%" if state['conversion'] is not None else ''
+        lines.append(
+            f"{state['state']}: {state['reached']}{conversion} · "
+            f"{_duration(state['time_p50_s'])} (p90 {_duration(state['time_p90_s'])}) · "
+            f"ждут {state['idle']}"
+        )
+    if report['generations']:
+        lines += ["", "⚙️ Генерации:"]
+        for generation in report['generations']:
+            lines.append(
+                f"{generation['kind']}: {generation['calls']}, ошибок {generation['error_rate'] * 100:.1f}% · "
+                f"{_duration(generation['p50_s'])} (p90 {_duration(generation['p90_s'])})"
+            )
+    if len(lines) == 2:
+        lines.append("Событий пока нет.")
+    lines += [
+        "",
+        f"% — дошли до следующего шага; «ждут» — без движения больше {report['idle_hours']:.0f} ч",
+    ]
+    return '\n'.join(lines)
+
+def funnel_command(update: Update, context: CallbackContext) -> None:
+    """/funnel - admins only, silently ignored for everyone else."""
+    if not is_admin(update.effective_user.id):
+        return
+    rollup()
+    update.message.reply_text(format_report(funnel_report(current_tenant())))
+
+def rollup_job(context: CallbackContext) -> None:
+    try:
+        rollup()
+    except Exception as e:
+        logger.error(f"Analytics rollup failed: {e}", exc_info=True)
+
+def record_generations() -> None:
+    """Record the outcome of every generation this process runs."""
+    if _record_generation not in generation_flight.hooks:
+        generation_flight.hooks.append(_record_generation)
+
+def install_analytics(dispatcher: Dispatcher, group: int = 0) -> None:
+    """Register /funnel and record the outcome of every generation."""
+    # Rolls up first, which can take a moment after a busy spell
+    dispatcher.add_handler(CommandHandler('funnel', funnel_command, run_async=True), group=group)
+    record_generations()
+
+def schedule_analytics(job_queue) -> None:
+    """Register the periodic rollup; one covers every tenant."""
+    if ANALYTICS_ROLLUP_MINUTES <= 0:
+        logger.info("Analytics rollup job disabled")
+        return
+    job_queue.run_repeating(rollup_job, interval=ANALYTICS_ROLLUP_MINUTES * 60, first=60, name='analytics_rollup')
+    logger.info(f"Analytics rollup scheduled every {ANALYTICS_ROLLUP_MINUTES} min")
@@ -0,0 +1,392 @@
+"""HTTP generation API on the Flask app, for the CMS: /api/v1.
+
+The same plan, post and repackaging generation as the bot, without Telegram:
+
+    POST /api/v1/jobs               {"kind": "plan", "profile": {...}, "days": 14}
+                                    -> 202 {"id": ..., "status": "queued", ...} at once
+    GET  /api/v1/jobs/<id>          status, and the result once done
+    GET  /api/v1/jobs/<id>/events   server-sent events: status, token, result or error
+
+A post job also takes "content_plan", "days" and "post_number"; profile fields
+are the ones the bot asks for (PROFILE_FIELDS). Requests carry a key from
+API_KEYS (Authorization: Bearer <key>), JSON or a path to a JSON file:
+
+    {"3f9a...": {"name": "cms", "rate_per_minute": 30, "burst": 10, "tenant": "acme"}}
+
+Each key has a token bucket for new jobs (429 with Retry-After when it is
+empty) and at most API_MAX_PENDING jobs queued or running; both are counted
+per process. Jobs run on API_WORKERS threads of the process that accepted
+them, in the key's tenant, and are stored in api_jobs, so any process answers
+a status request. A key's tenant must be in TENANTS, whose models and routes
+the API uses without running the bots. Token events come only from the process running the job;
+elsewhere the stream carries status and result, from the database.
+
+A stream holds its connection until the job ends: with more than a few at
+once, run gunicorn with threaded workers (--worker-class gthread). To load
+test locally: `python benchmarks.py api` (fake generation, no network).
+"""
+import os
+import hmac
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from flask import Blueprint, Response, jsonify, request, url_for
+from backends import _load_json_setting
+from database import DB_PATH, init_db, tenant_scope
+from prompts import (
+    DEFAULT_PLAN_DAYS, MAX_PLAN_DAYS, MIN_PLAN_DAYS, extract_plan_post, generate_content_plan,
+    generate_post, generate_product_repackaging, streaming
+)
+from ratelimit import TokenBucket
+from tenants import get_tenant, load_tenants, register
+import metrics
+
+logger = logging.getLogger(__name__)
+
+API_WORKERS = int(os.getenv('API_WORKERS', '8'))
+API_RATE_PER_MINUTE = float(os.getenv('API_RATE_PER_MINUTE', '30'))
+API_BURST = int(os.getenv('API_BURST', '10'))
+API_MAX_PENDING = int(os.getenv('API_MAX_PENDING', '20'))
+API_MAX_BODY_BYTES = int(os.getenv('API_MAX_BODY_BYTES', str(256 * 1024)))
+API_MAX_FIELD_CHARS = int(os.getenv('API_MAX_FIELD_CHARS', '5000'))
+API_MAX_PLAN_CHARS = int(os.getenv('API_MAX_PLAN_CHARS', '100000'))
+# A finished job's events stay in memory this long for late or resumed streams
+API_EVENTS_TTL_SECONDS = 300
+KEEPALIVE_SECONDS = 15
+POLL_SECONDS = 1.0
+
+PROFILE_FIELDS = (
+    'topic', 'audience', 'monetization', 'product_details', 'preferences', 'style', 'emotions',
+    # Product repackaging answers
+    'tool', 'result',
+)
+REQUIRED_FIELDS = {
+    'plan': ('topic', 'audience'),
+    'post': ('topic', 'audience'),
+    'repackaging': ('audience', 'tool', 'result'),
+}
+FINISHED = ('done', 'failed')
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+class ApiKey:
+    """A client of the API and its limits."""
+
+    def __init__(self, name: str, rate_per_minute: float = API_RATE_PER_MINUTE, burst: int = API_BURST,
+                 max_pending: int = API_MAX_PENDING, tenant: str = ''):
+        self.name = name
+        self.tenant = tenant
+        self.max_pending = max_pending
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self.pending = 0
+
+_keys: Optional[Dict[str, ApiKey]] = None
+_keys_lock = threading.Lock()
+
+def _api_keys() -> Dict[str, ApiKey]:
+    global _keys
+    if _keys is None:
+        with _keys_lock:
+            if _keys is None:
+                _keys = {
+                    secret: ApiKey(**{'name': secret[:6], **options})
+                    for secret, options in _load_json_setting('API_KEYS').items()
+                }
+    return _keys
+
+def _authenticate() -> Optional[ApiKey]:
+    header = request.headers.get('Authorization', '')
+    secret = header[len('Bearer '):].strip() if header.startswith('Bearer ') else ''
+    for candidate, key in _api_keys().items():
+        if secret and hmac.compare_digest(candidate.encode(), secret.encode()):
+            return key
+    return None
+
+def _error(status: int, message: str, **headers) -> Response:
+    response = jsonify({'error': message})
+    response.status_code = status
+    response.headers.update(headers)
+    return response
+
+def _validate(body: Any) -> Dict[str, Any]:
+    """The job request in `body`, checked; ValueError says what's wrong."""
+    if not isinstance(body, dict):
+        raise ValueError("Body must be a JSON object")
+    kind = body.get('kind')
+    if kind not in REQUIRED_FIELDS:
+        raise ValueError(f"kind must be one of {sorted(REQUIRED_FIELDS)}")
+    profile = body.get('profile')
+    if not isinstance(profile, dict):
+        raise ValueError("profile must be an object")
+    unknown = set(profile) - set(PROFILE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown profile fields {sorted(unknown)}, known: {list(PROFILE_FIELDS)}")
+    for field, value in profile.items():
+        if not isinstance(value, str) or len(value) > API_MAX_FIELD_CHARS:
+            raise ValueError(f"profile.{field} must be a string of at most {API_MAX_FIELD_CHARS} characters")
+    missing = [field for field in REQUIRED_FIELDS[kind] if not (profile.get(field) or '').strip()]
+    if missing:
+        raise ValueError(f"A {kind} job needs profile fields {missing}")
+    job = {'kind': kind, 'profile': profile}
+    if kind == 'repackaging':
+        return job
+
+    days = body.get('days', DEFAULT_PLAN_DAYS)
+    if isinstance(days, bool) or not isinstance(days, int) or not (MIN_PLAN_DAYS <= days <= MAX_PLAN_DAYS):
+        raise ValueError(f"days must be a whole number from {MIN_PLAN_DAYS} to {MAX_PLAN_DAYS}")
+    job['days'] = days
+    if kind == 'post':
+        content_plan, post_number = body.get('content_plan'), body.get('post_number')
+        if not isinstance(content_plan, str) or not content_plan.strip() or len(content_plan) > API_MAX_PLAN_CHARS:
+            raise ValueError(f"A post job needs content_plan, a string of at most {API_MAX_PLAN_CHARS} characters")
+        if isinstance(post_number, bool) or not isinstance(post_number, int) or not (1 <= post_number <= days):
+            raise ValueError(f"post_number must be a whole number from 1 to days ({days})")
+        # Raises if the plan has no entry for that day
+        extract_plan_post(content_plan, post_number, days)
+        job.update(content_plan=content_plan, post_number=post_number)
+    return job
+
+def _generate(job: Dict[str, Any]) -> str:
+    profile = dict(job['profile'])
+    if job['kind'] == 'plan':
+        return generate_content_plan(profile, job['days'])
+    if job['kind'] == 'post':
+        profile.update(content_plan=job['content_plan'], plan_days=job['days'])
+        return generate_post(profile, job['post_number'])
+    return generate_product_repackaging(profile)
+
+def _execute(sql: str, params: tuple) -> None:
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        with conn:
+            conn.execute(sql, params)
+    finally:
+        if conn:
+            conn.close()
+
+def _load_job(key: ApiKey, job_id: str) -> Optional[Dict[str, Any]]:
+    """The job as the API shows it, if it is one of `key`'s."""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('''
+            SELECT id, kind, status, result, error, created_at, started_at, finished_at
+            FROM api_jobs WHERE id = ? AND api_key = ? AND tenant_id = ?
+        ''', (job_id, key.name, key.tenant)).fetchone()
+    finally:
+        if conn:
+            conn.close()
+    if row is None:
+        return None
+    job = {name: row[name] for name in ('id', 'kind', 'status', 'created_at', 'started_at', 'finished_at')}
+    if row['status'] == 'done':
+        job['result'] = row['result']
+    elif row['status'] == 'failed':
+        job['error'] = row['error']
+    return job
+
+class Job:
+    """A job running in this process and the events of its stream, in order."""
+
+    def __init__(self, job_id: str, key: ApiKey, request: Dict[str, Any]):
+        self.id = job_id
+        self.key = key
+        self.request = request
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.finished_at: Optional[float] = None
+        self._condition = threading.Condition()
+
+    def publish(self, event: str, data: Dict[str, Any], last: bool = False) -> None:
+        with self._condition:
+            self.events.append((event, data))
+            if last:
+                self.finished_at = time.monotonic()
+            self._condition.notify_all()
+
+    def wait_events(self, start: int, timeout: float) -> Tuple[List[Tuple[str, Dict[str, Any]]], bool]:
+        """Events from index `start` on, waiting up to `timeout` for one; and whether the job is over."""
+        with self._condition:
+            if len(self.events) <= start and self.finished_at is None:
+                self._condition.wait(timeout)
+            return self.events[start:], self.finished_at is not None
+
+# job id -> Job, for jobs of this process running or recently finished
+_jobs: Dict[str, Job] = {}
+_jobs_lock = threading.Lock()
+_executor = ThreadPoolExecutor(API_WORKERS, thread_name_prefix='api-job')
+
+def _forget_finished_jobs() -> None:
+    now = time.monotonic()
+    with _jobs_lock:
+        for job_id in [job_id for job_id, job in _jobs.items()
+                       if job.finished_at is not None and now - job.finished_at > API_EVENTS_TTL_SECONDS]:
+            del _jobs[job_id]
+
+def _run(job: Job) -> None:
+    started = time.monotonic()
+    def on_token(task: str, text: str) -> None:
+        job.publish('token', {'task': task, 'text': text})
+
+    status, data = 'failed', {'status': 'failed', 'error': "Generation failed"}
+    try:
+        _execute("UPDATE api_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE id = ?", (job.id,))
+        job.publish('status', {'status': 'running'})
+        with tenant_scope(job.key.tenant), streaming(on_token):
+            result = _generate(job.request)
+        _execute('''
+            UPDATE api_jobs SET status = 'done', result = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (result, job.id))
+        metrics.incr('api.jobs.done')
+        status, data = 'done', {'status': 'done', 'result': result}
+    except Exception as e:
+        logger.error(f"API job {job.id} ({job.request['kind']} for {job.key.name}) failed: {e}")
+        metrics.incr('api.jobs.failed')
+        _execute('''
+            UPDATE api_jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (data['error'], job.id))
+    finally:
+        with _keys_lock:
+            job.key.pending -= 1
+        metrics.incr('api.jobs.ms', int((time.monotonic() - started) * 1000))
+        # Streams end even when the database couldn't be updated
+        job.publish('result' if status == 'done' else 'error', data, last=True)
+
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _job_stream(job: Job, start: int) -> Iterator[str]:
+    index = start
+    while True:
+        events, finished = job.wait_events(index, KEEPALIVE_SECONDS)
+        if not events and not finished:
+            yield ": keep-alive\n\n"
+        for event, data in events:
+            yield _sse(event, data, index)
+            index += 1
+        if finished:
+            return
+
+def _polled_stream(key: ApiKey, job_id: str) -> Iterator[str]:
+    """Stream of a job running in another process (or finished long ago): status and result only."""
+    status = None
+    waited = 0.0
+    while True:
+        job = _load_job(key, job_id)
+        if job is None:
+            return
+        if job['status'] != status:
+            status = job['status']
+            waited = 0.0
+            if status == 'done':
+                yield _sse('result', {'status': status, 'result': job['result']})
+            elif status == 'failed':
+                yield _sse('error', {'status': status, 'error': job['error']})
+            else:
+                yield _sse('status', {'status': status})
+        if status in FINISHED:
+            return
+        time.sleep(POLL_SECONDS)
+        waited += POLL_SECONDS
+        if waited >= KEEPALIVE_SECONDS:
+            waited = 0.0
+            yield ": keep-alive\n\n"
+
+@api.record_once
+def _setup(state) -> None:
+    init_db()
+    # The tenants' models and routes, without running their bots
+    for tenant in load_tenants():
+        if get_tenant(tenant.id) is None:
+            register(tenant)
+    unknown = sorted(key.name for key in _api_keys().values() if key.tenant and get_tenant(key.tenant) is None)
+    if unknown:
+        raise ValueError(f"API keys {unknown} belong to tenants missing from TENANTS")
+
+@api.route('/jobs', methods=['POST'])
+def create_job():
+    key = _authenticate()
+    if key is None:
+        return _error(401, "Missing or unknown API key")
+    if (request.content_length or 0) > API_MAX_BODY_BYTES:
+        return _error(413, f"Body over {API_MAX_BODY_BYTES} bytes")
+    try:
+        job_request = _validate(request.get_json(silent=True))
+    except ValueError as e:
+        return _error(400, str(e))
+
+    with _keys_lock:
+        if key.pending >= key.max_pending:
+            metrics.incr('api.rate_limited')
+            return _error(429, f"{key.max_pending} jobs already queued or running", **{'Retry-After': '5'})
+        if not key.bucket.try_acquire():
+            metrics.incr('api.rate_limited')
+            retry_after = max(1, int(key.bucket.time_until() + 0.999))
+            return _error(429, "Rate limit exceeded", **{'Retry-After': str(retry_after)})
+        key.pending += 1
+
+    job = Job(uuid.uuid4().hex, key, job_request)
+    try:
+        _execute('''
+            INSERT INTO api_jobs (id, tenant_id, api_key, kind, request, status) VALUES (?, ?, ?, ?, ?, 'queued')
+        ''', (job.id, key.tenant, key.name, job_request['kind'], json.dumps(job_request, ensure_ascii=False)))
+    except Exception:
+        with _keys_lock:
+            key.pending -= 1
+        raise
+    job.publish('status', {'status': 'queued'})
+    _forget_finished_jobs()
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _executor.submit(_run, job)
+    metrics.incr('api.jobs.created')
+    logger.info(f"API job {job.id}: {job_request['kind']} for {key.name}")
+
+    response = jsonify({
+        'id': job.id,
+        'status': 'queued',
+        'status_url': url_for('api.get_job', job_id=job.id),
+        'events_url': url_for('api.job_events', job_id=job.id),
+    })
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.get_job', job_id=job.id)
+    return response
+
+@api.route('/jobs/<job_id>')
+def get_job(job_id: str):
+    key = _authenticate()
+    if key is None:
+        return _error(401, "Missing or unknown API key")
+    job = _load_job(key, job_id)
+    if job is None:
+        return _error(404, "No such job")
+    return jsonify(job)
+
+@api.route('/jobs/<job_id>/events')
+def job_events(job_id: str):
+    """Server-sent events of a job; Last-Event-ID resumes a dropped stream."""
+    key = _authenticate()
+    if key is None:
+        return _error(401, "Missing or unknown API key")
+    if _load_job(key, job_id) is None:
+        return _error(404, "No such job")
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        start = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+        stream = _job_stream(job, start)
+    else:
+        stream = _polled_stream(key, job_id)
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Proxies such as nginx would otherwise hold the events back
+        'X-Accel-Buffering': 'no',
+    })
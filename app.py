@@ -3,7 +3,8 @@ import os
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 import logging
-from main import run_telegram_bot
+import metrics
+from api import api
 
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG)
@@ -34,17 +35,32 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 # Initialize SQLAlchemy with app
 db.init_app(app)
 
+# HTTP generation API for the CMS (see api.py)
+app.register_blueprint(api)
+
 # Basic route for health check
 @app.route('/')
 def home():
     return render_template('index.html')
 
+# Process-local counters (single-flight coalescing etc.)
+@app.route('/metrics')
+def metrics_view():
+    return jsonify(metrics.snapshot())
+
+# Conversation funnel from the analytics rollups; ?tenant=<id> for a tenant's bot
+@app.route('/analytics/funnel')
+def funnel_view():
+    from analytics import funnel_report  # imports telegram, so only when asked
+    return jsonify(funnel_report(request.args.get('tenant', '')))
+
 #Webhook route (added based on intention)
 @app.route('/webhook', methods=['POST'])
 def webhook():
     if request.method == 'POST':
         update = request.get_json()
         #process update and log it
+        from main import run_telegram_bot  # main imports this module, so import lazily
         run_telegram_bot(update) #Pass update to bot processing function in main.py.  Assumes this function exists.
         return jsonify({'status': 'success'})
     else:
@@ -0,0 +1,621 @@
+"""asyncio runtime: one event loop serves every chat and generation awaits AsyncOpenAI.
+
+Questionnaire steps reuse the synchronous handlers from handlers.py through
+small adapters; their only I/O is reply_text, which is queued here and sent
+asynchronously. Steps that read the saved profile run the same handlers in a
+thread; there context.bot and reply_document call the Bot API on the loop and
+wait for the answer (plan documents, channel exports). Steps that wait on the
+network (subscription check and the generators) have async counterparts
+below built from the same helpers.
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from telegram.error import BadRequest
+from telegram.ext import ConversationHandler, DispatcherHandlerStop
+import handlers
+import history
+import documents
+import metrics
+import prompts
+import database
+from database import init_db, save_user_data, save_user_preferences, get_user_data
+from sessions import (
+    SESSION_IDLE_SECONDS, MAX_SESSIONS, SESSION_SPILL, EVICTION_INTERVAL_SECONDS, SPILL_BATCH_SIZE,
+    EXPIRED_SESSION_TEXT, restore_session, spill_sessions
+)
+from handlers import (
+    SUBSCRIPTION_CHECK, MAIN_MENU, TOPIC, AUDIENCE, MONETIZATION,
+    PRODUCT_DETAILS, PREFERENCES, STYLE, EMOTIONS,
+    EXAMPLES, POST_NUMBER, REPACKAGE_AUDIENCE, REPACKAGE_TOOL, REPACKAGE_RESULT,
+    PROFILE_CHOICE, PLAN_EDIT
+)
+from utils import subscription_channel, create_main_menu_keyboard
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30
+MAX_CONNECTIONS = int(os.getenv('ASYNC_BOT_MAX_CONNECTIONS', '100'))
+# Name of the conversation in main.py: sessions spilled by either runtime are restored by the other
+CONVERSATION_NAME = 'main_conversation'
+
+class AsyncBotClient:
+    """Tiny Bot API client on top of httpx (already installed with openai)."""
+
+    def __init__(self, token: str, base_url: Optional[str] = None, base_file_url: Optional[str] = None):
+        import httpx
+        self.url = f"{base_url or 'https://api.telegram.org/bot'}{token}"
+        self.file_url = f"{base_file_url or 'https://api.telegram.org/file/bot'}{token}"
+        self._http = httpx.AsyncClient(
+            timeout=POLL_TIMEOUT + 10,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS)
+        )
+
+    async def call(self, method: str, files: Optional[Dict[str, Tuple[str, bytes]]] = None, **params) -> Any:
+        if files:
+            # Multipart form: every other parameter as a string
+            response = await self._http.post(f"{self.url}/{method}", files=files,
+                                             data={key: str(value) for key, value in params.items()})
+        else:
+            response = await self._http.post(f"{self.url}/{method}", json=params)
+        payload = response.json()
+        if not payload.get('ok'):
+            if payload.get('error_code') == 400:
+                raise BadRequest(payload.get('description') or f"{method} failed")
+            raise RuntimeError(f"{method} failed: {payload.get('description')}")
+        return payload['result']
+
+    async def download(self, file_path: str, custom_path: str) -> str:
+        async with self._http.stream('GET', f"{self.file_url}/{file_path}") as response:
+            response.raise_for_status()
+            with open(custom_path, 'wb') as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+        return custom_path
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+class _Message:
+    def __init__(self, update: '_Update', data: Dict[str, Any]):
+        self._update = update
+        self.text = data.get('text')
+        self.caption = data.get('caption')
+        forwarded = data.get('forward_from_chat')
+        self.forward_from_chat = SimpleNamespace(title=forwarded.get('title')) if forwarded else None
+        document = data.get('document')
+        self.document = SimpleNamespace(
+            file_id=document.get('file_id'), file_name=document.get('file_name'),
+            file_size=document.get('file_size')
+        ) if document else None
+
+    def reply_text(self, text: str, parse_mode: Optional[str] = None, reply_markup=None) -> None:
+        params = {'chat_id': self._update.effective_chat.id, 'text': text}
+        if parse_mode is not None:
+            params['parse_mode'] = parse_mode
+        if reply_markup is not None:
+            params['reply_markup'] = reply_markup.to_dict()
+        self._update.outbox.append(('sendMessage', params))
+
+    def reply_document(self, document, filename: Optional[str] = None, caption: Optional[str] = None):
+        """Only in threaded handlers: waits for the upload, whose file_id the caller keeps."""
+        params = {'chat_id': self._update.effective_chat.id}
+        if caption is not None:
+            params['caption'] = caption
+        if isinstance(document, str):
+            result = self._update.bot.call('sendDocument', document=document, **params)
+        else:
+            result = self._update.bot.call('sendDocument', files={'document': (filename or 'document', document.read())},
+                                           **params)
+        return SimpleNamespace(document=SimpleNamespace(file_id=(result.get('document') or {}).get('file_id')))
+
+class _CallbackQuery:
+    def __init__(self, update: '_Update', data: Dict[str, Any]):
+        self._update = update
+        self.id = data['id']
+        self.data = data.get('data')
+        self.message = _Message(update, data.get('message') or {})
+
+    def answer(self) -> None:
+        self._update.outbox.append(('answerCallbackQuery', {'callback_query_id': self.id}))
+
+class _Update:
+    """The subset of telegram.Update that handlers.py uses, built from raw JSON."""
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.outbox: List[Tuple[str, Dict[str, Any]]] = []
+        # _ThreadBot, set by the runtime
+        self.bot: Optional['_ThreadBot'] = None
+        message = raw.get('message')
+        callback = raw.get('callback_query')
+        source = message or (callback or {}).get('message') or {}
+        user = (message or callback or {}).get('from') or {}
+        self.effective_chat = SimpleNamespace(id=(source.get('chat') or {}).get('id', user.get('id')))
+        self.effective_user = SimpleNamespace(id=user.get('id'))
+        self.message = _Message(self, message) if message else None
+        self.callback_query = _CallbackQuery(self, callback) if callback else None
+        self.effective_message = self.message or (self.callback_query.message if self.callback_query else None)
+
+class _PrefetchedMemberBot:
+    """Stands in for context.bot after the membership was fetched asynchronously."""
+
+    def __init__(self, status: str):
+        self.status = status
+
+    def get_chat_member(self, chat_id, user_id):
+        return SimpleNamespace(status=self.status)
+
+class _File:
+    def __init__(self, bot: '_ThreadBot', data: Dict[str, Any]):
+        self._bot = bot
+        self.file_id = data.get('file_id')
+        self.file_size = data.get('file_size')
+        self.file_path = data.get('file_path')
+
+    def download(self, custom_path: str) -> str:
+        return self._bot.run(self._bot.runtime.client.download(self.file_path, custom_path))
+
+class _ThreadBot:
+    """context.bot of threaded handlers: Bot API calls run on the loop, the thread waits.
+
+    Replies queued so far are sent first, keeping them in order. Calling it
+    from the loop itself would deadlock.
+    """
+
+    def __init__(self, runtime: 'AsyncBotRuntime', update: '_Update', loop: asyncio.AbstractEventLoop):
+        self.runtime = runtime
+        self.update = update
+        self.loop = loop
+
+    def run(self, coro) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def call(self, method: str, **params) -> Any:
+        self.run(self.runtime.flush(self.update))
+        return self.run(self.runtime.client.call(method, **params))
+
+    def get_file(self, file_id: str) -> _File:
+        return _File(self, self.call('getFile', file_id=file_id))
+
+def _threaded(callback):
+    """Run a sync handler that reads the database off the event loop."""
+    async def run(update: _Update, context):
+        return await asyncio.to_thread(callback, update, context)
+
+    run.__name__ = callback.__name__
+    return run
+
+PLAN_DOCUMENT_PATTERN = f"^plan_doc_({'|'.join(documents.DOCUMENT_FORMATS)})$"
+
+def plan_document_button(update: _Update, context) -> None:
+    """documents.plan_document_button; the conversation stays in its state."""
+    try:
+        documents.plan_document_button(update, context)
+    except DispatcherHandlerStop:
+        pass
+
+class _Session:
+    __slots__ = ('user_id', 'state', 'user_data', 'lock', 'in_flight', 'last_seen', 'loaded')
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.state = None
+        self.user_data: Dict[str, Any] = {}
+        self.lock = asyncio.Lock()
+        self.in_flight: Optional[str] = None
+        self.last_seen = time.monotonic()
+        # False until a spilled copy was looked for
+        self.loaded = False
+
+class AsyncBotRuntime:
+    """Routes updates like main.build_conversation_handler, on one event loop.
+
+    Sessions are bounded like sessions.SessionManager bounds the dispatcher's:
+    idle ones and the least recently used beyond max_sessions are spilled to
+    the database (or dropped, and the user told on return).
+    """
+
+    def __init__(self, client: AsyncBotClient, idle_seconds: float = SESSION_IDLE_SECONDS,
+                 max_sessions: int = MAX_SESSIONS, spill: bool = SESSION_SPILL):
+        self.client = client
+        # chat_id -> session, least recently used first
+        self.sessions: 'OrderedDict[int, _Session]' = OrderedDict()
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.spill = spill
+        # Dropped sessions that had an active conversation, to explain the reset
+        self._expired: 'OrderedDict[int, None]' = OrderedDict()
+        # Held while spilling, so a returning user can't read a half-written spill
+        self._spill_lock = asyncio.Lock()
+        self._next_eviction = time.monotonic() + EVICTION_INTERVAL_SECONDS
+        self._tasks = set()
+        self.callback_routes = {
+            SUBSCRIPTION_CHECK: [('^check_subscription$', self.check_subscription_button)],
+            MAIN_MENU: [('', _threaded(handlers.handle_main_menu))],
+            TOPIC: [('^start_work$', handlers.button_handler)],
+            MONETIZATION: [('^(advertising|products|services|consulting)$', handlers.button_handler)],
+            STYLE: [('^(aggressive|business|humorous|custom)$', handlers.button_handler)],
+            EXAMPLES: [('^(add_example|finish_examples)$', handlers.button_handler),
+                       (r'^plan_days_\d+$', self.content_plan)],
+            POST_NUMBER: [('^(new_plan|edit_plan)$', _threaded(handlers.button_handler)),
+                          (PLAN_DOCUMENT_PATTERN, _threaded(plan_document_button))],
+            PROFILE_CHOICE: [('^(reuse_profile|fresh_profile|show_plan|edit_plan)$',
+                              _threaded(handlers.button_handler)),
+                             (PLAN_DOCUMENT_PATTERN, _threaded(plan_document_button))],
+            PLAN_EDIT: [(r'^regen_phase_\w+$', self.plan_edit)],
+        }
+        self.text_routes = {
+            TOPIC: handlers.text_handler,
+            AUDIENCE: handlers.text_handler,
+            PRODUCT_DETAILS: handlers.text_handler,
+            PREFERENCES: handlers.text_handler,
+            STYLE: handlers.text_handler,
+            EMOTIONS: handlers.text_handler,
+            EXAMPLES: handlers.text_handler,
+            POST_NUMBER: self.post_number,
+            REPACKAGE_AUDIENCE: handlers.handle_repackage,
+            REPACKAGE_TOOL: handlers.handle_repackage,
+            REPACKAGE_RESULT: self.repackage_result,
+            PLAN_EDIT: self.plan_edit,
+        }
+        # Channel exports (result.json), like Filters.document.file_extension('json') in main.py
+        self.document_routes = {
+            EXAMPLES: _threaded(handlers.handle_example_export),
+        }
+        self.generation_steps = {self.content_plan, self.post_number, self.repackage_result, self.plan_edit}
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, update: _Update) -> None:
+        """Send everything the handlers replied so far, in order."""
+        while update.outbox:
+            method, params = update.outbox.pop(0)
+            try:
+                await self.client.call(method, **params)
+            except Exception as e:
+                logger.error(f"Error calling {method}: {e}")
+
+    def _route(self, state, update: _Update):
+        message = update.message
+        if message and message.text and message.text.startswith('/'):
+            command = message.text.split()[0][1:].split('@')[0]
+            if command == 'start':
+                return self.start
+            if command == 'cancel' and state is not None:
+                return handlers.cancel
+            return None
+        if state is None:
+            return None
+        if update.callback_query:
+            for pattern, callback in self.callback_routes.get(state, []):
+                if re.match(pattern, update.callback_query.data or ''):
+                    return callback
+            return None
+        if message and message.document:
+            if (message.document.file_name or '').lower().endswith('.json'):
+                return self.document_routes.get(state)
+            return None
+        if message and (message.text or (state == EXAMPLES and message.forward_from_chat)):
+            return self.text_routes.get(state)
+        return None
+
+    @staticmethod
+    def _apply_state(session: _Session, new_state) -> None:
+        if new_state == ConversationHandler.END:
+            session.state = None
+        elif new_state is not None:
+            session.state = new_state
+
+    def _session(self, update: _Update) -> _Session:
+        chat_id = update.effective_chat.id
+        session = self.sessions.get(chat_id)
+        if session is None:
+            session = self.sessions[chat_id] = _Session(update.effective_user.id)
+        session.last_seen = time.monotonic()
+        self.sessions.move_to_end(chat_id)
+        if session.last_seen >= self._next_eviction or len(self.sessions) > self.max_sessions:
+            self._spawn(self.evict())
+        return session
+
+    async def _load(self, chat_id: int, session: _Session, update: _Update) -> bool:
+        """Bring back a spilled session. False if the update only gets the expiry notice."""
+        session.loaded = True
+        if not self.spill:
+            expired = chat_id in self._expired
+            self._expired.pop(chat_id, None)
+            text = update.message.text if update.message else ''
+            if expired and not (text or '').startswith('/start'):
+                update.effective_message.reply_text(EXPIRED_SESSION_TEXT)
+                return False
+            return True
+        async with self._spill_lock:
+            state, data = await asyncio.to_thread(
+                restore_session, database.DB_PATH, CONVERSATION_NAME, (chat_id, session.user_id)
+            )
+        if data and not session.user_data:
+            session.user_data.update(data)
+        if state is not None and session.state is None:
+            session.state = state
+        return True
+
+    async def evict(self, now: Optional[float] = None) -> int:
+        """Evict idle sessions and the oldest ones above the cap. Returns the count."""
+        now = time.monotonic() if now is None else now
+        self._next_eviction = now + EVICTION_INTERVAL_SECONDS
+        overflow = len(self.sessions) - self.max_sessions
+        evicted = {}
+        for chat_id, session in list(self.sessions.items()):
+            if overflow <= 0 and now - session.last_seen < self.idle_seconds:
+                break
+            # Being handled, waited for, or generating
+            if session.lock.locked() or session.in_flight is not None:
+                continue
+            del self.sessions[chat_id]
+            evicted[chat_id, session.user_id] = (session.state, session.user_data)
+            overflow -= 1
+        if not evicted:
+            return 0
+
+        if self.spill:
+            keys = list(evicted)
+            async with self._spill_lock:
+                for start in range(0, len(keys), SPILL_BATCH_SIZE):
+                    batch = {key: evicted[key] for key in keys[start:start + SPILL_BATCH_SIZE]}
+                    await asyncio.to_thread(spill_sessions, database.DB_PATH, CONVERSATION_NAME, batch)
+        else:
+            for (chat_id, _), (state, _) in evicted.items():
+                if state is not None:
+                    self._expired[chat_id] = None
+            while len(self._expired) > self.max_sessions * 10:
+                self._expired.popitem(last=False)
+
+        metrics.incr('sessions.evicted', len(evicted))
+        logger.info(f"Evicted {len(evicted)} idle sessions, {len(self.sessions)} in memory")
+        return len(evicted)
+
+    async def handle_update(self, raw: Dict[str, Any]) -> None:
+        update = _Update(raw)
+        session = self._session(update)
+        update.bot = _ThreadBot(self, update, asyncio.get_running_loop())
+        context = SimpleNamespace(user_data=session.user_data, bot=update.bot)
+        try:
+            async with session.lock:
+                if not session.loaded and not await self._load(update.effective_chat.id, session, update):
+                    await self.flush(update)
+                    return
+                if session.in_flight is not None:
+                    self._handle_while_generating(update, context, session)
+                    await self.flush(update)
+                    return
+
+                callback = self._route(session.state, update)
+                if callback is None:
+                    return
+                if callback in self.generation_steps:
+                    # Runs outside the lock; later updates see in_flight instead
+                    session.in_flight = handlers.generation_key(update, context) or 'generation'
+                    self._spawn(self._run_generation(callback, update, context, session))
+                    return
+                if asyncio.iscoroutinefunction(callback):
+                    new_state = await callback(update, context)
+                else:
+                    new_state = callback(update, context)
+                await self.flush(update)
+                self._apply_state(session, new_state)
+        except Exception as e:
+            logger.error(f"Error handling update: {e}", exc_info=True)
+
+    async def _run_generation(self, callback, update: _Update, context, session: _Session) -> None:
+        new_state = None
+        try:
+            new_state = await callback(update, context)
+            await self.flush(update)
+        except Exception as e:
+            logger.error(f"Error in generation step: {e}", exc_info=True)
+        finally:
+            session.in_flight = None
+        self._apply_state(session, new_state)
+
+    def _handle_while_generating(self, update: _Update, context, session: _Session) -> None:
+        """Same policy as handlers.handle_while_generating."""
+        if update.callback_query:
+            update.callback_query.answer()
+        key = handlers.generation_key(update, context)
+        if key is not None and key == session.in_flight:
+            metrics.incr('generation.coalesced')
+            return
+        metrics.incr('generation.conflicts')
+        update.effective_message.reply_text(handlers.STILL_WORKING_TEXT)
+
+    async def _member_status(self, user_id: int) -> str:
+        channel = subscription_channel()
+        if not channel:
+            return 'member'
+        try:
+            member = await self.client.call('getChatMember', chat_id=channel, user_id=user_id)
+            return member.get('status', 'left')
+        except Exception as e:
+            logger.error(f"Subscription check error for user {user_id}: {e}")
+            return 'left'
+
+    async def start(self, update: _Update, context) -> int:
+        context.bot = _PrefetchedMemberBot(await self._member_status(update.effective_user.id))
+        return handlers.start(update, context)
+
+    async def check_subscription_button(self, update: _Update, context) -> int:
+        context.bot = _PrefetchedMemberBot(await self._member_status(update.effective_user.id))
+        return handlers.button_handler(update, context)
+
+    async def content_plan(self, update: _Update, context) -> Optional[int]:
+        query = update.callback_query
+        query.answer()
+        user_data = context.user_data
+        missing_fields = handlers.missing_plan_fields(user_data)
+        if missing_fields:
+            logger.error(f"Missing required fields: {missing_fields}")
+            query.message.reply_text(
+                "❌ Не хватает некоторых данных. Пожалуйста, начните заново с команды /start"
+            )
+            return ConversationHandler.END
+
+        days = int(query.data[len('plan_days_'):])
+        user_data['plan_days'] = days
+        query.message.reply_text(f"🔄 Генерирую контент-план на {days} дней...")
+        await self.flush(update)
+        try:
+            metrics.incr('generation.started')
+            content_plan = await prompts.agenerate_content_plan(user_data)
+            user_data['content_plan'] = content_plan
+            await asyncio.to_thread(save_user_data, update.effective_chat.id, user_data)
+            await asyncio.to_thread(history.record_plan, update.effective_chat.id, content_plan, days)
+            handlers.send_content_plan(query.message, content_plan, days)
+            user_data['waiting_for'] = 'post_number'
+            return POST_NUMBER
+        except Exception:
+            logger.exception("Error generating content plan:")
+            query.message.reply_text(
+                "❌ Произошла ошибка при генерации контент-плана. "
+                "Пожалуйста, попробуйте еще раз или начните заново с команды /start"
+            )
+            return EXAMPLES
+
+    async def post_number(self, update: _Update, context) -> Optional[int]:
+        text = (update.message.text or '').strip()
+        days = context.user_data.get('plan_days') or prompts.DEFAULT_PLAN_DAYS
+        if not (text.isdigit() and 1 <= int(text) <= days):
+            # Validation replies need no I/O, reuse the sync handler
+            return handlers.text_handler(update, context)
+
+        post_number = int(text)
+        update.message.reply_text(f"🔄 Получено число {post_number}, генерирую пост...")
+        await self.flush(update)
+        user_data = await asyncio.to_thread(get_user_data, update.effective_chat.id)
+        if not user_data or 'content_plan' not in user_data:
+            logger.error("Content plan not found in user data")
+            update.message.reply_text(
+                "❌ Ошибка: контент-план не найден. Пожалуйста, начните заново с команды /start"
+            )
+            return ConversationHandler.END
+
+        try:
+            metrics.incr('generation.started')
+            generated_post = await prompts.agenerate_post(user_data, post_number)
+            await asyncio.to_thread(
+                history.record_post, update.effective_chat.id, post_number, generated_post, user_data['content_plan']
+            )
+            handlers.send_generated_post(update.message, post_number, generated_post, days)
+        except Exception as e:
+            logger.error(f"Error generating post: {e}", exc_info=True)
+            update.message.reply_text(
+                "❌ Произошла ошибка при генерации поста. Пожалуйста, попробуйте еще раз."
+            )
+        return POST_NUMBER
+
+    async def plan_edit(self, update: _Update, context) -> Optional[int]:
+        user_data = context.user_data
+        days = user_data.get('plan_days') or prompts.DEFAULT_PLAN_DAYS
+        if update.callback_query:
+            update.callback_query.answer()
+            message = update.callback_query.message
+            first, last = prompts.plan_phases(days)[update.callback_query.data[len('regen_phase_'):]]
+            selected = list(range(first, last + 1))
+        else:
+            message = update.message
+            try:
+                selected = handlers.parse_day_selection(message.text or '', days)
+            except ValueError:
+                # Validation replies need no I/O, reuse the sync handler
+                return handlers.text_handler(update, context)
+
+        message.reply_text(
+            f"🔄 Перегенерирую дни {handlers.format_day_selection(selected)}, "
+            "остальные дни плана не изменятся..."
+        )
+        await self.flush(update)
+        try:
+            metrics.incr('generation.started')
+            content_plan = await prompts.aregenerate_plan_days(user_data, selected)
+            user_data['content_plan'] = content_plan
+            await asyncio.to_thread(save_user_data, update.effective_chat.id, user_data)
+            await asyncio.to_thread(
+                history.record_plan, update.effective_chat.id, content_plan, days,
+                handlers.format_day_selection(selected)
+            )
+            handlers.send_updated_days(message, content_plan, selected, days)
+            user_data['waiting_for'] = 'post_number'
+            return POST_NUMBER
+        except Exception:
+            logger.exception("Error regenerating plan days:")
+            message.reply_text(
+                "❌ Не удалось перегенерировать дни плана. Попробуйте ещё раз или выберите другие дни."
+            )
+            return PLAN_EDIT
+
+    async def repackage_result(self, update: _Update, context) -> int:
+        context.user_data['result'] = update.message.text
+        update.message.reply_text("🔄 Генерирую переупаковку продукта...")
+        await self.flush(update)
+        try:
+            metrics.incr('generation.started')
+            repackaged_content = await prompts.agenerate_product_repackaging(context.user_data)
+            await asyncio.to_thread(save_user_preferences, update.effective_chat.id, {
+                'saved_audience': context.user_data.get('audience'),
+                'content_theme': context.user_data.get('tool')
+            })
+            handlers.send_repackaging_result(update.message, repackaged_content)
+        except Exception as e:
+            logger.error(f"Error generating repackaged content: {e}")
+            update.message.reply_text(
+                "❌ Произошла ошибка при генерации контента. "
+                "Пожалуйста, попробуйте еще раз.",
+                reply_markup=create_main_menu_keyboard()
+            )
+        return MAIN_MENU
+
+    async def run_polling(self) -> None:
+        """Long-poll getUpdates and handle every update as its own task."""
+        offset = None
+        await self.client.call('deleteWebhook', drop_pending_updates=True)
+        logger.info("Async bot started")
+        while True:
+            try:
+                updates = await self.client.call('getUpdates', offset=offset, timeout=POLL_TIMEOUT)
+            except Exception as e:
+                logger.error(f"getUpdates failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            for raw in updates:
+                offset = raw['update_id'] + 1
+                self._spawn(self.handle_update(raw))
+
+async def run_async_bot(token: str, base_url: Optional[str] = None) -> None:
+    """Initialize the database and serve the bot until cancelled."""
+    await asyncio.to_thread(init_db)
+    client = AsyncBotClient(token, base_url)
+    try:
+        await AsyncBotRuntime(client).run_polling()
+    finally:
+        await client.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not TOKEN:
+        logger.error("Telegram bot token not found!")
+        sys.exit(1)
+    try:
+        asyncio.run(run_async_bot(TOKEN, os.getenv("TELEGRAM_API_BASE_URL") or None))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,531 @@
+"""Autoposting: publish the posts of a user's content plan to their channel.
+
+`/autopost @channel 09:00` links a channel where both the bot and the user are
+admins; from then on day N of the plan is published at 09:00 (UTC offset
+AUTOPOST_UTC_OFFSET_MINUTES) on the N-th slot. Schedules live in
+autopost_schedules with next_run_at as a unix time, and a JobQueue job polls
+the (status, next_run_at) index every AUTOPOST_POLL_SECONDS:
+
+  * due schedules are published, at most AUTOPOST_BATCH per poll;
+  * schedules due within AUTOPOST_PREFETCH_MINUTES get their post generated
+    ahead of time into autopost_posts, so the slot isn't late by a completion.
+
+Both only read rows near the front of the index, so a poll costs the same with
+ten or a hundred thousand channels. State is in the database, a restart picks
+up where it stopped; a crash between sending and saving can repeat one post.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, Unauthorized
+from telegram.ext import (
+    CallbackContext, CallbackQueryHandler, CommandHandler, Dispatcher, DispatcherHandlerStop, Filters
+)
+from database import DB_PATH, current_tenant, get_user_profile, pack_text, unpack_text
+from prompts import generate_post, get_plan_days, plan_entries
+from postprocess import html_parts
+from ratelimit import TokenBucket
+import history
+import metrics
+
+logger = logging.getLogger(__name__)
+
+AUTOPOST_POLL_SECONDS = float(os.getenv('AUTOPOST_POLL_SECONDS', '60'))
+AUTOPOST_PREFETCH_MINUTES = float(os.getenv('AUTOPOST_PREFETCH_MINUTES', '120'))
+AUTOPOST_BATCH = int(os.getenv('AUTOPOST_BATCH', '200'))
+AUTOPOST_CONCURRENCY = int(os.getenv('AUTOPOST_CONCURRENCY', '4'))
+# Posting times are given in this offset (Moscow by default)
+AUTOPOST_UTC_OFFSET_MINUTES = int(os.getenv('AUTOPOST_UTC_OFFSET_MINUTES', '180'))
+# Telegram allows about 30 messages per second overall
+AUTOPOST_RATE = float(os.getenv('AUTOPOST_RATE', '20'))
+# After a generation or network failure the slot is retried this much later
+RETRY_DELAY_SECONDS = 300
+
+TIME_PATTERN = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+CHANNEL_LINK = re.compile(r'^(?:https?://)?(?:t\.me|telegram\.me)/([A-Za-z0-9_]{5,})/?$')
+
+STATUS_LABELS = {
+    'active': 'включён',
+    'paused': 'на паузе',
+    'done': 'все посты опубликованы',
+    'error': 'остановлен из-за ошибки',
+}
+
+USAGE_TEXT = (
+    "📅 Автопостинг публикует посты вашего контент-плана в канал, по одному в день.\n\n"
+    "1. Добавьте бота в канал администратором с правом публикации сообщений.\n"
+    "2. Отправьте команду с каналом и временем публикации, например:\n"
+    "/autopost @my_channel 09:00\n\n"
+    "Время указывается в {zone}."
+)
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _zone(utc_offset: int) -> str:
+    hours, minutes = divmod(abs(utc_offset), 60)
+    sign = '+' if utc_offset >= 0 else '-'
+    return f"UTC{sign}{hours}" + (f":{minutes:02d}" if minutes else '')
+
+def _plan_hash(content_plan: str, day: int) -> str:
+    """Digest of the plan entry for `day`: editing other days keeps its post."""
+    entry = plan_entries(content_plan).get(day, '')
+    return hashlib.sha1(entry.encode('utf-8')).hexdigest()
+
+def next_run_at(post_time: str, utc_offset: int, after: float) -> int:
+    """Unix time of the first `post_time` slot (local at `utc_offset` minutes) after `after`."""
+    hours, minutes = map(int, post_time.split(':'))
+    local = int(after) + utc_offset * 60
+    slot = local - local % 86400 + hours * 3600 + minutes * 60
+    if slot <= local:
+        slot += 86400
+    return slot - utc_offset * 60
+
+def get_schedule(chat_id: int) -> Optional[Dict[str, Any]]:
+    conn = None
+    try:
+        conn = _connect()
+        row = conn.execute(
+            'SELECT * FROM autopost_schedules WHERE tenant_id = ? AND chat_id = ?', (current_tenant(), chat_id)
+        ).fetchone()
+        return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Error reading autopost schedule for {chat_id}: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def link_channel(chat_id: int, channel_id: int, channel_title: str, post_time: str,
+                 plan_days: int, utc_offset: int = AUTOPOST_UTC_OFFSET_MINUTES) -> Dict[str, Any]:
+    """Create or replace the schedule of `chat_id`, starting again from day 1."""
+    tenant_id = current_tenant()
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('DELETE FROM autopost_posts WHERE tenant_id = ? AND chat_id = ?', (tenant_id, chat_id))
+            conn.execute('''
+                INSERT OR REPLACE INTO autopost_schedules
+                    (tenant_id, chat_id, channel_id, channel_title, post_time, utc_offset, next_day,
+                     plan_days, status, next_run_at)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?, 'active', ?)
+            ''', (
+                tenant_id, chat_id, channel_id, channel_title, post_time, utc_offset, plan_days,
+                next_run_at(post_time, utc_offset, time.time())
+            ))
+        logger.info(f"Autopost for {chat_id} linked to channel {channel_id} at {post_time}")
+    finally:
+        if conn:
+            conn.close()
+    return get_schedule(chat_id)
+
+def set_schedule_status(chat_id: int, status: str) -> None:
+    """Pause or resume; resuming skips the slots missed in between."""
+    schedule = get_schedule(chat_id)
+    if not schedule:
+        return
+    run_at = schedule['next_run_at']
+    if status == 'active':
+        run_at = next_run_at(schedule['post_time'], schedule['utc_offset'], time.time())
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('''
+                UPDATE autopost_schedules SET status = ?, next_run_at = ?, last_error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE tenant_id = ? AND chat_id = ?
+            ''', (status, run_at, current_tenant(), chat_id))
+    finally:
+        if conn:
+            conn.close()
+
+def delete_schedule(chat_id: int) -> None:
+    tenant_id = current_tenant()
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('DELETE FROM autopost_posts WHERE tenant_id = ? AND chat_id = ?', (tenant_id, chat_id))
+            conn.execute('DELETE FROM autopost_schedules WHERE tenant_id = ? AND chat_id = ?', (tenant_id, chat_id))
+    finally:
+        if conn:
+            conn.close()
+
+class AutoPoster:
+    """Generates and publishes due plan posts on a small thread pool.
+
+    The schedules polled are the current tenant's; `executor` replaces the
+    pool of its own (tenants.py passes the pool shared by every tenant).
+    """
+
+    def __init__(self, bot: Bot, concurrency: int = AUTOPOST_CONCURRENCY, batch: int = AUTOPOST_BATCH,
+                 prefetch_seconds: float = AUTOPOST_PREFETCH_MINUTES * 60, rate: float = AUTOPOST_RATE,
+                 executor: Optional[Executor] = None):
+        self.bot = bot
+        self.batch = batch
+        self.prefetch_seconds = prefetch_seconds
+        self.bucket = TokenBucket(rate)
+        self.executor = executor or ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='autopost')
+        # chat_ids queued or running in the pool; a poll never submits them twice
+        self._in_flight: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def poll(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Submit due and soon-due schedules. Returns (publishing, prefetching)."""
+        now = int(now if now is not None else time.time())
+        tenant_id = current_tenant()
+        conn = None
+        try:
+            conn = _connect()
+            due = conn.execute('''
+                SELECT chat_id FROM autopost_schedules
+                WHERE status = 'active' AND next_run_at <= ? AND tenant_id = ?
+                ORDER BY next_run_at
+                LIMIT ?
+            ''', (now, tenant_id, self.batch)).fetchall()
+            upcoming = conn.execute('''
+                SELECT s.chat_id FROM autopost_schedules s
+                LEFT JOIN autopost_posts p
+                    ON p.tenant_id = s.tenant_id AND p.chat_id = s.chat_id AND p.day = s.next_day
+                WHERE s.status = 'active' AND s.next_run_at > ? AND s.next_run_at <= ? AND s.tenant_id = ?
+                    AND p.chat_id IS NULL
+                ORDER BY s.next_run_at
+                LIMIT ?
+            ''', (now, now + self.prefetch_seconds, tenant_id, self.batch)).fetchall()
+        except Exception as e:
+            logger.error(f"Error polling autopost schedules: {e}")
+            return 0, 0
+        finally:
+            if conn:
+                conn.close()
+        publishing = sum(self._submit(self.publish, row[0]) for row in due)
+        prefetching = sum(self._submit(self.prefetch, row[0]) for row in upcoming)
+        return publishing, prefetching
+
+    def poll_job(self, context: CallbackContext) -> None:
+        self.poll()
+
+    def _submit(self, task: Callable[[int], None], chat_id: int) -> bool:
+        with self._lock:
+            if chat_id in self._in_flight:
+                return False
+            self._in_flight.add(chat_id)
+
+        def run():
+            try:
+                task(chat_id)
+            except Exception as e:
+                logger.error(f"Autopost task for {chat_id} failed: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._in_flight.discard(chat_id)
+
+        self.executor.submit(run)
+        return True
+
+    def _load(self, chat_id: int) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        return get_schedule(chat_id), get_user_profile(chat_id)
+
+    def _post_text(self, chat_id: int, day: int, profile: Dict[str, Any]) -> str:
+        """The stored post for `day`, generated now if missing or made from another plan entry."""
+        plan_hash = _plan_hash(profile['content_plan'], day)
+        conn = None
+        try:
+            conn = _connect()
+            row = conn.execute(
+                'SELECT plan_hash, body FROM autopost_posts WHERE tenant_id = ? AND chat_id = ? AND day = ?',
+                (current_tenant(), chat_id, day)
+            ).fetchone()
+            if row and row['plan_hash'] == plan_hash:
+                return unpack_text(row['body'])
+            text = generate_post(profile, day)
+            metrics.incr('autopost.generated')
+            with conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO autopost_posts (tenant_id, chat_id, day, plan_hash, body, status)
+                    VALUES (?, ?, ?, ?, ?, 'ready')
+                ''', (current_tenant(), chat_id, day, plan_hash, pack_text(text)))
+            history.record_post(chat_id, day, text, profile['content_plan'])
+            return text
+        finally:
+            if conn:
+                conn.close()
+
+    def prefetch(self, chat_id: int) -> None:
+        schedule, profile = self._load(chat_id)
+        if not schedule or schedule['status'] != 'active' or not profile.get('content_plan'):
+            return
+        try:
+            self._post_text(chat_id, schedule['next_day'], profile)
+            metrics.incr('autopost.prefetched')
+        except Exception as e:
+            # publish() tries again at the slot
+            logger.warning(f"Prefetching autopost day {schedule['next_day']} for {chat_id} failed: {e}")
+
+    def publish(self, chat_id: int) -> None:
+        schedule, profile = self._load(chat_id)
+        # Paused, stopped or rescheduled since the poll
+        if not schedule or schedule['status'] != 'active' or schedule['next_run_at'] > time.time():
+            return
+        if not profile.get('content_plan'):
+            self._stop_with_error(schedule, "Контент-план не найден")
+            return
+        plan_days = get_plan_days(profile)
+        day = schedule['next_day']
+        if day > plan_days:
+            self._advance(schedule, day - 1, None, plan_days)
+            return
+
+        try:
+            text = self._post_text(chat_id, day, profile)
+        except Exception as e:
+            logger.error(f"Generating autopost day {day} for {chat_id} failed: {e}")
+            self._retry_later(chat_id, str(e), RETRY_DELAY_SECONDS)
+            return
+
+        try:
+            message_id = self._send(schedule['channel_id'], text)
+        except RetryAfter as e:
+            self.bucket.pause(e.retry_after)
+            self._retry_later(chat_id, e.message, e.retry_after)
+            return
+        except (Unauthorized, BadRequest) as e:
+            # Bot removed from the channel or lost its rights: needs the user
+            self._stop_with_error(schedule, e.message)
+            return
+        except NetworkError as e:
+            logger.warning(f"Autopost to {schedule['channel_id']} failed, retrying later: {e}")
+            self._retry_later(chat_id, str(e), RETRY_DELAY_SECONDS)
+            return
+        self._advance(schedule, day, message_id, plan_days)
+
+    def _send(self, channel_id: int, text: str) -> int:
+        """Send the post (in parts over the message limit). Returns the first message_id."""
+        message_ids = []
+        for part in html_parts(text):
+            self.bucket.acquire()
+            message = self.bot.send_message(chat_id=channel_id, text=part, parse_mode=ParseMode.HTML)
+            message_ids.append(message.message_id)
+        return message_ids[0]
+
+    def _advance(self, schedule: Dict[str, Any], day: int, message_id: Optional[int], plan_days: int) -> None:
+        chat_id = schedule['chat_id']
+        done = day >= plan_days
+        conn = None
+        try:
+            conn = _connect()
+            with conn:
+                conn.execute('''
+                    UPDATE autopost_posts SET status = 'published', message_id = ?,
+                        published_at = CURRENT_TIMESTAMP
+                    WHERE tenant_id = ? AND chat_id = ? AND day = ?
+                ''', (message_id, current_tenant(), chat_id, day))
+                conn.execute('''
+                    UPDATE autopost_schedules SET next_day = ?, plan_days = ?, status = ?,
+                        next_run_at = ?, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE tenant_id = ? AND chat_id = ?
+                ''', (
+                    day + 1, plan_days, 'done' if done else 'active',
+                    next_run_at(schedule['post_time'], schedule['utc_offset'], time.time()),
+                    current_tenant(), chat_id
+                ))
+        finally:
+            if conn:
+                conn.close()
+        if message_id is not None:
+            metrics.incr('autopost.published')
+            logger.info(f"Autopost day {day} of {chat_id} published to {schedule['channel_id']}")
+        if done:
+            self._notify(chat_id, f"✅ Автопостинг завершён: все посты плана ({plan_days} из {plan_days}) "
+                                  f"опубликованы в «{schedule['channel_title']}».")
+
+    def _retry_later(self, chat_id: int, error: str, delay: float) -> None:
+        metrics.incr('autopost.retries')
+        conn = None
+        try:
+            conn = _connect()
+            with conn:
+                conn.execute('''
+                    UPDATE autopost_schedules SET next_run_at = ?, last_error = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE tenant_id = ? AND chat_id = ? AND status = 'active'
+                ''', (int(time.time() + delay), error, current_tenant(), chat_id))
+        finally:
+            if conn:
+                conn.close()
+
+    def _stop_with_error(self, schedule: Dict[str, Any], error: str) -> None:
+        chat_id = schedule['chat_id']
+        metrics.incr('autopost.errors')
+        logger.warning(f"Autopost of {chat_id} to {schedule['channel_id']} stopped: {error}")
+        conn = None
+        try:
+            conn = _connect()
+            with conn:
+                conn.execute('''
+                    UPDATE autopost_schedules SET status = 'error', last_error = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE tenant_id = ? AND chat_id = ?
+                ''', (error, current_tenant(), chat_id))
+        finally:
+            if conn:
+                conn.close()
+        self._notify(
+            chat_id,
+            f"❌ Не удалось опубликовать пост в «{schedule['channel_title']}»: {error}\n\n"
+            "Проверьте, что бот остаётся администратором канала с правом публикации, "
+            "и возобновите автопостинг: /autopost",
+        )
+
+    def _notify(self, chat_id: int, text: str) -> None:
+        try:
+            self.bot.send_message(chat_id=chat_id, text=text)
+        except TelegramError as e:
+            logger.warning(f"Could not notify {chat_id} about autopost: {e}")
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def format_schedule(schedule: Dict[str, Any]) -> str:
+    published = schedule['next_day'] - 1
+    text = (
+        f"📅 Автопостинг в «{schedule['channel_title']}»: "
+        f"{STATUS_LABELS.get(schedule['status'], schedule['status'])}\n"
+        f"Время публикации: {schedule['post_time']} ({_zone(schedule['utc_offset'])})\n"
+        f"Опубликовано: {published} из {schedule['plan_days']}"
+    )
+    if schedule['status'] == 'active':
+        local = datetime.fromtimestamp(schedule['next_run_at'], timezone(timedelta(minutes=schedule['utc_offset'])))
+        text += f"\nСледующий пост: день {schedule['next_day']}, {local:%d.%m %H:%M}"
+    if schedule['status'] == 'error' and schedule['last_error']:
+        text += f"\nОшибка: {schedule['last_error']}"
+    return text
+
+def schedule_keyboard(schedule: Dict[str, Any]) -> Optional[InlineKeyboardMarkup]:
+    if schedule['status'] == 'done':
+        return None
+    toggle = (
+        InlineKeyboardButton("⏸ Приостановить", callback_data='autopost_pause')
+        if schedule['status'] == 'active'
+        else InlineKeyboardButton("▶️ Возобновить", callback_data='autopost_resume')
+    )
+    return InlineKeyboardMarkup([[toggle, InlineKeyboardButton("⏹ Отключить", callback_data='autopost_stop')]])
+
+def parse_channel(value: str) -> Optional[Any]:
+    """@username, a t.me link or a numeric -100… id, in the form getChat accepts."""
+    match = CHANNEL_LINK.match(value)
+    if match:
+        return f"@{match.group(1)}"
+    if value.startswith('@') and len(value) > 1:
+        return value
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return None
+
+def check_channel(bot: Bot, channel: Any, user_id: int):
+    """(chat, None) if the bot can post to `channel` and the user administers it, else (None, reason)."""
+    try:
+        chat = bot.get_chat(channel)
+    except (BadRequest, Unauthorized):
+        return None, ("❌ Канал не найден. Проверьте имя канала и что бот добавлен в него "
+                      "администратором.")
+    if chat.type != 'channel':
+        return None, "❌ Это не канал. Автопостинг работает только с каналами."
+    try:
+        bot_member = bot.get_chat_member(chat.id, bot.id)
+        user_member = bot.get_chat_member(chat.id, user_id)
+    except (BadRequest, Unauthorized):
+        return None, f"❌ Бот не является администратором «{chat.title}». Добавьте его и попробуйте снова."
+    if bot_member.status != 'administrator' or not bot_member.can_post_messages:
+        return None, (f"❌ Бот не может публиковать в «{chat.title}». Сделайте его администратором "
+                      "с правом публикации сообщений.")
+    if user_member.status not in ('creator', 'administrator'):
+        return None, "❌ Подключить автопостинг может только администратор канала."
+    return chat, None
+
+def autopost_command(update: Update, context: CallbackContext) -> None:
+    """/autopost shows the schedule, /autopost <channel> <HH:MM> links a channel."""
+    message = update.message
+    chat_id = update.effective_chat.id
+    args = context.args or []
+    if not args:
+        schedule = get_schedule(chat_id)
+        if schedule:
+            message.reply_text(format_schedule(schedule), reply_markup=schedule_keyboard(schedule))
+        else:
+            message.reply_text(USAGE_TEXT.format(zone=_zone(AUTOPOST_UTC_OFFSET_MINUTES)))
+        raise DispatcherHandlerStop()
+
+    channel = parse_channel(args[0])
+    post_time = args[1] if len(args) > 1 else ''
+    if channel is None or not TIME_PATTERN.match(post_time):
+        message.reply_text(USAGE_TEXT.format(zone=_zone(AUTOPOST_UTC_OFFSET_MINUTES)))
+        raise DispatcherHandlerStop()
+
+    profile = get_user_profile(chat_id)
+    if not profile.get('content_plan'):
+        message.reply_text("❌ Сначала создайте контент-план: /start")
+        raise DispatcherHandlerStop()
+
+    chat, error = check_channel(context.bot, channel, update.effective_user.id)
+    if error:
+        message.reply_text(error)
+        raise DispatcherHandlerStop()
+
+    hours, minutes = TIME_PATTERN.match(post_time).groups()
+    schedule = link_channel(chat_id, chat.id, chat.title, f"{int(hours):02d}:{minutes}", get_plan_days(profile))
+    metrics.incr('autopost.linked')
+    message.reply_text(
+        f"✅ Канал «{chat.title}» подключён. Посты плана будут выходить по одному в день.\n\n"
+        + format_schedule(schedule),
+        reply_markup=schedule_keyboard(schedule)
+    )
+    raise DispatcherHandlerStop()
+
+def autopost_button(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    query.answer()
+    chat_id = update.effective_chat.id
+    action = query.data[len('autopost_'):]
+    if action == 'stop':
+        delete_schedule(chat_id)
+        query.message.reply_text("⏹ Автопостинг отключён.")
+        raise DispatcherHandlerStop()
+    set_schedule_status(chat_id, 'active' if action == 'resume' else 'paused')
+    schedule = get_schedule(chat_id)
+    if schedule:
+        query.message.reply_text(format_schedule(schedule), reply_markup=schedule_keyboard(schedule))
+    raise DispatcherHandlerStop()
+
+def install_autopost(dispatcher: Dispatcher, group: int = 0) -> AutoPoster:
+    """Register /autopost and its buttons and start polling for due posts.
+
+    Call it in exactly one process (the one that owns the Updater), and before
+    the conversation handler when sharing its group: MAIN_MENU answers any button.
+    """
+    dispatcher.add_handler(
+        CommandHandler('autopost', autopost_command, filters=Filters.chat_type.private), group=group
+    )
+    dispatcher.add_handler(
+        CallbackQueryHandler(autopost_button, pattern='^autopost_(pause|resume|stop)$'), group=group
+    )
+    # A TenantDispatcher (tenants.py) brings the worker pool shared by every tenant
+    poster = AutoPoster(dispatcher.bot, executor=getattr(dispatcher, 'executor', None))
+    if AUTOPOST_POLL_SECONDS > 0:
+        dispatcher.job_queue.run_repeating(
+            poster.poll_job, interval=AUTOPOST_POLL_SECONDS, first=10, name='autopost'
+        )
+        logger.info(f"Autopost polling every {AUTOPOST_POLL_SECONDS:.0f}s")
+    return poster
@@ -0,0 +1,400 @@
+"""Generation backends and the per-task routing table used by prompts.py.
+
+A backend turns a prompt into text. OpenAIBackend talks to OpenAI or any
+OpenAI-compatible server (vLLM, llama.cpp, Ollama, fake_openai.py) via
+base_url; FakeBackend answers offline with deterministic text.
+
+Each task (plan, post, repackaging, repair, validation, summary) has a Route: backend,
+model, temperature, a latency budget (request timeout) and an optional cost
+budget per call. A route whose estimate exceeds the cost budget, or whose call
+fails or times out, hands over to its fallback route if it has one.
+
+Configuration, all optional:
+
+    GENERATION_BACKEND=fake         every task on the offline fake (tests, benchmarks)
+    GENERATION_BACKENDS='{"local": {"type": "openai", "base_url": "http://127.0.0.1:8000/v1"}}'
+    GENERATION_ROUTES='{"post": {"backend": "local", "model": "qwen2.5-7b", "timeout": 20}}'
+
+GENERATION_ROUTES may also be a path to a JSON file. Keys not given keep the
+defaults below. Tenants (tenants.py) can override the model or routes; their
+Routers share the backends, so one set of clients and connection pools.
+
+Router.complete() with on_token streams the answer: the callback gets each
+piece of text as the backend produces it (api.py relays them over SSE).
+"""
+import os
+import abc
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+from database import current_tenant
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TASKS = ('plan', 'post', 'repackaging', 'repair', 'validation', 'summary')
+
+# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+# do not change this unless explicitly requested by the user
+DEFAULT_MODEL = "gpt-4o"
+
+# USD per 1M (prompt, completion) tokens, for the cost budget; unknown models cost 0
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+}
+# Completion length assumed by cost estimates when a route sets no max_tokens
+ESTIMATED_COMPLETION_TOKENS = 1500
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: about 4 characters per token, 2.5 for Cyrillic."""
+    cyrillic = sum(1 for char in text if 'Ѐ' <= char <= 'ӿ')
+    return int(cyrillic / 2.5 + (len(text) - cyrillic) / 4) + 1
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+class Completion:
+    """Text of an answer and the tokens it took (estimated if the backend can't tell)."""
+
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+# Called with each piece of an answer as it is generated
+TokenCallback = Callable[[str], None]
+
+class Backend(abc.ABC):
+    """Interface of a generation backend."""
+
+    name = 'backend'
+
+    @abc.abstractmethod
+    def complete(self, prompt: str, model: str, temperature: float,
+                 timeout: Optional[float] = None, max_tokens: Optional[int] = None,
+                 on_token: Optional[TokenCallback] = None) -> Completion:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def acomplete(self, prompt: str, model: str, temperature: float,
+                        timeout: Optional[float] = None, max_tokens: Optional[int] = None,
+                        on_token: Optional[TokenCallback] = None) -> Completion:
+        raise NotImplementedError
+
+class OpenAIBackend(Backend):
+    """OpenAI chat completions, or any server speaking the same API at base_url.
+
+    Without base_url the client falls back to OPENAI_BASE_URL, then to OpenAI.
+    Clients are created on first use so importing this module stays cheap.
+    """
+
+    def __init__(self, name: str = 'openai', base_url: Optional[str] = None, api_key: Optional[str] = None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _client_options(self) -> Dict[str, Any]:
+        # Local servers usually ignore the key, but the client insists on one
+        api_key = self.api_key or os.getenv("OPENAI_API_KEY") or ('local' if self.base_url else None)
+        return {'api_key': api_key, 'base_url': self.base_url}
+
+    def get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(**self._client_options())
+        return self._client
+
+    def get_async_client(self):
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    from openai import AsyncOpenAI
+                    self._async_client = AsyncOpenAI(**self._client_options())
+        return self._async_client
+
+    @staticmethod
+    def _request(prompt: str, model: str, temperature: float, timeout: Optional[float],
+                 max_tokens: Optional[int], stream: bool = False) -> Dict[str, Any]:
+        request = {
+            'model': model,
+            'messages': [{"role": "user", "content": prompt}],
+            'temperature': temperature,
+        }
+        if timeout:
+            request['timeout'] = timeout
+        if max_tokens:
+            request['max_tokens'] = max_tokens
+        if stream:
+            request['stream'] = True
+            request['stream_options'] = {'include_usage': True}
+        return request
+
+    @staticmethod
+    def _completion(response) -> Completion:
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content.strip(),
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0
+        )
+
+    @staticmethod
+    def _chunk_text(chunk, parts: list, on_token: TokenCallback) -> None:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            on_token(parts[-1])
+
+    @staticmethod
+    def _streamed(parts: list, usage) -> Completion:
+        # The usage chunk comes last, and only from servers that support include_usage
+        return Completion(
+            ''.join(parts).strip(),
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0
+        )
+
+    def complete(self, prompt, model, temperature, timeout=None, max_tokens=None, on_token=None):
+        request = self._request(prompt, model, temperature, timeout, max_tokens, stream=bool(on_token))
+        if not on_token:
+            return self._completion(self.get_client().chat.completions.create(**request))
+        parts, usage = [], None
+        for chunk in self.get_client().chat.completions.create(**request):
+            usage = chunk.usage or usage
+            self._chunk_text(chunk, parts, on_token)
+        return self._streamed(parts, usage)
+
+    async def acomplete(self, prompt, model, temperature, timeout=None, max_tokens=None, on_token=None):
+        request = self._request(prompt, model, temperature, timeout, max_tokens, stream=bool(on_token))
+        if not on_token:
+            return self._completion(await self.get_async_client().chat.completions.create(**request))
+        parts, usage = [], None
+        async for chunk in await self.get_async_client().chat.completions.create(**request):
+            usage = chunk.usage or usage
+            self._chunk_text(chunk, parts, on_token)
+        return self._streamed(parts, usage)
+
+class FakeBackend(Backend):
+    """Deterministic offline answers in the format each prompt asks for."""
+
+    def __init__(self, name: str = 'fake', latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+
+    def _answer(self, prompt: str, on_token: Optional[TokenCallback]) -> Completion:
+        # Shares its answers with the HTTP fake, so both paths behave the same
+        from fake_openai import fake_completion_text, fake_stream_pieces
+        text = fake_completion_text(prompt)
+        if on_token:
+            for piece in fake_stream_pieces(text):
+                on_token(piece)
+        return Completion(text, estimate_tokens(prompt), estimate_tokens(text))
+
+    def complete(self, prompt, model, temperature, timeout=None, max_tokens=None, on_token=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(prompt, on_token)
+
+    async def acomplete(self, prompt, model, temperature, timeout=None, max_tokens=None, on_token=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._answer(prompt, on_token)
+
+BACKEND_TYPES = {'openai': OpenAIBackend, 'fake': FakeBackend}
+
+class Route:
+    """Where and how one task is generated."""
+
+    def __init__(self, task: str, backend: str = 'openai', model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, timeout: Optional[float] = None,
+                 max_cost: Optional[float] = None, max_tokens: Optional[int] = None,
+                 fallback: Optional[Dict[str, Any]] = None):
+        self.task = task
+        self.backend = backend
+        self.model = model
+        self.temperature = temperature
+        # Latency budget in seconds, sent to the backend as the request timeout
+        self.timeout = timeout
+        # Cost budget in USD per call, checked against an estimate before sending
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.fallback = Route(task, **fallback) if fallback else None
+
+    def estimated_cost(self, prompt: str) -> float:
+        return estimate_cost(
+            self.model, estimate_tokens(prompt), self.max_tokens or ESTIMATED_COMPLETION_TOKENS
+        )
+
+    def describe(self) -> str:
+        return f"{self.backend}/{self.model}"
+
+# Every task runs on gpt-4o unless GENERATION_ROUTES says otherwise
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    'plan': {'timeout': 120},
+    'post': {'timeout': 90},
+    'repackaging': {'timeout': 90},
+    # Fixing a plan's numbering is mechanical: low temperature
+    'repair': {'temperature': 0.2, 'timeout': 90},
+    'validation': {'temperature': 0.0, 'timeout': 30},
+    # One-off compaction of oversized profile fields (budget.py)
+    'summary': {'temperature': 0.2, 'timeout': 60},
+}
+
+def _load_json_setting(name: str) -> Dict[str, Any]:
+    value = os.getenv(name, '').strip()
+    if not value:
+        return {}
+    if not value.startswith('{'):
+        with open(value, encoding='utf-8') as f:
+            value = f.read()
+    return json.loads(value)
+
+def _build_routes(backends: Dict[str, Backend], overrides: Dict[str, Dict[str, Any]]) -> Dict[str, Route]:
+    forced_backend = os.getenv('GENERATION_BACKEND')
+    routes = {}
+    for task in TASKS:
+        options = {**DEFAULT_ROUTES.get(task, {}), **overrides.get(task, {})}
+        if forced_backend:
+            options['backend'] = forced_backend
+            options.pop('fallback', None)
+        routes[task] = Route(task, **options)
+    for task, route in routes.items():
+        for candidate in (route, route.fallback):
+            if candidate and candidate.backend not in backends:
+                raise ValueError(f"Route {task} uses unknown backend {candidate.backend}")
+    logger.info("Generation routes: " + ', '.join(f"{t}={r.describe()}" for t, r in routes.items()))
+    return routes
+
+class Router:
+    """Backends by name and the route of every task."""
+
+    def __init__(self, backends: Dict[str, Backend], routes: Dict[str, Route]):
+        self.backends = backends
+        self.routes = routes
+
+    @classmethod
+    def from_env(cls) -> 'Router':
+        backends: Dict[str, Backend] = {'openai': OpenAIBackend(), 'fake': FakeBackend()}
+        for name, options in _load_json_setting('GENERATION_BACKENDS').items():
+            options = dict(options)
+            backend_type = BACKEND_TYPES[options.pop('type', 'openai')]
+            backends[name] = backend_type(name=name, **options)
+
+        return cls(backends, _build_routes(backends, _load_json_setting('GENERATION_ROUTES')))
+
+    def for_tenant(self, model: Optional[str] = None,
+                   routes: Optional[Dict[str, Dict[str, Any]]] = None) -> 'Router':
+        """A Router on these backends with a tenant's model and route overrides on top of GENERATION_ROUTES."""
+        overrides = _load_json_setting('GENERATION_ROUTES')
+        merged = {
+            task: {**overrides.get(task, {}), **({'model': model} if model else {}), **(routes or {}).get(task, {})}
+            for task in TASKS
+        }
+        return Router(self.backends, _build_routes(self.backends, merged))
+
+    def _plan(self, task: str, prompt: str) -> Route:
+        """Route for this prompt: the task's own, or its fallback if over the cost budget."""
+        route = self.routes[task]
+        if route.max_cost is not None and route.estimated_cost(prompt) > route.max_cost:
+            metrics.incr(f'generation.{task}.over_budget')
+            if route.fallback:
+                logger.info(f"{task}: estimated cost over {route.max_cost}$, using {route.fallback.describe()}")
+                return route.fallback
+            logger.warning(f"{task}: estimated cost over {route.max_cost}$ and no fallback route")
+        return route
+
+    def _account(self, task: str, route: Route, completion: Completion, started: float) -> Completion:
+        elapsed = time.monotonic() - started
+        cost = estimate_cost(route.model, completion.prompt_tokens, completion.completion_tokens)
+        metrics.incr(f'generation.{task}.calls')
+        metrics.incr(f'generation.{task}.ms', int(elapsed * 1000))
+        metrics.incr(f'generation.{task}.tokens', completion.prompt_tokens + completion.completion_tokens)
+        metrics.incr(f'generation.{task}.cost_micro_usd', int(cost * 1_000_000))
+        if route.timeout and elapsed > route.timeout:
+            metrics.incr(f'generation.{task}.over_latency')
+        return completion
+
+    def complete(self, task: str, prompt: str, on_token: Optional[TokenCallback] = None) -> Completion:
+        """Generate `prompt` on the task's route; with on_token, stream the answer to it.
+
+        A fallback after a failure mid-stream starts its answer over, so
+        streamed pieces are a preview; the returned text is the answer.
+        """
+        route = self._plan(task, prompt)
+        started = time.monotonic()
+        try:
+            completion = self.backends[route.backend].complete(
+                prompt, route.model, route.temperature, route.timeout, route.max_tokens, on_token
+            )
+        except Exception as e:
+            if route.fallback is None:
+                raise
+            logger.warning(f"{task} on {route.describe()} failed ({e}), retrying on {route.fallback.describe()}")
+            metrics.incr(f'generation.{task}.fallbacks')
+            route = route.fallback
+            started = time.monotonic()
+            completion = self.backends[route.backend].complete(
+                prompt, route.model, route.temperature, route.timeout, route.max_tokens, on_token
+            )
+        return self._account(task, route, completion, started)
+
+    async def acomplete(self, task: str, prompt: str, on_token: Optional[TokenCallback] = None) -> Completion:
+        route = self._plan(task, prompt)
+        started = time.monotonic()
+        try:
+            completion = await self.backends[route.backend].acomplete(
+                prompt, route.model, route.temperature, route.timeout, route.max_tokens, on_token
+            )
+        except Exception as e:
+            if route.fallback is None:
+                raise
+            logger.warning(f"{task} on {route.describe()} failed ({e}), retrying on {route.fallback.describe()}")
+            metrics.incr(f'generation.{task}.fallbacks')
+            route = route.fallback
+            started = time.monotonic()
+            completion = await self.backends[route.backend].acomplete(
+                prompt, route.model, route.temperature, route.timeout, route.max_tokens, on_token
+            )
+        return self._account(task, route, completion, started)
+
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+# tenant id -> Router of a tenant with its own model or routes
+_tenant_routers: Dict[str, Router] = {}
+
+def get_router() -> Router:
+    """Return the current tenant's Router, else the shared one built from the environment on first call."""
+    global _router
+    router = _tenant_routers.get(current_tenant())
+    if router is not None:
+        return router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = Router.from_env()
+    return _router
+
+def set_router(router: Optional[Router]) -> None:
+    """Replace the shared Router (None: rebuild from the environment on next use)."""
+    global _router
+    with _router_lock:
+        _router = router
+
+def set_tenant_router(tenant_id: str, router: Optional[Router]) -> None:
+    """Give a tenant its own Router (None: back to the shared one)."""
+    with _router_lock:
+        if router is None:
+            _tenant_routers.pop(tenant_id, None)
+        else:
+            _tenant_routers[tenant_id] = router
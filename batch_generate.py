@@ -0,0 +1,252 @@
+"""Generate plans (and optionally all posts) for many channel profiles offline.
+
+Input is CSV, NDJSON or a JSON array with the questionnaire fields collected
+by handlers.py: topic, audience, monetization, product_details, preferences,
+style, emotions.
+An `id` column names each item (defaults to the row number); a `chat_id`
+column links the result to an existing bot user, and an optional `plan_days`
+column overrides --days for that profile.
+
+    python batch_generate.py profiles.csv --out results/ --concurrency 8 --posts
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import zlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Set, Tuple
+from database import init_db, save_user_data
+from handlers import missing_plan_fields
+from prompts import generate_content_plan, generate_post, get_plan_days
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = [
+    'topic', 'audience', 'monetization', 'product_details',
+    'preferences', 'style', 'emotions'
+]
+
+def read_profiles(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield profiles from a CSV, NDJSON or JSON array file, one at a time.
+
+    Lines or elements that aren't JSON objects are logged and skipped.
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.json'):
+            rows = enumerate(json.load(f), 1)
+        elif path.endswith(('.ndjson', '.jsonl')):
+            rows = _ndjson_rows(f, path)
+        else:
+            rows = None
+        if rows is not None:
+            for number, row in rows:
+                if isinstance(row, dict):
+                    yield {'_row': number, **row}
+                else:
+                    logger.warning(f"Skipping row {number} of {path}: not a JSON object")
+        else:
+            for number, row in enumerate(csv.DictReader(f), 1):
+                yield {'_row': number, **row}
+
+def _ndjson_rows(f, path: str) -> Iterator[Tuple[int, Any]]:
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            logger.warning(f"Skipping row {number} of {path}: invalid JSON ({e})")
+
+def field_text(value: Any) -> str:
+    """A questionnaire answer as text: JSON numbers and lists become strings."""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ', '.join(field_text(item) for item in value)
+    return str(value).strip()
+
+def item_id(profile: Dict[str, Any]) -> str:
+    return str(profile.get('id') or profile.get('chat_id') or f"row{profile['_row']}")
+
+def item_dir_name(key: str) -> str:
+    """Directory of an item under --out: ids from the input never leave it.
+
+    Ids that had to be changed get their checksum appended, so two of them
+    don't share a directory.
+    """
+    name = re.sub(r'[^\w.-]', '_', key)
+    if name == key and name not in ('.', '..'):
+        return name
+    return f"{name.strip('.') or 'item'}-{zlib.crc32(key.encode()):08x}"
+
+def item_chat_id(profile: Dict[str, Any]) -> int:
+    """chat_id to store the result under; profiles without one get a stable negative id."""
+    if str(profile.get('chat_id') or '').lstrip('-').isdigit():
+        return int(profile['chat_id'])
+    return -(zlib.crc32(item_id(profile).encode()) + 1)
+
+class Checkpoint:
+    """Append-only NDJSON log of finished plans and posts, replayed on restart."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.plans: Dict[str, str] = {}
+        self.posts: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._apply(json.loads(line))
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        if record['event'] == 'plan':
+            self.plans[record['id']] = record['file']
+        elif record['event'] == 'post':
+            self.posts.setdefault(record['id'], set()).add(record['day'])
+
+    def record(self, **record) -> None:
+        with self._lock:
+            self._apply(record)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+def profile_days(profile: Dict[str, Any], days: int) -> int:
+    return get_plan_days({'plan_days': profile.get('plan_days') or days})
+
+def process_profile(profile: Dict[str, Any], out_dir: str, checkpoint: Checkpoint,
+                    with_posts: bool, days: int) -> Dict[str, Any]:
+    """Generate (or resume) one item. Returns timing information."""
+    key = item_id(profile)
+    user_data = {field: field_text(profile.get(field)) for field in PROFILE_FIELDS}
+    user_data['plan_days'] = profile_days(profile, days)
+    if key not in checkpoint.plans:
+        missing = missing_plan_fields(user_data)
+        if missing:
+            raise ValueError(f"missing fields: {', '.join(missing)}")
+    item_dir = os.path.join(out_dir, item_dir_name(key))
+    os.makedirs(item_dir, exist_ok=True)
+    calls = []
+    started = time.monotonic()
+
+    if key in checkpoint.plans:
+        with open(checkpoint.plans[key], encoding='utf-8') as f:
+            content_plan = f.read()
+    else:
+        call_started = time.monotonic()
+        content_plan = generate_content_plan(user_data)
+        calls.append(time.monotonic() - call_started)
+
+        plan_file = os.path.join(item_dir, 'plan.txt')
+        with open(plan_file, 'w', encoding='utf-8') as f:
+            f.write(content_plan)
+        save_user_data(item_chat_id(profile), {**user_data, 'content_plan': content_plan})
+        checkpoint.record(event='plan', id=key, file=plan_file)
+
+    user_data['content_plan'] = content_plan
+    if with_posts:
+        done = checkpoint.posts.get(key, set())
+        for day in range(1, user_data['plan_days'] + 1):
+            if day in done:
+                continue
+            call_started = time.monotonic()
+            post = generate_post(user_data, day)
+            calls.append(time.monotonic() - call_started)
+            post_file = os.path.join(item_dir, f'post_{day:02d}.txt')
+            with open(post_file, 'w', encoding='utf-8') as f:
+                f.write(post)
+            checkpoint.record(event='post', id=key, day=day, file=post_file)
+
+    return {'id': key, 'latency': time.monotonic() - started, 'calls': calls}
+
+def run_batch(input_path: str, out_dir: str, concurrency: int = 4, with_posts: bool = False,
+              days: int = 14) -> Dict[str, Any]:
+    """Process every profile with at most `concurrency` items in flight."""
+    init_db()
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(out_dir, 'checkpoint.ndjson'))
+
+    pending = []
+    skipped = 0
+    for profile in read_profiles(input_path):
+        key = item_id(profile)
+        if key in checkpoint.plans and (
+            not with_posts or len(checkpoint.posts.get(key, ())) == profile_days(profile, days)
+        ):
+            skipped += 1
+            continue
+        pending.append(profile)
+    logger.info(f"{len(pending)} items to process, {skipped} already done")
+
+    results, failures = [], []
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(process_profile, profile, out_dir, checkpoint, with_posts, days): item_id(profile)
+            for profile in pending
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result = future.result()
+                results.append(result)
+                logger.info(f"Item {key} done in {result['latency']:.1f}s")
+            except Exception as e:
+                failures.append({'id': key, 'error': str(e)})
+                logger.error(f"Item {key} failed: {e}")
+    elapsed = time.monotonic() - started
+
+    latencies = [result['latency'] for result in results]
+    calls = [call for result in results for call in result['calls']]
+    return {
+        'processed': len(results),
+        'failed': failures,
+        'skipped': skipped,
+        'elapsed_seconds': round(elapsed, 2),
+        'items_per_minute': round(len(results) / elapsed * 60, 2) if elapsed else 0.0,
+        'calls': len(calls),
+        'item_latency_p50': round(_percentile(latencies, 50), 2),
+        'item_latency_p95': round(_percentile(latencies, 95), 2),
+        'item_latency_max': round(max(latencies, default=0.0), 2),
+        'call_latency_p50': round(_percentile(calls, 50), 2),
+        'call_latency_p95': round(_percentile(calls, 95), 2),
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Bulk content plan/post generation")
+    parser.add_argument('input', help="CSV, NDJSON or JSON array file with channel profiles")
+    parser.add_argument('--out', default='batch_output')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--days', type=int, default=14, help="plan length in days")
+    parser.add_argument('--posts', action='store_true', help="also generate a post for every day")
+    parser.add_argument('--backend', help="run every task on this backend, e.g. 'fake' for an offline dry run")
+    args = parser.parse_args()
+    if args.backend:
+        # Read by backends.Router.from_env on the first generation
+        os.environ['GENERATION_BACKEND'] = args.backend
+
+    try:
+        report = run_batch(args.input, args.out, args.concurrency, args.posts, args.days)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        sys.exit(1 if report['failed'] else 0)
+    except Exception:
+        logger.error("Batch generation failed", exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,680 @@
+"""Local performance benchmarks. Nothing here talks to Telegram or OpenAI.
+
+Usage: python benchmarks.py <benchmark> [options]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Texts the bot sends during the first questionnaire steps, in order
+QUESTIONNAIRE_REPLIES = ['👋 Выберите действие', '📝 Какая тема', '✍️ Отлично', '💰 Выберите']
+
+def _use_temp_database() -> str:
+    """Point database.py at a throwaway file so benchmarks never touch bot.db."""
+    path = os.path.join(tempfile.mkdtemp(prefix='bot-bench-'), 'bench.db')
+    os.environ['BOT_DB_PATH'] = path
+    return path
+
+def _reply_step(text: str) -> int:
+    for index, prefix in enumerate(QUESTIONNAIRE_REPLIES):
+        if text.startswith(prefix):
+            return index
+    return -1
+
+def bench_workers(args) -> None:
+    """Throughput of the sharded runtime against the fake Bot API."""
+    _use_temp_database()
+    from database import init_db
+    from fake_bot_api import FakeBotAPI, make_message_update, make_callback_update
+    from workers import ShardedRuntime
+
+    init_db()
+    api = FakeBotAPI().start()
+    runtime = ShardedRuntime('123:fake', workers=args.workers, base_url=api.base_url)
+    runtime.start('polling')
+    time.sleep(args.warmup)
+
+    chats = range(1_000_000, 1_000_000 + args.chats)
+    started = time.monotonic()
+    for chat_id in chats:
+        api.inject_update(make_message_update(chat_id, '/start'))
+        api.inject_update(make_callback_update(chat_id, 'content_plan'))
+        api.inject_update(make_message_update(chat_id, 'Бизнес и финансы'))
+        api.inject_update(make_message_update(chat_id, 'Предприниматели 25-40 лет'))
+
+    expected = len(QUESTIONNAIRE_REPLIES) * args.chats
+    deadline = started + args.timeout
+    while len(api.sent_messages()) < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+    runtime.stop()
+    api.stop()
+
+    sent = api.sent_messages()
+    by_chat = {}
+    for call in sent:
+        by_chat.setdefault(int(call['params']['chat_id']), []).append(call['params']['text'])
+    out_of_order = 0
+    for texts in by_chat.values():
+        steps = [_reply_step(text) for text in texts]
+        if steps != list(range(len(steps))):
+            out_of_order += 1
+
+    print(f"workers:          {args.workers}")
+    print(f"chats:            {args.chats}")
+    print(f"replies:          {len(sent)}/{expected}")
+    print(f"elapsed:          {elapsed:.2f}s")
+    print(f"updates/sec:      {4 * args.chats / elapsed:.1f}")
+    print(f"out-of-order:     {out_of_order}")
+
+def _rss_kb() -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def _serve_fakes(latency: float, conn) -> None:
+    """Child process running the fake Bot API and fake OpenAI."""
+    from fake_bot_api import FakeBotAPI
+    from fake_openai import FakeOpenAI
+    api = FakeBotAPI().start()
+    openai_server = FakeOpenAI(latency=latency).start()
+    conn.send((api.base_url, openai_server.base_url))
+    while True:
+        time.sleep(3600)
+
+def bench_runtimes(args) -> None:
+    """In-flight generation capacity and memory per session: threaded vs asyncio."""
+    import json
+    import threading
+    import multiprocessing
+    import urllib.request
+    from fake_bot_api import make_message_update, make_callback_update
+    from fake_openai import fake_completion_text
+
+    _use_temp_database()
+    parent_conn, child_conn = multiprocessing.Pipe()
+    fakes = multiprocessing.Process(target=_serve_fakes, args=(args.latency, child_conn), daemon=True)
+    fakes.start()
+    bot_url, openai_url = parent_conn.recv()
+    os.environ['OPENAI_BASE_URL'] = openai_url
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    token = '123:fake'
+
+    def post(url, payload):
+        request = urllib.request.Request(url, json.dumps(payload).encode(), {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def bot_stats():
+        return post(f"{bot_url}{token}/benchStats", {'contains': fake_completion_text('')})['result']
+
+    from database import init_db
+    init_db()
+    if args.runtime == 'threaded':
+        from telegram.ext import Updater
+        from main import build_conversation_handler
+        updater = Updater(token=token, use_context=True, base_url=bot_url, workers=args.threads)
+        updater.dispatcher.add_handler(build_conversation_handler())
+        updater.start_polling(poll_interval=0)
+    else:
+        import asyncio
+        from async_runtime import AsyncBotClient, AsyncBotRuntime
+
+        def serve():
+            async def main():
+                await AsyncBotRuntime(AsyncBotClient(token, bot_url)).run_polling()
+            asyncio.run(main())
+        threading.Thread(target=serve, daemon=True).start()
+    time.sleep(2)
+
+    baseline_rss = _rss_kb()
+    updates = []
+    for chat_id in range(2_000_000, 2_000_000 + args.sessions):
+        updates += [
+            make_message_update(chat_id, '/start'),
+            make_callback_update(chat_id, 'repackage'),
+            make_message_update(chat_id, 'Предприниматели'),
+            make_message_update(chat_id, 'Курс по рилс'),
+            make_message_update(chat_id, 'Продажи'),
+        ]
+    started = time.monotonic()
+    post(f"{bot_url}{token}/benchInject", {'updates': updates})
+
+    peak_rss = baseline_rss
+    done = 0
+    while done < args.sessions and time.monotonic() - started < args.timeout:
+        time.sleep(0.1)
+        peak_rss = max(peak_rss, _rss_kb())
+        done = bot_stats()['matching']
+    elapsed = time.monotonic() - started
+    with urllib.request.urlopen(f"{openai_url}/stats") as response:
+        openai_stats = json.loads(response.read())
+    fakes.kill()
+
+    print(f"runtime:                 {args.runtime}")
+    print(f"sessions:                {args.sessions}")
+    print(f"generation latency:      {args.latency}s")
+    print(f"completed:               {done}")
+    print(f"elapsed:                 {elapsed:.2f}s")
+    print(f"peak in-flight requests: {openai_stats['peak_in_flight']}")
+    print(f"RSS growth:              {peak_rss - baseline_rss} KB "
+          f"({(peak_rss - baseline_rss) / args.sessions:.1f} KB/session)")
+    os._exit(0)
+
+def _trim_heap() -> None:
+    """Return freed heap pages to the OS (glibc), so RSS reflects live memory."""
+    import gc
+    import ctypes
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except OSError:
+        pass
+
+_VOCABULARY = []
+
+def _example_text(rng, chars: int) -> str:
+    """Pseudo-Russian text; a few thousand distinct words compress roughly like real posts."""
+    if not _VOCABULARY:
+        syllables = [c + v for c in 'бвгдзклмнпрстх' for v in 'аеиоуыя']
+        words_rng = __import__('random').Random(0)
+        _VOCABULARY.extend(
+            ''.join(words_rng.choice(syllables) for _ in range(words_rng.randint(1, 4)))
+            for _ in range(3000)
+        )
+    text, length = [], 0
+    while length < chars:
+        word = rng.choice(_VOCABULARY)
+        text.append(word)
+        length += len(word) + 1
+    return ' '.join(text)[:chars]
+
+def bench_sessions(args) -> None:
+    """Resident memory of in-memory sessions before and after idle eviction."""
+    import random
+    from queue import Queue
+    from telegram import Bot
+    from telegram.ext import Dispatcher
+    db_path = _use_temp_database()
+    from database import init_db
+    from handlers import EXAMPLES
+    from main import build_conversation_handler
+    from sessions import SessionManager
+
+    init_db()
+    dispatcher = Dispatcher(Bot('123:fake'), Queue(), use_context=True)
+    conversation = build_conversation_handler()
+    dispatcher.add_handler(conversation)
+    manager = SessionManager(dispatcher, conversation, idle_seconds=args.idle, max_sessions=args.max_sessions)
+
+    rng = random.Random(1)
+    _trim_heap()
+    baseline_rss = _rss_kb()
+    now = time.monotonic()
+    for index in range(args.sessions):
+        chat_id = 3_000_000 + index
+        dispatcher.user_data[chat_id].update({
+            'waiting_for': 'examples',
+            'topic': 'Бизнес и финансы для начинающих предпринимателей',
+            'audience': 'Предприниматели 25-40 лет',
+            'monetization': 'services',
+            'product_details': _example_text(rng, 300),
+            'preferences': _example_text(rng, 200),
+            'style': 'business',
+            'emotions': 'Доверие, интерес',
+            'examples': [
+                {'text': _example_text(rng, args.example_chars), 'source': ''}
+                for _ in range(args.examples)
+            ],
+        })
+        conversation.conversations[(chat_id, chat_id)] = EXAMPLES
+        # Spread activity over the last 2 * idle seconds: about half are idle
+        manager.mark_active((chat_id, chat_id), now - rng.random() * 2 * args.idle)
+    _trim_heap()
+    full_rss = _rss_kb()
+
+    started = time.monotonic()
+    evicted = manager.evict(now)
+    evict_seconds = time.monotonic() - started
+    _trim_heap()
+    evicted_rss = _rss_kb()
+
+    per_10k = 10_000 / args.sessions
+    print(f"sessions:              {args.sessions} ({args.examples} examples x {args.example_chars} chars)")
+    print(f"RSS, all in memory:    {(full_rss - baseline_rss) * per_10k / 1024:.1f} MB per 10k sessions")
+    print(f"evicted:               {evicted} in {evict_seconds:.2f}s, {len(manager)} left in memory")
+    print(f"RSS after eviction:    {(evicted_rss - baseline_rss) * per_10k / 1024:.1f} MB per 10k sessions")
+    db_size = sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path))
+    print(f"database size:         {db_size / 1024 / 1024:.1f} MB")
+
+def _percentiles(values) -> str:
+    ordered = sorted(values)
+    pick = lambda percent: ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+    return f"p50 {pick(50) * 1000:.2f}ms  p95 {pick(95) * 1000:.2f}ms"
+
+def bench_storage(args) -> None:
+    """Database size and read latency: JSON columns vs example_posts + compression."""
+    import json
+    import random
+    import sqlite3
+    db_path = _use_temp_database()
+    import database
+    from fake_openai import fake_completion_text
+
+    rng = random.Random(1)
+    # Forwarded posts repeat across users: draw examples from a shared pool
+    pool_size = max(1, int(args.users * args.examples * (1 - args.duplicates)))
+    pool = [_example_text(rng, rng.randint(300, args.example_chars)) for _ in range(pool_size)]
+    plan = fake_completion_text('Создай контент-план')
+    profiles = []
+    for _ in range(args.users):
+        profiles.append({
+            'topic': 'Бизнес и финансы', 'audience': 'Предприниматели 25-40 лет',
+            'monetization': 'services', 'product_details': _example_text(rng, 300),
+            'preferences': '', 'style': 'business', 'emotions': 'Доверие',
+            'examples': [{'text': rng.choice(pool), 'source': ''} for _ in range(args.examples)],
+            'content_plan': plan.replace('Тестовый пост', _example_text(rng, 40)),
+        })
+
+    # Old layout: what save_user_data wrote before example_posts existed
+    legacy_path = db_path.replace('bench.db', 'legacy.db')
+    database.DB_PATH = legacy_path
+    database.init_db()
+    conn = sqlite3.connect(legacy_path)
+    with conn:
+        conn.executemany('''
+            INSERT INTO users (chat_id, channel_topic, target_audience, monetization, product_details,
+                               preferences, style, emotions, examples, content_plan)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (index, p['topic'], p['audience'], p['monetization'], p['product_details'], p['preferences'],
+             p['style'], p['emotions'], json.dumps(p['examples']), json.dumps(p['content_plan']))
+            for index, p in enumerate(profiles)
+        ])
+    conn.close()
+
+    database.DB_PATH = db_path
+    database.init_db()
+    for index, profile in enumerate(profiles):
+        database.save_user_data(index, profile)
+
+    sample = [rng.randrange(args.users) for _ in range(args.reads)]
+    print(f"users: {args.users}, {args.examples} examples each, {args.duplicates:.0%} duplicates")
+    for name, path in (('json columns', legacy_path), ('example_posts+zlib', db_path)):
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+        conn.close()
+        database.DB_PATH = path
+        timings = []
+        for chat_id in sample:
+            started = time.perf_counter()
+            data = database.get_user_data(chat_id)
+            timings.append(time.perf_counter() - started)
+            assert data['examples'] == profiles[chat_id]['examples']
+        print(f"{name:20s} {os.path.getsize(path) / 1024 / 1024:7.1f} MB   get_user_data {_percentiles(timings)}")
+
+def bench_broadcast(args) -> None:
+    """Broadcast throughput against a fake Bot API with latency, 403s and a 429 limit."""
+    import random
+    import sqlite3
+    from collections import Counter
+    db_path = _use_temp_database()
+    from database import init_db
+    from fake_bot_api import FakeBotAPI
+    from telegram import Bot
+    import broadcast
+
+    init_db()
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany('INSERT INTO users (chat_id) VALUES (?)', [(chat_id,) for chat_id in range(1, args.users + 1)])
+    conn.close()
+
+    api = FakeBotAPI(send_latency=args.send_latency, send_rate_limit=args.rate_limit).start()
+    rng = random.Random(1)
+    api.blocked_chats = set(rng.sample(range(1, args.users + 1), int(args.users * args.blocked)))
+
+    broadcast_id = broadcast.create_broadcast('Тестовая рассылка', created_by=0)
+    started = time.monotonic()
+    broadcaster = broadcast.Broadcaster(
+        Bot('123:fake', base_url=api.base_url), broadcast_id,
+        rate=args.rate, concurrency=args.concurrency, page_size=args.page_size
+    ).start()
+    broadcaster.join()
+    elapsed = time.monotonic() - started
+
+    result = broadcast.get_broadcast(broadcast_id)
+    deliveries = Counter(int(call['params']['chat_id']) for call in api.sent_messages())
+    print(f"users: {args.users}, rate {args.rate}/s, {args.concurrency} senders, "
+          f"send latency {args.send_latency * 1000:.0f} ms, 429 above {args.rate_limit or '-'}/s")
+    print(f"status {result['status']}: sent {result['sent']}, blocked {result['blocked']}, "
+          f"failed {result['failed']}, 429s {api.throttled}")
+    print(f"{elapsed:.1f}s, {args.users / elapsed:.1f} chats/s, "
+          f"duplicates {sum(1 for count in deliveries.values() if count > 1)}")
+
+def bench_budget(args) -> None:
+    """Prompt tokens before/after the field budgets, on profiles with pasted sales pages."""
+    import random
+    _use_temp_database()
+    os.environ['GENERATION_BACKEND'] = 'fake'
+    from database import init_db
+    from fake_openai import fake_completion_text
+    import budget
+    import prompts
+
+    init_db()
+    rng = random.Random(1)
+    plan = fake_completion_text('Создай контент-план')
+    profiles = []
+    for _ in range(args.users):
+        oversized = rng.random() < args.oversized
+        profiles.append({
+            'topic': 'Бизнес и финансы', 'audience': 'Предприниматели 25-40 лет',
+            'monetization': 'services', 'style': 'business', 'emotions': 'Доверие',
+            'product_details': _example_text(rng, rng.randint(20_000, 60_000) if oversized else rng.randint(200, 1200)),
+            'preferences': _example_text(rng, rng.randint(3000, 8000) if oversized else rng.randint(0, 300)),
+            'content_plan': plan,
+        })
+
+    def distribution(values) -> str:
+        ordered = sorted(values)
+        pick = lambda percent: ordered[min(len(ordered) - 1, int(percent / 100 * len(ordered)))]
+        return f"p50 {pick(50):6d}  p95 {pick(95):6d}  max {ordered[-1]:6d}  total {sum(ordered):9d}"
+
+    def timed(profiles) -> float:
+        started = time.perf_counter()
+        for profile in profiles:
+            budget.compact_profile(profile)
+        return (time.perf_counter() - started) / len(profiles) * 1000
+
+    first = timed(profiles)
+    in_memory = timed(profiles)
+    budget._memory_cache.clear()
+    from_db = timed(profiles)
+    compact = [budget.compact_profile(profile) for profile in profiles]
+
+    print(f"{args.users} users, {args.oversized:.0%} oversized, mode {budget.PROMPT_BUDGET_MODE}")
+    print(f"compact_profile: first {first:.3f} ms/user, cached in memory {in_memory:.3f}, in the database {from_db:.3f}")
+    for name, build in (
+        ('plan', lambda data: prompts.build_content_plan_prompt(data, 14)),
+        ('post', lambda data: prompts.build_post_prompt(data, 3)),
+    ):
+        print(f"{name} prompt tokens")
+        print(f"  before  {distribution([budget.count_tokens(build(profile)) for profile in profiles])}")
+        print(f"  after   {distribution([budget.count_tokens(build(profile)) for profile in compact])}")
+
+def bench_autopost(args) -> None:
+    """Cost of one autopost poll over many schedules, with and without the due index."""
+    import random
+    import sqlite3
+    db_path = _use_temp_database()
+    from database import init_db
+    import autopost
+
+    init_db()
+    rng = random.Random(1)
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany('''
+            INSERT INTO autopost_schedules
+                (chat_id, channel_id, channel_title, post_time, utc_offset, next_day, plan_days, status, next_run_at)
+            VALUES (?, ?, 'Канал', '09:00', 180, 1, 14, ?, ?)
+        ''', [
+            (chat_id, -chat_id, 'active' if rng.random() < 0.9 else 'done', now + rng.randint(0, 86400))
+            for chat_id in range(1, args.schedules + 1)
+        ])
+    due_query = '''
+        SELECT chat_id FROM autopost_schedules
+        WHERE status = 'active' AND next_run_at <= ? ORDER BY next_run_at LIMIT ?
+    '''
+    plan = ' / '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {due_query}', (now, 200)))
+
+    poster = autopost.AutoPoster(bot=None)
+    # Only the polling queries are measured, nothing is generated or sent
+    poster._submit = lambda task, chat_id: True
+
+    def timed() -> str:
+        timings = []
+        for _ in range(args.polls):
+            started = time.perf_counter()
+            poster.poll(now + rng.randint(0, 86400))
+            timings.append(time.perf_counter() - started)
+        return _percentiles(timings)
+
+    print(f"{args.schedules} schedules, {args.polls} polls at random times of day")
+    print(f"due query plan: {plan}")
+    print(f"with idx_autopost_due     poll {timed()}")
+    conn.execute('DROP INDEX idx_autopost_due')
+    print(f"without the index         poll {timed()}")
+    conn.close()
+    poster.shutdown()
+
+def bench_search(args) -> None:
+    """/search latency over a large history, against a LIKE scan of the same user's rows."""
+    import random
+    import sqlite3
+    db_path = _use_temp_database()
+    from database import init_db
+    import history
+
+    init_db()
+    rng = random.Random(1)
+    # One agency-sized account next to many ordinary ones
+    heavy_user = 1
+    owners = [heavy_user] * args.heavy_posts + [
+        rng.randint(2, args.users + 1) for _ in range(args.posts - args.heavy_posts)
+    ]
+    conn = sqlite3.connect(db_path)
+    started = time.perf_counter()
+    for start in range(0, len(owners), 10_000):
+        with conn:
+            conn.executemany(
+                'INSERT INTO generation_history (chat_id, kind, day, title, body) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (chat_id, 'post', 1, f"Пост #1: {_example_text(rng, 40)}", _example_text(rng, args.post_chars))
+                    for chat_id in owners[start:start + 10_000]
+                ]
+            )
+    indexing = time.perf_counter() - started
+    db_size = os.path.getsize(db_path)
+
+    def timed(chat_ids, words: int):
+        fts, like = [], []
+        for chat_id in chat_ids:
+            query = ' '.join(rng.choice(_VOCABULARY) for _ in range(words))
+            started = time.perf_counter()
+            history.search(chat_id, query)
+            fts.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            # Like /search, the baseline needs the number of matches, not just the first few
+            conn.execute(
+                'SELECT COUNT(*) FROM generation_history WHERE chat_id = ? AND '
+                + ' AND '.join(['body LIKE ?'] * words),
+                [chat_id] + [f'%{word}%' for word in query.split()]
+            ).fetchall()
+            like.append(time.perf_counter() - started)
+        return _percentiles(fts), _percentiles(like)
+
+    regular = [rng.randint(2, args.users + 1) for _ in range(args.queries)]
+    print(f"{args.posts} posts of {args.post_chars} chars, {args.users} users + one with {args.heavy_posts} posts")
+    print(f"indexing: {args.posts / indexing:.0f} posts/s, database size {db_size / 1024 / 1024:.1f} MB")
+    for words in (1, 2):
+        fts, like = timed(regular, words)
+        print(f"regular user, {words} word(s)  fts {fts}   like {like}")
+        fts, like = timed([heavy_user] * args.queries, words)
+        print(f"heavy user,   {words} word(s)  fts {fts}   like {like}")
+    conn.close()
+
+def bench_similarity(args) -> None:
+    """Cost of the near-duplicate check over plans of each length."""
+    import random
+    from prompts import plan_entries
+    from similarity import repeated_days
+
+    rng = random.Random(1)
+    for days in (7, 14, 30, 90):
+        plans = [
+            "\n\n".join(
+                f"🔢 День #{day}:\n🎯 Цель: engagement\n📢 Заголовок: {_example_text(rng, 50)}\n"
+                f"📝 Описание: {_example_text(rng, 120)}"
+                for day in range(1, days + 1)
+            )
+            for _ in range(args.plans)
+        ]
+        timings, flagged = [], 0
+        for plan in plans:
+            started = time.perf_counter()
+            flagged += len(repeated_days(plan_entries(plan)))
+            timings.append(time.perf_counter() - started)
+        print(f"{days:>3} days: {_percentiles(timings)}  repeated days per plan {flagged / len(plans):.2f}")
+
+def bench_api(args) -> None:
+    """HTTP API under load: job latency and time to the first streamed token, on the fake OpenAI."""
+    import json
+    import threading
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.serving import make_server
+    from fake_openai import FakeOpenAI
+
+    db_path = _use_temp_database()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{db_path}')
+    fake = FakeOpenAI(latency=args.latency).start()
+    os.environ['OPENAI_BASE_URL'] = fake.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    os.environ['API_WORKERS'] = str(args.workers)
+    os.environ['API_KEYS'] = json.dumps({'bench': {
+        'name': 'bench', 'rate_per_minute': 60 * args.jobs, 'burst': args.jobs, 'max_pending': args.jobs
+    }})
+    from app import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/api/v1"
+    headers = {'Authorization': 'Bearer bench', 'Content-Type': 'application/json'}
+
+    def run_job(index: int):
+        started = time.monotonic()
+        body = {'kind': 'plan', 'profile': {'topic': f'Тема {index}', 'audience': 'Предприниматели'}, 'days': args.days}
+        with urllib.request.urlopen(urllib.request.Request(f"{base_url}/jobs", json.dumps(body).encode(), headers)) as r:
+            job_id = json.loads(r.read())['id']
+        accepted = time.monotonic() - started
+        first_token, result = None, False
+        with urllib.request.urlopen(urllib.request.Request(f"{base_url}/jobs/{job_id}/events", headers=headers)) as r:
+            for line in r:
+                if first_token is None and line.startswith(b'event: token'):
+                    first_token = time.monotonic() - started
+                if line.startswith((b'event: result', b'event: error')):
+                    result = line.startswith(b'event: result')
+                    break
+        return accepted, first_token or 0.0, time.monotonic() - started, result
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(args.clients) as clients:
+        results = list(clients.map(run_job, range(args.jobs)))
+    elapsed = time.monotonic() - started
+    server.shutdown()
+    fake.stop()
+
+    print(f"{args.jobs} {args.days}-day plan jobs from {args.clients} clients, {args.workers} API workers, "
+          f"generation latency {args.latency}s")
+    print(f"succeeded:     {sum(result[3] for result in results)}")
+    print(f"jobs/s:        {args.jobs / elapsed:.2f}")
+    print(f"accepted in    {_percentiles([result[0] for result in results])}")
+    print(f"first token    {_percentiles([result[1] for result in results])}")
+    print(f"done in        {_percentiles([result[2] for result in results])}")
+    print(f"peak in-flight generation requests: {fake.stats()['peak_in_flight']}")
+
+BENCHMARKS = {
+    'workers': bench_workers,
+    'runtimes': bench_runtimes,
+    'sessions': bench_sessions,
+    'storage': bench_storage,
+    'broadcast': bench_broadcast,
+    'budget': bench_budget,
+    'autopost': bench_autopost,
+    'search': bench_search,
+    'similarity': bench_similarity,
+    'api': bench_api,
+}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Run a local benchmark")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    workers = subparsers.add_parser('workers', help="sharded multi-process runtime throughput")
+    workers.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    workers.add_argument('--chats', type=int, default=500)
+    workers.add_argument('--warmup', type=float, default=5.0, help="seconds to wait for workers to boot")
+    workers.add_argument('--timeout', type=float, default=120.0)
+
+    runtimes = subparsers.add_parser('runtimes', help="threaded vs asyncio in-flight capacity")
+    runtimes.add_argument('--runtime', choices=['threaded', 'async'], required=True)
+    runtimes.add_argument('--sessions', type=int, default=200)
+    runtimes.add_argument('--latency', type=float, default=1.0, help="fake OpenAI latency in seconds")
+    runtimes.add_argument('--threads', type=int, default=4, help="Dispatcher workers (threaded runtime)")
+    runtimes.add_argument('--timeout', type=float, default=600.0)
+
+    sessions = subparsers.add_parser('sessions', help="memory per session before/after eviction")
+    sessions.add_argument('--sessions', type=int, default=10_000)
+    sessions.add_argument('--examples', type=int, default=5, help="example posts per session")
+    sessions.add_argument('--example-chars', type=int, default=1500)
+    sessions.add_argument('--idle', type=float, default=1800.0, help="idle timeout in seconds")
+    sessions.add_argument('--max-sessions', type=int, default=5000)
+
+    storage = subparsers.add_parser('storage', help="database size and read latency of stored examples")
+    storage.add_argument('--users', type=int, default=5000)
+    storage.add_argument('--examples', type=int, default=5)
+    storage.add_argument('--example-chars', type=int, default=2000)
+    storage.add_argument('--duplicates', type=float, default=0.5, help="share of repeated example posts")
+    storage.add_argument('--reads', type=int, default=2000)
+
+    broadcast = subparsers.add_parser('broadcast', help="rate-limited broadcast throughput")
+    broadcast.add_argument('--users', type=int, default=3000)
+    broadcast.add_argument('--rate', type=float, default=25.0, help="messages per second to aim for")
+    broadcast.add_argument('--concurrency', type=int, default=8)
+    broadcast.add_argument('--page-size', type=int, default=200)
+    broadcast.add_argument('--send-latency', type=float, default=0.1, help="fake sendMessage latency")
+    broadcast.add_argument('--rate-limit', type=float, default=30.0, help="fake answers 429 above this")
+    broadcast.add_argument('--blocked', type=float, default=0.05, help="share of users who blocked the bot")
+
+    budget = subparsers.add_parser('budget', help="prompt token distribution before/after field budgets")
+    budget.add_argument('--users', type=int, default=1000)
+    budget.add_argument('--oversized', type=float, default=0.1, help="share of users who paste a whole sales page")
+
+    autopost = subparsers.add_parser('autopost', help="autopost poll cost over many schedules")
+    autopost.add_argument('--schedules', type=int, default=100_000)
+    autopost.add_argument('--polls', type=int, default=200)
+
+    search = subparsers.add_parser('search', help="/search latency over a large generation history")
+    search.add_argument('--posts', type=int, default=300_000)
+    search.add_argument('--users', type=int, default=3000)
+    search.add_argument('--heavy-posts', type=int, default=20_000, help="posts of the one agency-sized user")
+    search.add_argument('--post-chars', type=int, default=1000)
+    search.add_argument('--queries', type=int, default=200)
+
+    similarity = subparsers.add_parser('similarity', help="near-duplicate check time per plan")
+    similarity.add_argument('--plans', type=int, default=200)
+
+    api = subparsers.add_parser('api', help="HTTP generation API under concurrent clients")
+    api.add_argument('--jobs', type=int, default=200)
+    api.add_argument('--clients', type=int, default=50, help="concurrent clients, each streaming its job")
+    api.add_argument('--workers', type=int, default=8, help="API_WORKERS")
+    api.add_argument('--days', type=int, default=14)
+    api.add_argument('--latency', type=float, default=0.5, help="fake OpenAI latency in seconds")
+
+    args = parser.parse_args()
+    try:
+        BENCHMARKS[args.benchmark](args)
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,323 @@
+"""Admin broadcasts to every user in the users table.
+
+`/broadcast <text>` (or as a reply to a message) queues a broadcast; chat_ids
+are read from users in pages ordered by chat_id and sent through a shared
+TokenBucket by a small thread pool. After each page the cursor and counters
+are committed to the broadcasts table, so a restart resumes after the last
+finished page (at most one page can be sent twice). Users who blocked the bot
+or deleted their chat get users.blocked_at and are skipped from then on;
+saving their profile again (they came back) clears it. A broadcast goes to
+the users of the tenant it was created in (see tenants.py).
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from telegram import Bot, Update
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+from telegram.ext import CallbackContext, CommandHandler, Dispatcher, DispatcherHandlerStop
+from telegram.utils.request import Request
+from database import DB_PATH, current_tenant
+from ratelimit import TokenBucket
+from utils import is_admin
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second to different chats
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '8'))
+BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', '200'))
+MAX_SEND_ATTEMPTS = 3
+# BadRequest descriptions that mean the chat is gone for good
+GONE_CHAT_ERRORS = ('chat not found', 'user is deactivated', 'peer_id_invalid', 'bot was kicked')
+
+STATUS_LABELS = {
+    'running': 'идёт',
+    'done': 'завершена',
+    'cancelled': 'отменена',
+}
+
+# broadcast id -> Broadcaster running in this process
+_running: Dict[int, 'Broadcaster'] = {}
+_running_lock = threading.Lock()
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def create_broadcast(text: str, created_by: int) -> int:
+    """Insert a running broadcast for every reachable user. Returns its id."""
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            tenant_id = current_tenant()
+            total = conn.execute(
+                'SELECT COUNT(*) FROM users WHERE tenant_id = ? AND chat_id > 0 AND blocked_at IS NULL',
+                (tenant_id,)
+            ).fetchone()[0]
+            cursor = conn.execute('''
+                INSERT INTO broadcasts (tenant_id, text, created_by, status, total)
+                VALUES (?, ?, ?, 'running', ?)
+            ''', (tenant_id, text, created_by, total))
+        logger.info(f"Broadcast {cursor.lastrowid} created for {total} users")
+        return cursor.lastrowid
+    finally:
+        if conn:
+            conn.close()
+
+def get_broadcast(broadcast_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """A broadcast of the current tenant by id, or its latest one."""
+    conn = None
+    try:
+        conn = _connect()
+        if broadcast_id is None:
+            row = conn.execute(
+                'SELECT * FROM broadcasts WHERE tenant_id = ? ORDER BY id DESC LIMIT 1', (current_tenant(),)
+            ).fetchone()
+        else:
+            row = conn.execute(
+                'SELECT * FROM broadcasts WHERE id = ? AND tenant_id = ?', (broadcast_id, current_tenant())
+            ).fetchone()
+        return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Error reading broadcast {broadcast_id}: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def set_broadcast_status(broadcast_id: int, status: str) -> None:
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('''
+                UPDATE broadcasts SET status = ?, updated_at = CURRENT_TIMESTAMP,
+                    finished_at = CASE WHEN ? = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END
+                WHERE id = ?
+            ''', (status, status, broadcast_id))
+    finally:
+        if conn:
+            conn.close()
+
+def _sending_bot(bot: Bot, concurrency: int) -> Bot:
+    """Bot with its own connection pool, so a broadcast doesn't starve the handlers."""
+    # Bot.base_url already ends with the token
+    base_url = bot.base_url[:-len(bot.token)]
+    return Bot(bot.token, base_url=base_url, request=Request(con_pool_size=concurrency + 1))
+
+class Broadcaster:
+    """Sends one broadcast page by page, committing progress after each page."""
+
+    def __init__(self, bot: Bot, broadcast_id: int, rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY, page_size: int = BROADCAST_PAGE_SIZE):
+        self.bot = _sending_bot(bot, concurrency)
+        self.broadcast_id = broadcast_id
+        # run() is on a thread of its own, outside the creator's tenant scope
+        self.tenant_id = current_tenant()
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.bucket = TokenBucket(rate)
+        self.throttled = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'Broadcaster':
+        with _running_lock:
+            _running[self.broadcast_id] = self
+        self._thread = threading.Thread(
+            target=self.run, name=f'broadcast-{self.broadcast_id}', daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread:
+            self._thread.join(timeout)
+
+    def deliver(self, chat_id: int, text: str) -> str:
+        """Send to one chat: 'sent', 'blocked' (chat unreachable for good) or 'failed'."""
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=True)
+                return 'sent'
+            except RetryAfter as e:
+                # Flood limit: stop every sender, then retry this chat
+                self.throttled += 1
+                logger.warning(f"Broadcast {self.broadcast_id} throttled for {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+            except Unauthorized:
+                return 'blocked'
+            except BadRequest as e:
+                if any(error in e.message.lower() for error in GONE_CHAT_ERRORS):
+                    return 'blocked'
+                logger.warning(f"Broadcast {self.broadcast_id} to {chat_id} failed: {e.message}")
+                return 'failed'
+            except NetworkError as e:
+                logger.warning(f"Broadcast {self.broadcast_id} to {chat_id}, attempt {attempt + 1}: {e}")
+                time.sleep(2 ** attempt)
+        return 'failed'
+
+    def _next_page(self, conn, cursor: int) -> List[int]:
+        rows = conn.execute('''
+            SELECT chat_id FROM users
+            WHERE tenant_id = ? AND chat_id > ? AND blocked_at IS NULL
+            ORDER BY chat_id
+            LIMIT ?
+        ''', (self.tenant_id, cursor, self.page_size)).fetchall()
+        return [row[0] for row in rows]
+
+    def _commit_page(self, conn, cursor: int, results: Dict[int, str]) -> None:
+        outcomes = list(results.values())
+        blocked = [chat_id for chat_id, outcome in results.items() if outcome == 'blocked']
+        with conn:
+            conn.execute('''
+                UPDATE broadcasts SET
+                    cursor = ?, sent = sent + ?, blocked = blocked + ?, failed = failed + ?,
+                    throttled = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (
+                cursor, outcomes.count('sent'), len(blocked), outcomes.count('failed'),
+                self.throttled, self.broadcast_id
+            ))
+            conn.executemany(
+                'UPDATE users SET blocked_at = CURRENT_TIMESTAMP WHERE tenant_id = ? AND chat_id = ?',
+                [(self.tenant_id, chat_id) for chat_id in blocked]
+            )
+        metrics.incr('broadcast.sent', outcomes.count('sent'))
+        metrics.incr('broadcast.blocked', len(blocked))
+        metrics.incr('broadcast.failed', outcomes.count('failed'))
+
+    def run(self) -> None:
+        conn = None
+        try:
+            conn = _connect()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while True:
+                    broadcast = conn.execute(
+                        'SELECT status, cursor, text, throttled FROM broadcasts WHERE id = ?',
+                        (self.broadcast_id,)
+                    ).fetchone()
+                    if broadcast is None or broadcast['status'] != 'running':
+                        logger.info(f"Broadcast {self.broadcast_id} stopped")
+                        return
+                    self.throttled = max(self.throttled, broadcast['throttled'])
+                    page = self._next_page(conn, broadcast['cursor'])
+                    if not page:
+                        break
+                    outcomes = executor.map(lambda chat_id: self.deliver(chat_id, broadcast['text']), page)
+                    self._commit_page(conn, page[-1], dict(zip(page, outcomes)))
+            set_broadcast_status(self.broadcast_id, 'done')
+            logger.info(f"Broadcast {self.broadcast_id} finished")
+        except Exception as e:
+            logger.error(f"Broadcast {self.broadcast_id} crashed, it resumes on restart: {e}", exc_info=True)
+        finally:
+            if conn:
+                conn.close()
+            with _running_lock:
+                _running.pop(self.broadcast_id, None)
+
+def resume_broadcasts(bot: Bot) -> List[int]:
+    """Restart the current tenant's broadcasts left running by a previous process."""
+    conn = None
+    try:
+        conn = _connect()
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM broadcasts WHERE status = 'running' AND tenant_id = ?", (current_tenant(),)
+        )]
+    except Exception as e:
+        logger.error(f"Error loading running broadcasts: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+    for broadcast_id in ids:
+        with _running_lock:
+            if broadcast_id in _running:
+                continue
+        logger.info(f"Resuming broadcast {broadcast_id}")
+        Broadcaster(bot, broadcast_id).start()
+    return ids
+
+def _elapsed_seconds(broadcast: Dict[str, Any]) -> float:
+    end = broadcast['finished_at'] or broadcast['updated_at']
+    return (datetime.fromisoformat(end) - datetime.fromisoformat(broadcast['created_at'])).total_seconds()
+
+def format_broadcast(broadcast: Dict[str, Any]) -> str:
+    done = broadcast['sent'] + broadcast['blocked'] + broadcast['failed']
+    elapsed = _elapsed_seconds(broadcast)
+    rate = f"{done / elapsed:.1f}" if elapsed > 0 else '—'
+    return (
+        f"📣 Рассылка #{broadcast['id']}: {STATUS_LABELS.get(broadcast['status'], broadcast['status'])}\n"
+        f"Обработано: {done} из {broadcast['total']}\n"
+        f"✅ Доставлено: {broadcast['sent']}\n"
+        f"🚫 Бот заблокирован / чат удалён: {broadcast['blocked']}\n"
+        f"⚠️ Ошибки: {broadcast['failed']}\n"
+        f"⏱ Ограничений Telegram (429): {broadcast['throttled']}\n"
+        f"Скорость: {rate} сообщ./с"
+    )
+
+def broadcast_command(update: Update, context: CallbackContext) -> None:
+    """/broadcast <text>, or as a reply to the message to send."""
+    if not is_admin(update.effective_user.id):
+        return
+    message = update.message
+    parts = (message.text or '').split(None, 1)
+    text = parts[1] if len(parts) > 1 else ''
+    if not text and message.reply_to_message:
+        text = message.reply_to_message.text or ''
+    if not text.strip():
+        message.reply_text("Использование: /broadcast <текст> или ответ на сообщение командой /broadcast")
+        raise DispatcherHandlerStop()
+
+    latest = get_broadcast()
+    if latest and latest['status'] == 'running':
+        message.reply_text(
+            f"Рассылка #{latest['id']} ещё идёт. /broadcast_status — прогресс, "
+            f"/broadcast_cancel {latest['id']} — отменить."
+        )
+        raise DispatcherHandlerStop()
+
+    broadcast_id = create_broadcast(text, update.effective_user.id)
+    Broadcaster(context.bot, broadcast_id).start()
+    message.reply_text(f"📣 Рассылка #{broadcast_id} запущена. /broadcast_status — прогресс.")
+    raise DispatcherHandlerStop()
+
+def broadcast_status_command(update: Update, context: CallbackContext) -> None:
+    """/broadcast_status [id]"""
+    if not is_admin(update.effective_user.id):
+        return
+    broadcast_id = int(context.args[0]) if context.args and context.args[0].isdigit() else None
+    broadcast = get_broadcast(broadcast_id)
+    update.message.reply_text(format_broadcast(broadcast) if broadcast else "Рассылок ещё не было.")
+    raise DispatcherHandlerStop()
+
+def broadcast_cancel_command(update: Update, context: CallbackContext) -> None:
+    """/broadcast_cancel <id> - the sender stops after the current page."""
+    if not is_admin(update.effective_user.id):
+        return
+    broadcast_id = int(context.args[0]) if context.args and context.args[0].isdigit() else None
+    broadcast = get_broadcast(broadcast_id)
+    if not broadcast or broadcast['status'] != 'running':
+        update.message.reply_text("Нет такой активной рассылки.")
+    else:
+        set_broadcast_status(broadcast['id'], 'cancelled')
+        update.message.reply_text(f"Рассылка #{broadcast['id']} отменена.")
+    raise DispatcherHandlerStop()
+
+def install_broadcasts(dispatcher: Dispatcher, group: int = 0) -> None:
+    """Register the admin commands and resume unfinished broadcasts.
+
+    Call it in exactly one process: the one that owns the Updater.
+    """
+    dispatcher.add_handler(CommandHandler('broadcast', broadcast_command), group=group)
+    dispatcher.add_handler(CommandHandler('broadcast_status', broadcast_status_command), group=group)
+    dispatcher.add_handler(CommandHandler('broadcast_cancel', broadcast_cancel_command), group=group)
+    resume_broadcasts(dispatcher.bot)
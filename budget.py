@@ -0,0 +1,260 @@
+"""Token budgets for the questionnaire fields pasted into every prompt.
+
+Each field has a budget (FIELD_TOKEN_BUDGETS) and all of them together
+PROMPT_TOTAL_BUDGET. A field over its budget is compacted once, by trimming
+to whole sentences (PROMPT_BUDGET_MODE=trim, the default) or by a one-off
+summary on the 'summary' route (summarize). The compact text is cached by
+content hash in field_summaries and in memory, so every later plan or post of
+that user reuses it. Fields within budget are passed through untouched.
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated.
+"""
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from backends import estimate_tokens, get_router
+from database import pack_text, unpack_text
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FIELD_TOKEN_BUDGETS = {
+    'topic': 100,
+    'audience': 200,
+    'monetization': 50,
+    'product_details': 600,
+    'preferences': 300,
+    'style': 150,
+    'emotions': 150,
+    # Product repackaging answers
+    'tool': 300,
+    'result': 300,
+}
+FIELD_TOKEN_BUDGETS.update(json.loads(os.getenv('PROMPT_FIELD_BUDGETS') or '{}'))
+PROMPT_TOTAL_BUDGET = int(os.getenv('PROMPT_TOTAL_BUDGET', '1500'))
+PROMPT_BUDGET_MODE = os.getenv('PROMPT_BUDGET_MODE', 'trim')
+# A field is never squeezed below this by the total budget
+MIN_FIELD_TOKENS = 40
+MEMORY_CACHE_SIZE = 2048
+# Longer texts have their token count memoized by digest (counting them is the slow part)
+MEMO_MIN_CHARS = 2000
+
+FIELD_LABELS = {
+    'topic': 'тема канала',
+    'audience': 'целевая аудитория',
+    'monetization': 'метод монетизации',
+    'product_details': 'описание продукта/услуги',
+    'preferences': 'пожелания к контенту',
+    'style': 'стиль написания',
+    'emotions': 'желаемые эмоции аудитории',
+    'tool': 'инструмент',
+    'result': 'результат для клиента',
+}
+
+SENTENCE_BREAK = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+_encoding = None
+_memory_cache: 'OrderedDict[str, str]' = OrderedDict()
+_token_memo: 'OrderedDict[bytes, int]' = OrderedDict()
+_memory_lock = threading.Lock()
+
+def count_tokens(text: str) -> int:
+    """Tokens in `text` for gpt-4o (tiktoken), or an estimate without it."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('o200k_base')
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return estimate_tokens(text)
+
+def _field_tokens(text: str) -> int:
+    """count_tokens, memoized for long texts: every prompt build counts the same fields."""
+    if len(text) < MEMO_MIN_CHARS:
+        return count_tokens(text)
+    digest = hashlib.sha1(text.encode('utf-8')).digest()
+    with _memory_lock:
+        if digest in _token_memo:
+            _token_memo.move_to_end(digest)
+            return _token_memo[digest]
+    tokens = count_tokens(text)
+    with _memory_lock:
+        _token_memo[digest] = tokens
+        while len(_token_memo) > MEMORY_CACHE_SIZE * 4:
+            _token_memo.popitem(last=False)
+    return tokens
+
+def _normalize(text: str) -> str:
+    """Collapse whitespace and drop repeated lines (pasted pages repeat a lot)."""
+    seen = set()
+    lines = []
+    for line in text.splitlines():
+        line = ' '.join(line.split())
+        if line and line not in seen:
+            seen.add(line)
+            lines.append(line)
+    return '\n'.join(lines)
+
+def trim_to_tokens(text: str, budget: int) -> str:
+    """Keep whole sentences from the start of `text` while they fit the budget."""
+    text = _normalize(text)
+    if count_tokens(text) <= budget:
+        return text
+    kept, used = [], 1
+    for piece in SENTENCE_BREAK.split(text):
+        cost = count_tokens(piece) + 1
+        if used + cost > budget:
+            if not kept:
+                # One endless sentence: cut it by words instead
+                for word in piece.split():
+                    used += count_tokens(word) + 1
+                    if used > budget:
+                        break
+                    kept.append(word)
+            break
+        kept.append(piece)
+        used += cost
+    return ' '.join(kept) + ' …'
+
+def build_summary_prompt(field: str, text: str, budget: int) -> str:
+    words = max(20, int(budget * 0.6))
+    return f"""
+        Сократи текст ниже примерно до {words} слов.
+        Сохрани то, что важно для маркетинга: что это за продукт, для кого он, цены,
+        результаты клиентов и отличия от конкурентов.
+        Ответ только сжатым текстом на русском языке, без вступления и пояснений.
+
+        Текст ({FIELD_LABELS.get(field, field)}):
+        {text}
+        """
+
+def _cache_key(field: str, text: str, budget: int, mode: str) -> str:
+    return hashlib.sha256(f"{mode}:{field}:{budget}:{text}".encode('utf-8')).hexdigest()
+
+def _load_cached(key: str) -> Optional[str]:
+    with _memory_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key]
+    conn = None
+    try:
+        conn = sqlite3.connect(database.DB_PATH)
+        row = conn.execute('SELECT body FROM field_summaries WHERE hash = ?', (key,)).fetchone()
+    except Exception as e:
+        logger.error(f"Error reading field summary: {e}")
+        row = None
+    finally:
+        if conn:
+            conn.close()
+    if row is None:
+        return None
+    compact = unpack_text(row[0])
+    _remember(key, compact)
+    return compact
+
+def _remember(key: str, compact: str) -> None:
+    with _memory_lock:
+        _memory_cache[key] = compact
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+def _store(key: str, field: str, mode: str, source_tokens: int, compact: str) -> None:
+    _remember(key, compact)
+    conn = None
+    try:
+        conn = sqlite3.connect(database.DB_PATH)
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO field_summaries (hash, field, mode, source_tokens, tokens, body)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, field, mode, source_tokens, count_tokens(compact), pack_text(compact)))
+    except Exception as e:
+        logger.error(f"Error saving field summary: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def _finish(field: str, text: str, budget: int, mode: str, key: str, summary: Optional[str]) -> str:
+    source_tokens = _field_tokens(text)
+    # A summary that ignored the length, or no summary at all, still gets trimmed
+    compact = trim_to_tokens(summary or text, budget)
+    _store(key, field, mode, source_tokens, compact)
+    metrics.incr('budget.compacted_fields')
+    metrics.incr('budget.tokens_saved', source_tokens - count_tokens(compact))
+    logger.info(f"Compacted {field}: {source_tokens} -> {count_tokens(compact)} tokens ({mode})")
+    return compact
+
+def compact_field(field: str, text: str, budget: int, mode: str = PROMPT_BUDGET_MODE) -> str:
+    """`text` if it fits `budget`, else its cached or freshly made compact version."""
+    if not text or _field_tokens(text) <= budget:
+        return text
+    key = _cache_key(field, text, budget, mode)
+    cached = _load_cached(key)
+    if cached is not None:
+        metrics.incr('budget.cache_hits')
+        return cached
+    summary = None
+    if mode == 'summarize':
+        try:
+            summary = get_router().complete('summary', build_summary_prompt(field, text, budget)).text.strip()
+            metrics.incr('budget.summaries')
+        except Exception as e:
+            logger.error(f"Summarizing {field} failed, trimming instead: {e}")
+    return _finish(field, text, budget, mode, key, summary)
+
+async def acompact_field(field: str, text: str, budget: int, mode: str = PROMPT_BUDGET_MODE) -> str:
+    """Async version of compact_field."""
+    if not text or _field_tokens(text) <= budget:
+        return text
+    key = _cache_key(field, text, budget, mode)
+    cached = _load_cached(key)
+    if cached is not None:
+        metrics.incr('budget.cache_hits')
+        return cached
+    summary = None
+    if mode == 'summarize':
+        try:
+            completion = await get_router().acomplete('summary', build_summary_prompt(field, text, budget))
+            summary = completion.text.strip()
+            metrics.incr('budget.summaries')
+        except Exception as e:
+            logger.error(f"Summarizing {field} failed, trimming instead: {e}")
+    return _finish(field, text, budget, mode, key, summary)
+
+def _field_budgets(user_data: Dict[str, Any]) -> Dict[str, int]:
+    """Per-field budgets; over the total budget the largest fields are capped first."""
+    budgets = {}
+    for field, budget in FIELD_TOKEN_BUDGETS.items():
+        if isinstance(user_data.get(field), str) and user_data[field]:
+            budgets[field] = min(budget, _field_tokens(user_data[field]))
+    if not budgets:
+        return budgets
+    level = max(budgets.values())
+    while sum(min(budget, level) for budget in budgets.values()) > PROMPT_TOTAL_BUDGET and level > MIN_FIELD_TOKENS:
+        level = max(MIN_FIELD_TOKENS, int(level * 0.9))
+    return {field: min(budget, level) for field, budget in budgets.items()}
+
+def compact_profile(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of user_data with every prompt field within its budget."""
+    compact = dict(user_data)
+    for field, budget in _field_budgets(user_data).items():
+        compact[field] = compact_field(field, user_data[field], budget)
+    return compact
+
+async def acompact_profile(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Async version of compact_profile."""
+    compact = dict(user_data)
+    for field, budget in _field_budgets(user_data).items():
+        compact[field] = await acompact_field(field, user_data[field], budget)
+    return compact
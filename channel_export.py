@@ -0,0 +1,204 @@
+"""Example posts imported from a Telegram Desktop channel export (result.json).
+
+Power users have hundreds of posts to learn from, and forwarding them one by
+one costs a round trip each. In the EXAMPLES step they can send the
+result.json of "Export chat history" (JSON format) as a document instead.
+
+The export is read as a stream: the top-level object is walked key by key
+and each element of its "messages" array is decoded on its own with
+JSONDecoder.raw_decode from a small rolling buffer, so memory stays flat
+however long the channel history is. Rich text (a list of plain strings
+and entity objects) is flattened to plain text; service messages, forwards
+and posts without enough text are skipped. A reservoir sample of
+EXPORT_RESERVOIR posts is kept while reading, and similarity.representative()
+picks the examples from it.
+
+The Bot API lets bots download files up to 20 MB. Bigger exports need a
+local Bot API server (TELEGRAM_API_BASE_URL) and a higher EXPORT_MAX_MB;
+with one, the file is read where the server stored it.
+"""
+import os
+import json
+import codecs
+import random
+import logging
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from similarity import representative
+
+logger = logging.getLogger(__name__)
+
+# 20 MB is the Bot API download limit; raise it with a local Bot API server
+EXPORT_MAX_MB = float(os.getenv('EXPORT_MAX_MB', '20'))
+# Posts kept as candidates while reading; the examples are picked among them
+EXPORT_RESERVOIR = int(os.getenv('EXPORT_RESERVOIR', '200'))
+# Shorter posts (announcements, "good morning") say little about the style
+EXPORT_MIN_CHARS = int(os.getenv('EXPORT_MIN_CHARS', '150'))
+READ_CHUNK_BYTES = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+class ExportFormatError(ValueError):
+    """The file is not a Telegram Desktop JSON export."""
+
+class _Stream:
+    """Decoded text of a binary file, read into a buffer as the parser needs it."""
+
+    def __init__(self, fileobj: BinaryIO, chunk_size: int = READ_CHUNK_BYTES):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Read one more chunk, dropping what was consumed. False at the end of the file."""
+        if self.eof:
+            return False
+        chunk = self.fileobj.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:] + self.decoder.decode(chunk, final=self.eof)
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character that isn't whitespace, '' at the end of the file."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer) or not self.fill():
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ExportFormatError(f"Expected {char!r}, found {self.peek()!r}")
+        self.position += 1
+
+    def value(self, decoder=json.JSONDecoder()) -> Any:
+        """Decode the next JSON value, reading more of the file until it is complete.
+
+        A value ending right at the end of the buffer may be cut (a number),
+        so it only counts once something follows it.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.position)
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ExportFormatError(f"Broken JSON: {e}") from None
+            self.fill()
+
+def _object_keys(stream: _Stream) -> Iterator[str]:
+    """Keys of the object starting at the stream, leaving it before each value."""
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.position += 1
+        return
+    while True:
+        key = stream.value()
+        if not isinstance(key, str):
+            raise ExportFormatError("Expected an object key")
+        stream.expect(':')
+        yield key
+        if stream.peek() == ',':
+            stream.position += 1
+            continue
+        stream.expect('}')
+        return
+
+def _array_items(stream: _Stream) -> Iterator[Any]:
+    stream.expect('[')
+    if stream.peek() == ']':
+        stream.position += 1
+        return
+    while True:
+        yield stream.value()
+        if stream.peek() == ',':
+            stream.position += 1
+            continue
+        stream.expect(']')
+        return
+
+def iter_export(fileobj: BinaryIO, header: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """The messages of a result.json export, one at a time.
+
+    Top-level values other than "messages" (channel name, type, id) go to
+    `header` as they are met; in Telegram's exports they come first.
+    """
+    stream = _Stream(fileobj)
+    if stream.peek() != '{':
+        raise ExportFormatError("Not a JSON object")
+    found = False
+    for key in _object_keys(stream):
+        if key != 'messages':
+            value = stream.value()
+            if header is not None:
+                header[key] = value
+            continue
+        found = True
+        for message in _array_items(stream):
+            if isinstance(message, dict):
+                yield message
+    if not found:
+        raise ExportFormatError("No messages in the export")
+
+def message_text(message: Dict[str, Any]) -> str:
+    """Plain text of an exported message: the rich text list flattened."""
+    text = message.get('text')
+    if isinstance(text, list):
+        return ''.join(part if isinstance(part, str) else str(part.get('text') or '') for part in text)
+    return text if isinstance(text, str) else ''
+
+def post_text(message: Dict[str, Any], min_chars: int = EXPORT_MIN_CHARS) -> Optional[str]:
+    """Text of a post worth learning from: the channel's own, long enough. None otherwise."""
+    if message.get('type') != 'message' or message.get('forwarded_from'):
+        return None
+    text = message_text(message).strip()
+    return text if len(text) >= min_chars else None
+
+def sample_posts(fileobj: BinaryIO, count: int, reservoir_size: int = EXPORT_RESERVOIR,
+                 max_chars: Optional[int] = None, seed: Optional[int] = None
+                 ) -> Tuple[List[str], Dict[str, Any]]:
+    """(`count` representative posts in channel order, stats) of an export.
+
+    Reads the file once. Posts are cut to `max_chars` as they are sampled,
+    so memory depends on the reservoir, not on the file.
+    """
+    rng = random.Random(seed)
+    header: Dict[str, Any] = {}
+    reservoir: List[Tuple[int, str]] = []
+    stats = {'messages': 0, 'posts': 0}
+    for message in iter_export(fileobj, header):
+        stats['messages'] += 1
+        text = post_text(message)
+        if text is None:
+            continue
+        if max_chars:
+            text = text[:max_chars]
+        # Algorithm R: every post ends up in the reservoir with equal odds
+        if len(reservoir) < reservoir_size:
+            reservoir.append((stats['posts'], text))
+        else:
+            slot = rng.randrange(stats['posts'] + 1)
+            if slot < reservoir_size:
+                reservoir[slot] = (stats['posts'], text)
+        stats['posts'] += 1
+    stats['channel'] = header.get('name') or ''
+    candidates = dict(reservoir)
+    return [candidates[number] for number in representative(candidates, count)], stats
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Example posts picked from a Telegram Desktop channel export")
+    parser.add_argument('path', help="result.json of the export")
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    with open(args.path, 'rb') as f:
+        posts, stats = sample_posts(f, args.count, seed=args.seed)
+    print(json.dumps({'stats': stats, 'examples': posts}, indent=2, ensure_ascii=False))
@@ -1,20 +1,124 @@
+import os
+import zlib
 import sqlite3
+import hashlib
 import json
 import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Union
 
 logger = logging.getLogger(__name__)
 
+DB_PATH = os.getenv('BOT_DB_PATH', 'bot.db')
+
+# Ingest limits for example posts, enforced here and in handle_example_post
+MAX_EXAMPLES = int(os.getenv('MAX_EXAMPLES', '10'))
+MAX_EXAMPLE_CHARS = int(os.getenv('MAX_EXAMPLE_CHARS', '4000'))
+# Text values at least this long (in UTF-8 bytes) are stored zlib-compressed
+COMPRESS_MIN_BYTES = int(os.getenv('DB_COMPRESS_MIN_BYTES', '256'))
+
+# Columns added after the first release; older bot.db files are migrated in init_db
+USERS_MIGRATIONS = {
+    'tone_of_voice': 'TEXT',
+    'saved_audience': 'TEXT',
+    'content_theme': 'TEXT',
+    'last_interaction': 'TIMESTAMP',
+    'plan_days': 'INTEGER DEFAULT 14',
+    # Set when a broadcast finds the bot blocked or the chat deleted
+    'blocked_at': 'TIMESTAMP',
+}
+
+# Tenant whose rows are read and written; tenants.py sets it per thread, '' when
+# the process runs a single bot (and for every row written before tenants existed)
+_tenant: contextvars.ContextVar = contextvars.ContextVar('tenant', default='')
+
+def current_tenant() -> str:
+    return _tenant.get()
+
+@contextmanager
+def tenant_scope(tenant_id: str):
+    """Run the block as `tenant_id`."""
+    token = _tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+def _create_tenant_table(c, table: str, create_sql: str) -> None:
+    """Create a table keyed by tenant_id, rebuilding one from before tenants existed.
+
+    Its rows are copied under tenant ''; the key can't be changed in place.
+    """
+    c.execute(create_sql)
+    columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})')]
+    if 'tenant_id' in columns:
+        return
+    c.execute(f'ALTER TABLE {table} RENAME TO {table}_single')
+    c.execute(create_sql)
+    names = ', '.join(columns)
+    c.execute(f'INSERT INTO {table} ({names}) SELECT {names} FROM {table}_single')
+    c.execute(f'DROP TABLE {table}_single')
+    logger.info(f"Rebuilt {table} with a tenant_id key")
+
+def _add_tenant_column(c, table: str) -> None:
+    if 'tenant_id' not in {row[1] for row in c.execute(f'PRAGMA table_info({table})')}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN tenant_id TEXT NOT NULL DEFAULT ''")
+        logger.info(f"Added missing column {table}.tenant_id")
+
+def _add_missing_columns(c, table: str) -> None:
+    existing = {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+    for column, column_type in USERS_MIGRATIONS.items():
+        if column not in existing:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+            logger.info(f"Added missing column {table}.{column}")
+
+def _migrate_users_table(c) -> None:
+    """Add columns missing from databases created by older versions."""
+    _add_missing_columns(c, 'users')
+    # ADD COLUMN can't use CURRENT_TIMESTAMP as default, so backfill it once
+    c.execute('UPDATE users SET last_interaction = CURRENT_TIMESTAMP WHERE last_interaction IS NULL')
+
+def pack_text(text: str) -> Union[str, bytes]:
+    """Value to store for a long text column: zlib BLOB if large, else the text."""
+    encoded = text.encode('utf-8')
+    if len(encoded) < COMPRESS_MIN_BYTES:
+        return text
+    return zlib.compress(encoded, 6)
+
+def unpack_text(value: Union[str, bytes, None]) -> str:
+    """Inverse of pack_text. Plain TEXT values (and old rows) are returned as is."""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value or ''
+
+def example_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def limit_examples(examples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Apply MAX_EXAMPLES / MAX_EXAMPLE_CHARS to an examples list."""
+    return [
+        {**example, 'text': (example.get('text') or '')[:MAX_EXAMPLE_CHARS]}
+        for example in examples[:MAX_EXAMPLES]
+    ]
+
 def init_db():
     """Initialize the SQLite database."""
     conn = None
     try:
-        conn = sqlite3.connect('bot.db')
+        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
 
+        # Only takes effect for a fresh database file; maintenance.py can convert old ones
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # WAL lets several processes read while one of them writes
+        c.execute('PRAGMA journal_mode = WAL')
+
         # Create users table with extended fields
-        c.execute('''
+        _create_tenant_table(c, 'users', '''
             CREATE TABLE IF NOT EXISTS users (
-                chat_id INTEGER PRIMARY KEY,
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
                 channel_topic TEXT,
                 target_audience TEXT,
                 monetization TEXT,
@@ -27,7 +131,291 @@ def init_db():
                 tone_of_voice TEXT,
                 saved_audience TEXT,
                 content_theme TEXT,
-                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                plan_days INTEGER DEFAULT 14,
+                blocked_at TIMESTAMP,
+                PRIMARY KEY (tenant_id, chat_id)
+            )
+        ''')
+        _migrate_users_table(c)
+
+        # Rows removed by the retention job when archiving is enabled
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS users_archive (
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER,
+                channel_topic TEXT,
+                target_audience TEXT,
+                monetization TEXT,
+                product_details TEXT,
+                preferences TEXT,
+                style TEXT,
+                emotions TEXT,
+                examples TEXT,
+                content_plan TEXT,
+                tone_of_voice TEXT,
+                saved_audience TEXT,
+                content_theme TEXT,
+                last_interaction TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                plan_days INTEGER,
+                blocked_at TIMESTAMP
+            )
+        ''')
+        _add_missing_columns(c, 'users_archive')
+        # Databases created before tenants
+        _add_tenant_column(c, 'users_archive')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_users_last_interaction ON users (last_interaction)')
+
+        # Conversation state shared between worker processes (see persistence.py)
+        _create_tenant_table(c, 'conversation_states', '''
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                tenant_id TEXT NOT NULL DEFAULT '',
+                name TEXT NOT NULL,
+                conversation_key TEXT NOT NULL,
+                state TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (tenant_id, name, conversation_key)
+            )
+        ''')
+        # Example posts, stored once per distinct text and shared between users
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS example_posts (
+                hash TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        _create_tenant_table(c, 'user_examples', '''
+            CREATE TABLE IF NOT EXISTS user_examples (
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                source TEXT,
+                PRIMARY KEY (tenant_id, chat_id, position)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_user_examples_hash ON user_examples (hash)')
+
+        # Compact versions of oversized profile fields, by content hash (see budget.py)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS field_summaries (
+                hash TEXT PRIMARY KEY,
+                field TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                source_tokens INTEGER,
+                tokens INTEGER,
+                body BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Admin broadcasts and their progress (see broadcast.py)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant_id TEXT NOT NULL DEFAULT '',
+                text TEXT NOT NULL,
+                created_by INTEGER,
+                status TEXT NOT NULL,
+                total INTEGER DEFAULT 0,
+                cursor INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                throttled INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        # Databases created before tenants
+        _add_tenant_column(c, 'broadcasts')
+
+        # Autoposting of plan posts to the user's channel (see autopost.py)
+        _create_tenant_table(c, 'autopost_schedules', '''
+            CREATE TABLE IF NOT EXISTS autopost_schedules (
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                channel_title TEXT,
+                post_time TEXT NOT NULL,
+                utc_offset INTEGER NOT NULL,
+                next_day INTEGER NOT NULL DEFAULT 1,
+                plan_days INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                next_run_at INTEGER NOT NULL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (tenant_id, chat_id)
+            )
+        ''')
+        # The poller reads only the due rows of active schedules
+        c.execute('CREATE INDEX IF NOT EXISTS idx_autopost_due ON autopost_schedules (status, next_run_at)')
+        _create_tenant_table(c, 'autopost_posts', '''
+            CREATE TABLE IF NOT EXISTS autopost_posts (
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                plan_hash TEXT NOT NULL,
+                body BLOB NOT NULL,
+                status TEXT NOT NULL,
+                message_id INTEGER,
+                generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                published_at TIMESTAMP,
+                PRIMARY KEY (tenant_id, chat_id, day)
+            )
+        ''')
+
+        # Every generated plan and post, full-text searchable with /search (see history.py)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS generation_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                day INTEGER,
+                title TEXT,
+                body TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        _add_tenant_column(c, 'generation_history')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_generation_history_chat ON generation_history (chat_id, id)')
+        # The index stores the owner as a token (c42, cm100 for -100) so a
+        # MATCH can be limited to one user; the view computes it for the index
+        c.execute('''
+            CREATE VIEW IF NOT EXISTS generation_search_source AS
+            SELECT id, 'c' || replace(chat_id, '-', 'm') AS owner, title, body FROM generation_history
+        ''')
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS generation_search USING fts5(
+                owner, title, body,
+                content='generation_search_source', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS generation_history_ai AFTER INSERT ON generation_history BEGIN
+                INSERT INTO generation_search (rowid, owner, title, body)
+                VALUES (new.id, 'c' || replace(new.chat_id, '-', 'm'), new.title, new.body);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS generation_history_ad AFTER DELETE ON generation_history BEGIN
+                INSERT INTO generation_search (generation_search, rowid, owner, title, body)
+                VALUES ('delete', old.id, 'c' || replace(old.chat_id, '-', 'm'), old.title, old.body);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS generation_history_au AFTER UPDATE ON generation_history BEGIN
+                INSERT INTO generation_search (generation_search, rowid, owner, title, body)
+                VALUES ('delete', old.id, 'c' || replace(old.chat_id, '-', 'm'), old.title, old.body);
+                INSERT INTO generation_search (rowid, owner, title, body)
+                VALUES (new.id, 'c' || replace(new.chat_id, '-', 'm'), new.title, new.body);
+            END
+        ''')
+
+        _create_tenant_table(c, 'session_data', '''
+            CREATE TABLE IF NOT EXISTS session_data (
+                tenant_id TEXT NOT NULL DEFAULT '',
+                user_id INTEGER NOT NULL,
+                data TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (tenant_id, user_id)
+            )
+        ''')
+
+        # Generation jobs of the HTTP API (see api.py)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS api_jobs (
+                id TEXT PRIMARY KEY,
+                tenant_id TEXT NOT NULL DEFAULT '',
+                api_key TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                request TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_api_jobs_created ON api_jobs (created_at)')
+
+        # Telegram file_ids of uploaded plan documents, by plan version (see documents.py)
+        _create_tenant_table(c, 'plan_documents', '''
+            CREATE TABLE IF NOT EXISTS plan_documents (
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                format TEXT NOT NULL,
+                version TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                size INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (tenant_id, chat_id, format)
+            )
+        ''')
+
+        # Conversation analytics (see analytics.py): the append-only event log...
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant_id TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                ok INTEGER,
+                ms INTEGER,
+                created_at REAL NOT NULL
+            )
+        ''')
+        # ...and the rollups folded from it, up to analytics_rollup.last_event_id
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_rollup (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_event_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP
+            )
+        ''')
+        c.execute('INSERT OR IGNORE INTO analytics_rollup (id, last_event_id) VALUES (1, 0)')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_chats (
+                tenant_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                entered_at REAL NOT NULL,
+                PRIMARY KEY (tenant_id, chat_id)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_analytics_chats_state ON analytics_chats (tenant_id, state, entered_at)')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_reached (
+                tenant_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                PRIMARY KEY (tenant_id, state, chat_id)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_counts (
+                tenant_id TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                errors INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (tenant_id, metric)
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_durations (
+                tenant_id TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (tenant_id, metric, bucket)
             )
         ''')
 
@@ -43,7 +431,7 @@ def save_user_preferences(chat_id: int, data: dict) -> None:
     """Save user preferences to the database."""
     conn = None
     try:
-        conn = sqlite3.connect('bot.db')
+        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
 
         c.execute('''
@@ -52,20 +440,22 @@ def save_user_preferences(chat_id: int, data: dict) -> None:
                 saved_audience = ?,
                 content_theme = ?,
                 last_interaction = CURRENT_TIMESTAMP
-            WHERE chat_id = ?
+            WHERE tenant_id = ? AND chat_id = ?
         ''', (
             data.get('tone_of_voice', ''),
             data.get('saved_audience', ''),
             data.get('content_theme', ''),
+            current_tenant(),
             chat_id
         ))
 
         if c.rowcount == 0:  # No existing record, insert new one
             c.execute('''
                 INSERT INTO users (
-                    chat_id, tone_of_voice, saved_audience, content_theme
-                ) VALUES (?, ?, ?, ?)
+                    tenant_id, chat_id, tone_of_voice, saved_audience, content_theme, last_interaction
+                ) VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
             ''', (
+                current_tenant(),
                 chat_id,
                 data.get('tone_of_voice', ''),
                 data.get('saved_audience', ''),
@@ -80,26 +470,54 @@ def save_user_preferences(chat_id: int, data: dict) -> None:
         if conn:
             conn.close()
 
+def save_user_examples(c, chat_id: int, examples: List[Dict[str, Any]]) -> None:
+    """Replace a user's examples, storing each distinct text only once."""
+    examples = limit_examples(examples)
+    tenant_id = current_tenant()
+    c.execute('DELETE FROM user_examples WHERE tenant_id = ? AND chat_id = ?', (tenant_id, chat_id))
+    rows = []
+    for position, example in enumerate(examples):
+        text = example.get('text') or ''
+        digest = example_hash(text)
+        c.execute('INSERT OR IGNORE INTO example_posts (hash, body) VALUES (?, ?)', (digest, pack_text(text)))
+        rows.append((tenant_id, chat_id, position, digest, example.get('source', '')))
+    c.executemany(
+        'INSERT INTO user_examples (tenant_id, chat_id, position, hash, source) VALUES (?, ?, ?, ?, ?)', rows
+    )
+
+def load_user_examples(c, chat_id: int) -> List[Dict[str, Any]]:
+    rows = c.execute('''
+        SELECT p.body, e.source FROM user_examples e
+        JOIN example_posts p ON p.hash = e.hash
+        WHERE e.tenant_id = ? AND e.chat_id = ?
+        ORDER BY e.position
+    ''', (current_tenant(), chat_id)).fetchall()
+    return [{'text': unpack_text(body), 'source': source or ''} for body, source in rows]
+
 def save_user_data(chat_id: int, data: dict) -> None:
     """Save user data to the database."""
     conn = None
     try:
-        conn = sqlite3.connect('bot.db')
+        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
 
-        # Convert lists and dicts to JSON strings
+        # Convert lists and dicts to JSON strings (on a copy, callers pass context.user_data)
+        data = dict(data)
         if 'examples' in data and isinstance(data['examples'], list):
-            data['examples'] = json.dumps(data['examples'])
+            # Kept in example_posts/user_examples, the column stays empty
+            save_user_examples(c, chat_id, data['examples'])
+            data['examples'] = ''
         if 'content_plan' in data:
-            data['content_plan'] = json.dumps(data['content_plan'])
+            data['content_plan'] = pack_text(json.dumps(data['content_plan'], ensure_ascii=False))
 
         c.execute('''
             INSERT OR REPLACE INTO users (
-                chat_id, channel_topic, target_audience, monetization,
+                tenant_id, chat_id, channel_topic, target_audience, monetization,
                 product_details, preferences, style, emotions, examples, content_plan,
-                tone_of_voice, saved_audience, content_theme
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                tone_of_voice, saved_audience, content_theme, plan_days, last_interaction
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
         ''', (
+            current_tenant(),
             chat_id,
             data.get('topic', ''),
             data.get('audience', ''),
@@ -112,7 +530,8 @@ def save_user_data(chat_id: int, data: dict) -> None:
             data.get('content_plan', ''),
             data.get('tone_of_voice', ''),
             data.get('saved_audience', ''),
-            data.get('content_theme', '')
+            data.get('content_theme', ''),
+            data.get('plan_days') or 14
         ))
         conn.commit()
         logger.info(f"Saved data for user {chat_id}")
@@ -126,36 +545,40 @@ def get_user_data(chat_id: int) -> dict:
     """Retrieve user data from the database."""
     conn = None
     try:
-        conn = sqlite3.connect('bot.db')
+        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
         c.execute('''
             SELECT 
                 chat_id, channel_topic, target_audience, monetization,
                 product_details, preferences, style, emotions, examples,
-                content_plan, tone_of_voice, saved_audience, content_theme
+                content_plan, tone_of_voice, saved_audience, content_theme, plan_days
             FROM users 
-            WHERE chat_id = ?
-        ''', (chat_id,))
+            WHERE tenant_id = ? AND chat_id = ?
+        ''', (current_tenant(), chat_id))
         row = c.fetchone()
 
         if row:
             columns = [
                 'chat_id', 'channel_topic', 'target_audience', 'monetization',
                 'product_details', 'preferences', 'style', 'emotions', 'examples',
-                'content_plan', 'tone_of_voice', 'saved_audience', 'content_theme'
+                'content_plan', 'tone_of_voice', 'saved_audience', 'content_theme', 'plan_days'
             ]
             data = dict(zip(columns, row))
 
             # Parse JSON strings back to Python objects
-            if data['examples']:
+            examples = load_user_examples(c, chat_id)
+            if examples:
+                data['examples'] = examples
+            elif data['examples']:
+                # Rows saved before example_posts existed
                 try:
-                    data['examples'] = json.loads(data['examples'])
+                    data['examples'] = json.loads(unpack_text(data['examples']))
                 except json.JSONDecodeError:
                     data['examples'] = []
 
             if data['content_plan']:
                 try:
-                    data['content_plan'] = json.loads(data['content_plan'])
+                    data['content_plan'] = json.loads(unpack_text(data['content_plan']))
                 except json.JSONDecodeError:
                     data['content_plan'] = None
 
@@ -166,4 +589,13 @@ def get_user_data(chat_id: int) -> dict:
         return {}
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            conn.close()
+
+def get_user_profile(chat_id: int) -> dict:
+    """get_user_data with the keys the questionnaire and prompts.py use."""
+    data = get_user_data(chat_id)
+    if data:
+        data['topic'] = data.get('channel_topic')
+        # The repackaging flow saves an audience too
+        data['audience'] = data.get('target_audience') or data.get('saved_audience')
+    return data
\ No newline at end of file
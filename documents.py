@@ -0,0 +1,168 @@
+"""The content plan and its posts as one document, uploaded once per version.
+
+A plan is sent as several long messages, and sending it again repeats all of
+them. The "plan as a file" buttons render the plan and the posts written for
+it (history.plan_posts) into a TXT or Markdown file instead. The first send
+uploads it; the file_id Telegram returns is kept in plan_documents with the
+document's digest as its version, so later sends of an unchanged plan only
+reference the file_id. Editing the plan or writing a post changes the digest
+and the next send uploads the new version over the old row.
+
+Documents are rendered locally from the database; a file_id Telegram no
+longer accepts is dropped and the document uploaded again.
+"""
+import io
+import hashlib
+import sqlite3
+import logging
+from typing import Dict, Optional, Tuple
+from telegram import Message, Update
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext, CallbackQueryHandler, Dispatcher, DispatcherHandlerStop
+from database import DB_PATH, current_tenant, get_user_profile
+from prompts import plan_entries, plan_headline, DEFAULT_PLAN_DAYS
+import history
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Callback suffix -> (file extension, caption label)
+DOCUMENT_FORMATS = {'txt': ('txt', 'TXT'), 'md': ('md', 'Markdown')}
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def render_text(content_plan: str, days: int, posts: Dict[int, str]) -> str:
+    """The plan as sent in chat, followed by its posts."""
+    parts = [f"📋 Контент-план на {days} дней\n\n{content_plan.strip()}"]
+    for day in sorted(posts):
+        parts.append(f"{'=' * 40}\n✍️ Пост #{day}\n\n{posts[day].strip()}")
+    return '\n\n\n'.join(parts) + '\n'
+
+def render_markdown(content_plan: str, days: int, posts: Dict[int, str]) -> str:
+    """The plan with a heading per day, then a heading per post."""
+    entries = plan_entries(content_plan)
+    lines = [f"# Контент-план на {days} дней", '']
+    if not entries:
+        lines += [content_plan.strip(), '']
+    for day in sorted(entries):
+        rest = entries[day].splitlines()[1:]
+        lines += [f"## День {day}. {plan_headline(entries[day])}", '']
+        # One paragraph per line: Markdown would join consecutive lines
+        lines += [paragraph for line in rest if line.strip() for paragraph in (line.strip(), '')]
+    if posts:
+        lines += ['# Посты', '']
+    for day in sorted(posts):
+        lines += [f"## {history.post_title(day, content_plan)}", '', posts[day].strip(), '']
+    return '\n'.join(lines)
+
+RENDERERS = {'txt': render_text, 'md': render_markdown}
+
+def build_document(chat_id: int, fmt: str) -> Optional[Tuple[bytes, str, str]]:
+    """(file contents, file name, caption) of the user's current plan, None without one."""
+    profile = get_user_profile(chat_id)
+    if not profile or not profile.get('content_plan'):
+        return None
+    days = profile.get('plan_days') or DEFAULT_PLAN_DAYS
+    posts = history.plan_posts(chat_id, profile['content_plan'])
+    data = RENDERERS[fmt](profile['content_plan'], days, posts).encode('utf-8')
+    extension, label = DOCUMENT_FORMATS[fmt]
+    caption = f"📄 Контент-план на {days} дней ({label})" + (f", постов: {len(posts)}" if posts else '')
+    return data, f"content-plan-{days}-days.{extension}", caption
+
+def document_version(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+def cached_file_id(chat_id: int, fmt: str, version: str) -> Optional[str]:
+    """file_id of this version of the document, if it was uploaded already."""
+    conn = None
+    try:
+        conn = _connect()
+        row = conn.execute(
+            'SELECT version, file_id FROM plan_documents WHERE tenant_id = ? AND chat_id = ? AND format = ?',
+            (current_tenant(), chat_id, fmt)
+        ).fetchone()
+        return row['file_id'] if row and row['version'] == version else None
+    finally:
+        if conn:
+            conn.close()
+
+def save_file_id(chat_id: int, fmt: str, version: str, file_id: str, size: int) -> None:
+    """Remember the upload of `version`, replacing the previous version's file_id."""
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('''
+                INSERT INTO plan_documents (tenant_id, chat_id, format, version, file_id, size)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (tenant_id, chat_id, format) DO UPDATE SET
+                    version = excluded.version, file_id = excluded.file_id,
+                    size = excluded.size, created_at = CURRENT_TIMESTAMP
+            ''', (current_tenant(), chat_id, fmt, version, file_id, size))
+    except Exception as e:
+        logger.error(f"Error saving plan document of {chat_id}: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def forget_file_id(chat_id: int, fmt: str) -> None:
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                'DELETE FROM plan_documents WHERE tenant_id = ? AND chat_id = ? AND format = ?',
+                (current_tenant(), chat_id, fmt)
+            )
+    finally:
+        if conn:
+            conn.close()
+
+def send_plan_document(message: Message, chat_id: int, fmt: str = 'txt') -> bool:
+    """Send the user's plan as a document in reply to `message`.
+
+    Returns False when there is no plan to send.
+    """
+    document = build_document(chat_id, fmt)
+    if document is None:
+        return False
+    data, filename, caption = document
+    version = document_version(data)
+    file_id = cached_file_id(chat_id, fmt, version)
+    if file_id:
+        try:
+            message.reply_document(file_id, caption=caption)
+            metrics.incr('documents.cached')
+            return True
+        except BadRequest as e:
+            # The file_id belongs to another bot token or has expired
+            logger.warning(f"Cached plan document of {chat_id} rejected, uploading again: {e.message}")
+            forget_file_id(chat_id, fmt)
+    sent = message.reply_document(io.BytesIO(data), filename=filename, caption=caption)
+    metrics.incr('documents.uploaded')
+    if sent and sent.document:
+        save_file_id(chat_id, fmt, version, sent.document.file_id, len(data))
+    return True
+
+def plan_document_button(update: Update, context: CallbackContext) -> None:
+    """plan_doc_<format> buttons: the current plan as a file."""
+    query = update.callback_query
+    query.answer()
+    fmt = query.data[len('plan_doc_'):]
+    if not send_plan_document(query.message, update.effective_chat.id, fmt):
+        query.message.reply_text("❌ Сохранённый контент-план не найден. Начните заново с команды /start")
+    raise DispatcherHandlerStop()
+
+def install_documents(dispatcher: Dispatcher, group: int = 0) -> None:
+    """Register the plan document buttons.
+
+    Add it before the conversation handler when sharing its group:
+    MAIN_MENU answers any button.
+    """
+    dispatcher.add_handler(
+        CallbackQueryHandler(plan_document_button, pattern=f"^plan_doc_({'|'.join(DOCUMENT_FORMATS)})$"),
+        group=group
+    )
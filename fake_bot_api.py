@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class FakeAPIError(Exception):
+    """Error response of the fake, shaped like Telegram's."""
+
+    def __init__(self, code: int, description: str, retry_after: Optional[int] = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+    def payload(self) -> Dict[str, Any]:
+        body = {'ok': False, 'error_code': self.code, 'description': self.description}
+        if self.retry_after is not None:
+            body['parameters'] = {'retry_after': self.retry_after}
+        return body
+
+class FakeBotAPI:
+    """Minimal local stand-in for the Telegram Bot API used by benchmarks.
+
+    Point the bot at it with TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>/bot.
+    Updates are queued with inject_update() and every outgoing call is
+    recorded in `sent` together with the time it was received.
+
+    For broadcasts it can play Telegram's failure modes: chats in
+    `blocked_chats` answer 403, and more than `send_rate_limit` sendMessage
+    calls per second answer 429 with retry_after.
+
+    Channels added with add_channel() answer getChat, and getChatMember with
+    the admin rights given for them. Files added with add_file() answer
+    getFile the way a local Bot API server does, with their path on disk.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, send_latency: float = 0.0,
+                 send_rate_limit: float = 0.0):
+        self.updates = queue.Queue()
+        self.sent: List[Dict[str, Any]] = []
+        # user_id -> getChatMember status, 'member' for everyone else
+        self.member_statuses: Dict[int, str] = {}
+        self.blocked_chats: Set[int] = set()
+        # chat_id -> getChat result, plus 'admins': user_id -> ChatMember fields
+        self.channels: Dict[int, Dict[str, Any]] = {}
+        # file_id -> path of a local file
+        self.files: Dict[str, str] = {}
+        self.send_latency = send_latency
+        self.send_rate_limit = send_rate_limit
+        self.throttled = 0
+        self._window_start = 0.0
+        self._window_count = 0
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._update_id = 0
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> 'FakeBotAPI':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Fake Bot API listening on {self.base_url}")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def inject_update(self, update: Dict[str, Any]) -> None:
+        with self._lock:
+            self._update_id += 1
+            update = {**update, 'update_id': self._update_id}
+        self.updates.put(update)
+
+    def add_channel(self, chat_id: int, title: str, username: Optional[str] = None,
+                    admins: Optional[Dict[int, Dict[str, Any]]] = None) -> None:
+        """A channel for getChat; `admins` maps user_id to e.g. {'status': 'creator'}."""
+        self.channels[chat_id] = {
+            'id': chat_id, 'type': 'channel', 'title': title, 'username': username,
+            'admins': admins or {},
+        }
+
+    def add_file(self, file_id: str, path: str) -> None:
+        """A file for getFile, served as a local Bot API server would."""
+        self.files[file_id] = os.path.abspath(path)
+
+    def _find_channel(self, chat_id: Any) -> Optional[Dict[str, Any]]:
+        if isinstance(chat_id, str) and chat_id.startswith('@'):
+            for channel in self.channels.values():
+                if channel['username'] and f"@{channel['username']}".lower() == chat_id.lower():
+                    return channel
+            return None
+        try:
+            return self.channels.get(int(chat_id))
+        except (TypeError, ValueError):
+            return None
+
+    def sent_messages(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [call for call in self.sent if call['method'] == 'sendMessage']
+
+    def _next_message_id(self) -> int:
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _check_send(self, chat_id: int) -> None:
+        """Raise the error Telegram would return for this sendMessage."""
+        if self.send_latency:
+            time.sleep(self.send_latency)
+        if chat_id in self.blocked_chats:
+            raise FakeAPIError(403, 'Forbidden: bot was blocked by the user')
+        if self.send_rate_limit:
+            with self._lock:
+                now = time.monotonic()
+                if now - self._window_start >= 1.0:
+                    self._window_start, self._window_count = now, 0
+                self._window_count += 1
+                if self._window_count > self.send_rate_limit:
+                    self.throttled += 1
+                    raise FakeAPIError(429, 'Too Many Requests: retry after 1', retry_after=1)
+
+    def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        timeout = float(params.get('timeout') or 0)
+        batch = []
+        try:
+            batch.append(self.updates.get(timeout=min(timeout, 1.0) if timeout else 0.01))
+            while len(batch) < int(params.get('limit') or 100):
+                batch.append(self.updates.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def handle(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        # Control methods for benchmarks running the fake in another process
+        if method == 'benchInject':
+            for update in params.get('updates', []):
+                self.inject_update(update)
+            return True
+        if method == 'benchStats':
+            sent = self.sent_messages()
+            needle = params.get('contains', '')
+            return {
+                'messages': len(sent),
+                'matching': sum(1 for call in sent if needle in call['params'].get('text', '')),
+            }
+
+        if method == 'sendMessage':
+            self._check_send(int(params.get('chat_id', 0)))
+
+        with self._lock:
+            self.sent.append({'method': method, 'params': params, 'time': time.monotonic()})
+
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method in ('sendMessage', 'sendDocument', 'editMessageText'):
+            message = {
+                'message_id': self._next_message_id(),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'},
+            }
+            channel = self._find_channel(params.get('chat_id'))
+            if channel:
+                message['chat'] = {'id': channel['id'], 'type': 'channel', 'title': channel['title']}
+            if 'text' in params:
+                message['text'] = params['text']
+            if method == 'sendDocument':
+                message['document'] = {
+                    'file_id': f"fake-file-{message['message_id']}",
+                    'file_unique_id': f"fake-unique-{message['message_id']}",
+                }
+            return message
+        if method == 'getFile':
+            path = self.files.get(params.get('file_id'))
+            if path is None:
+                raise FakeAPIError(400, 'Bad Request: invalid file_id')
+            return {
+                'file_id': params['file_id'], 'file_unique_id': f"fake-unique-{params['file_id']}",
+                'file_size': os.path.getsize(path), 'file_path': path,
+            }
+        if method == 'getChat':
+            channel = self._find_channel(params.get('chat_id'))
+            if channel is None:
+                raise FakeAPIError(400, 'Bad Request: chat not found')
+            return {key: value for key, value in channel.items() if key != 'admins' and value is not None}
+        if method == 'getChatMember':
+            user_id = int(params.get('user_id', 0))
+            channel = self._find_channel(params.get('chat_id'))
+            if channel is not None:
+                member = channel['admins'].get(user_id, {'status': 'left'})
+            else:
+                member = {'status': self.member_statuses.get(user_id, 'member')}
+            return {**member, 'user': {'id': user_id, 'is_bot': user_id == 1, 'first_name': 'User'}}
+        return True
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                params = {}
+                if body and self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body)
+                try:
+                    status, body = 200, {'ok': True, 'result': api.handle(method, params)}
+                except FakeAPIError as e:
+                    status, body = e.code, e.payload()
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def make_message_update(chat_id: int, text: str) -> Dict[str, Any]:
+    """Build a private-chat text message update (commands get an entity)."""
+    message = {
+        'message_id': int(time.time() * 1000) % 1_000_000_000,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': message}
+
+def make_document_update(chat_id: int, file_id: str, file_name: str, file_size: int = 0) -> Dict[str, Any]:
+    """Build a private-chat message update carrying a document."""
+    update = make_message_update(chat_id, '')
+    del update['message']['text']
+    update['message']['document'] = {
+        'file_id': file_id, 'file_unique_id': f"fake-unique-{file_id}",
+        'file_name': file_name, 'file_size': file_size,
+    }
+    return update
+
+def make_callback_update(chat_id: int, data: str) -> Dict[str, Any]:
+    """Build a callback query update as sent by an inline keyboard button."""
+    return {
+        'callback_query': {
+            'id': str(time.monotonic_ns()),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+            },
+        }
+    }
@@ -0,0 +1,141 @@
+import re
+import json
+import time
+import logging
+import threading
+from typing import Callable, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+def fake_completion_text(prompt: str) -> str:
+    """Deterministic answer in the format each prompt asks for."""
+    selected = re.search(r'постов с номерами ([\d, ]+)\.', prompt)
+    if selected:
+        # Regeneration of single plan days
+        return "\n\n".join(
+            f"🔢 День #{day}:\n🎯 Цель: engagement\n📢 Заголовок: Новый пост {day}\n"
+            f"📝 Описание: Новое описание поста номер {day}."
+            for day in map(int, selected.group(1).split(', '))
+        )
+    days = re.search(r'пронумерованных от (\d+) до (\d+)', prompt)
+    # Plan prompts, and repair prompts which ask for the same format
+    if 'Создай контент-план' in prompt or days:
+        first_day, last_day = (int(days.group(1)), int(days.group(2))) if days else (1, 14)
+        return "\n\n".join(
+            f"🔢 День #{day}:\n🎯 Цель: engagement\n📢 Заголовок: Тестовый пост {day}\n"
+            f"📝 Описание: Описание поста номер {day}."
+            for day in range(first_day, last_day + 1)
+        )
+    return "Тестовый ответ модели."
+
+def fake_stream_pieces(text: str) -> list:
+    """`text` cut into word-sized pieces, the way a streamed answer arrives."""
+    return re.findall(r'\s*\S+', text)
+
+class FakeOpenAI:
+    """OpenAI-compatible /v1/chat/completions server with a fixed latency.
+
+    Point the client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+    Tracks how many requests are being served at once (`peak_in_flight`).
+    """
+
+    def __init__(self, latency: float = 1.0, host: str = '127.0.0.1', port: int = 0,
+                 responder: Optional[Callable[[str], str]] = None):
+        self.latency = latency
+        # prompt -> answer text; the replayer serves recorded answers this way
+        self.responder = responder or fake_completion_text
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> 'FakeOpenAI':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Fake OpenAI listening on {self.base_url}")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'in_flight': self.in_flight, 'peak_in_flight': self.peak_in_flight, 'completed': self.completed}
+
+    def complete(self, request: dict) -> dict:
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            prompt = ''.join(m.get('content') or '' for m in request.get('messages', []))
+            return {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model', 'fake'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': self.responder(prompt)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            }
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    @staticmethod
+    def stream_events(body: dict) -> bytes:
+        """A completion as the server-sent events of stream=True, usage chunk last."""
+        chunk = {key: body[key] for key in ('id', 'created', 'model')}
+        chunk['object'] = 'chat.completion.chunk'
+        pieces = fake_stream_pieces(body['choices'][0]['message']['content'])
+        events = [
+            {**chunk, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+            for piece in pieces
+        ]
+        events.append({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        events.append({**chunk, 'choices': [], 'usage': body['usage']})
+        return b''.join(f"data: {json.dumps(event)}\n\n".encode() for event in events) + b"data: [DONE]\n\n"
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                content_type = 'application/json'
+                if self.path.endswith('/chat/completions'):
+                    body = fake.complete(request)
+                else:
+                    body = fake.stats()
+                if request.get('stream') and 'choices' in body:
+                    payload = fake.stream_events(body)
+                    content_type = 'text/event-stream'
+                else:
+                    payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,31 @@
+"""Features served from the shared database rather than a conversation's state.
+
+They belong to exactly one dispatcher per bot: the bot's own (main.py,
+tenants.py) or, in the sharded runtime (workers.py), the ingress ahead of
+the shards. Both install them from SHARED_INSTALLERS, so a feature added
+here reaches every runtime.
+"""
+from telegram.ext import Dispatcher
+from autopost import install_autopost
+from history import install_search
+from documents import install_documents
+from broadcast import install_broadcasts
+from analytics import install_analytics
+
+# Each is called as install(dispatcher, group=group)
+SHARED_INSTALLERS = [
+    install_autopost,    # /autopost and the poller publishing due posts
+    install_search,      # /search and its buttons
+    install_documents,   # the plan as a document
+    install_broadcasts,  # /broadcast for admins; resumes interrupted broadcasts
+    install_analytics,   # /funnel for admins
+]
+
+def install_shared(dispatcher: Dispatcher, group: int = 0) -> None:
+    """Register every shared feature.
+
+    Add them before the conversation handler when sharing its group:
+    MAIN_MENU answers any button.
+    """
+    for install in SHARED_INSTALLERS:
+        install(dispatcher, group=group)
@@ -1,21 +1,243 @@
+import re
+import os
 import logging
-from typing import Optional, Dict, Any
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import tempfile
+from typing import Optional, Dict, Any, List
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
 from telegram.ext import CallbackContext, ConversationHandler
-from database import save_user_data, get_user_data, save_user_preferences
-from prompts import generate_content_plan, generate_post, generate_product_repackaging
+from telegram.utils.helpers import is_local_file
+from database import (
+    save_user_data, get_user_data, get_user_profile, save_user_preferences, MAX_EXAMPLES, MAX_EXAMPLE_CHARS
+)
+from prompts import (
+    generate_content_plan, generate_post, generate_product_repackaging, regenerate_plan_days,
+    plan_entries, plan_phases, DEFAULT_PLAN_DAYS, PLAN_HORIZONS
+)
+from singleflight import generation_flight, InFlightConflict
+import history
+from postprocess import html_parts
+from channel_export import sample_posts, ExportFormatError, EXPORT_MAX_MB
 from utils import (
     create_monetization_keyboard, create_style_keyboard,
     create_subscription_keyboard, check_subscription,
-    create_main_menu_keyboard, create_back_to_menu_keyboard
+    create_main_menu_keyboard, create_back_to_menu_keyboard, bot_text
 )
 
 logger = logging.getLogger(__name__)
 
+STILL_WORKING_TEXT = "⏳ Я ещё работаю над вашим предыдущим запросом. Пожалуйста, подождите..."
+
 # Conversation states
 (SUBSCRIPTION_CHECK, MAIN_MENU, TOPIC, AUDIENCE, MONETIZATION, PRODUCT_DETAILS, 
  PREFERENCES, STYLE, EMOTIONS, EXAMPLES, POST_NUMBER,
- REPACKAGE_AUDIENCE, REPACKAGE_TOOL, REPACKAGE_RESULT) = range(14)
+ REPACKAGE_AUDIENCE, REPACKAGE_TOOL, REPACKAGE_RESULT,
+ PROFILE_CHOICE, PLAN_EDIT) = range(16)
+
+# Readable state names for logs and profiles
+STATE_NAMES = {
+    SUBSCRIPTION_CHECK: 'SUBSCRIPTION_CHECK', MAIN_MENU: 'MAIN_MENU', TOPIC: 'TOPIC',
+    AUDIENCE: 'AUDIENCE', MONETIZATION: 'MONETIZATION', PRODUCT_DETAILS: 'PRODUCT_DETAILS',
+    PREFERENCES: 'PREFERENCES', STYLE: 'STYLE', EMOTIONS: 'EMOTIONS', EXAMPLES: 'EXAMPLES',
+    POST_NUMBER: 'POST_NUMBER', REPACKAGE_AUDIENCE: 'REPACKAGE_AUDIENCE',
+    REPACKAGE_TOOL: 'REPACKAGE_TOOL', REPACKAGE_RESULT: 'REPACKAGE_RESULT',
+    PROFILE_CHOICE: 'PROFILE_CHOICE', PLAN_EDIT: 'PLAN_EDIT',
+    ConversationHandler.WAITING: 'WAITING',
+}
+
+PLAN_REQUIRED_FIELDS = ['topic', 'audience', 'monetization', 'style', 'emotions']
+# Saved answers copied into user_data when the user reuses their profile
+PROFILE_FIELDS = PLAN_REQUIRED_FIELDS + [
+    'product_details', 'preferences', 'examples', 'content_plan', 'plan_days',
+    'tone_of_voice', 'saved_audience', 'content_theme'
+]
+STYLE_LABELS = {'aggressive': 'Агрессивный', 'business': 'Деловой', 'humorous': 'Юмористический'}
+PHASE_LABELS = {'problems': 'Проблемы', 'solutions': 'Решения', 'expertise': 'Экспертность', 'offer': 'Продукт'}
+DAY_RANGE = re.compile(r'^(\d+)(?:-(\d+))?$')
+
+def missing_plan_fields(user_data: Dict[str, Any]) -> list:
+    """Return the questionnaire fields still needed to generate a plan."""
+    return [field for field in PLAN_REQUIRED_FIELDS if not user_data.get(field)]
+
+def create_new_plan_keyboard() -> InlineKeyboardMarkup:
+    """Keyboard shown under the plan and generated posts."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Сгенерировать новый контент-план", 
+                            callback_data='new_plan')],
+        [InlineKeyboardButton("✏️ Изменить часть плана", callback_data='edit_plan')],
+        [InlineKeyboardButton("📄 План файлом (TXT)", callback_data='plan_doc_txt'),
+         InlineKeyboardButton("📝 Markdown", callback_data='plan_doc_md')]
+    ])
+
+def create_profile_choice_keyboard(has_plan: bool) -> InlineKeyboardMarkup:
+    """Keyboard offering the saved profile instead of the questionnaire."""
+    keyboard = [[InlineKeyboardButton("♻️ Использовать мой профиль", callback_data='reuse_profile')]]
+    if has_plan:
+        keyboard.append([InlineKeyboardButton("📋 Мой текущий план", callback_data='show_plan')])
+        keyboard.append([InlineKeyboardButton("📄 Мой план файлом", callback_data='plan_doc_txt')])
+        keyboard.append([InlineKeyboardButton("✏️ Изменить часть плана", callback_data='edit_plan')])
+    keyboard.append([InlineKeyboardButton("📝 Заполнить анкету заново", callback_data='fresh_profile')])
+    return InlineKeyboardMarkup(keyboard)
+
+def create_phase_keyboard(days: int) -> InlineKeyboardMarkup:
+    """One button per warm-up phase of a `days`-day plan, two per row."""
+    buttons = [
+        InlineKeyboardButton(
+            f"{PHASE_LABELS[name]} ({first}-{last})" if first != last else f"{PHASE_LABELS[name]} ({first})",
+            callback_data=f'regen_phase_{name}'
+        )
+        for name, (first, last) in plan_phases(days).items()
+    ]
+    return InlineKeyboardMarkup([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+def create_plan_days_keyboard() -> InlineKeyboardMarkup:
+    """Keyboard for choosing the content plan length."""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(f"{days} дней", callback_data=f'plan_days_{days}')
+        for days in PLAN_HORIZONS
+    ]])
+
+def reply_long_text(message, text: str, reply_markup=None) -> None:
+    """Send `text` as HTML, split at paragraphs if it's over the message limit.
+
+    The keyboard goes with the last part.
+    """
+    parts = html_parts(text)
+    for number, part in enumerate(parts, 1):
+        message.reply_text(
+            part, parse_mode=ParseMode.HTML, reply_markup=reply_markup if number == len(parts) else None
+        )
+
+def send_content_plan(message, content_plan: str, days: int = DEFAULT_PLAN_DAYS) -> None:
+    """Send the plan (split into parts if needed) and the post number prompt."""
+    formatted_plan = f"📋 Контент-план на {days} дней:\n\n"
+    formatted_plan += content_plan
+    reply_long_text(message, formatted_plan)
+    send_post_number_prompt(message, days)
+
+def send_updated_days(message, content_plan: str, selected: List[int], days: int) -> None:
+    """Send only the regenerated days of the plan and the post number prompt."""
+    entries = plan_entries(content_plan)
+    reply_long_text(
+        message,
+        f"✏️ Обновлённые дни плана ({format_day_selection(selected)}), остальные без изменений:\n\n"
+        + "\n\n".join(entries[day] for day in selected if day in entries)
+    )
+    send_post_number_prompt(message, days)
+
+def send_post_number_prompt(message, days: int) -> None:
+    """Ask for the number of the post to write."""
+    message.reply_text(
+        "✍️ Чтобы сгенерировать полный текст поста, "
+        f"введите его номер (от 1 до {days}):\n\n"
+        "📅 Публиковать посты в ваш канал автоматически: /autopost\n"
+        "🔎 Найти прошлые планы и посты: /search <слова>",
+        reply_markup=create_new_plan_keyboard()
+    )
+
+def format_day_selection(selected: List[int]) -> str:
+    """[3, 5, 6, 7] -> '3, 5-7'."""
+    spans = []
+    for day in sorted(selected):
+        if spans and day == spans[-1][1] + 1:
+            spans[-1][1] = day
+        else:
+            spans.append([day, day])
+    return ', '.join(str(first) if first == last else f"{first}-{last}" for first, last in spans)
+
+def parse_day_selection(text: str, days: int) -> List[int]:
+    """'3, 5-7' -> [3, 5, 6, 7]. Raises ValueError for anything outside 1..days."""
+    selected = set()
+    for part in re.split(r'[,;\s]+', re.sub(r'\s*-\s*', '-', text.strip())):
+        match = DAY_RANGE.match(part)
+        if not match:
+            raise ValueError(f"Not a day or range: {part!r}")
+        first, last = int(match.group(1)), int(match.group(2) or match.group(1))
+        if not 1 <= first <= last <= days:
+            raise ValueError(f"Days {first}-{last} are outside 1-{days}")
+        selected.update(range(first, last + 1))
+    return sorted(selected)
+
+def _short(text: Any, limit: int = 80) -> str:
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+def offer_saved_profile(message, chat_id: int) -> Optional[int]:
+    """Offer the profile saved in the database instead of the questionnaire.
+
+    Returns PROFILE_CHOICE, or None when there is no complete saved profile.
+    """
+    profile = get_user_profile(chat_id)
+    if not profile or missing_plan_fields(profile):
+        return None
+    lines = [
+        f"• Тема: {_short(profile['topic'])}",
+        f"• Аудитория: {_short(profile['audience'])}",
+        f"• Стиль: {STYLE_LABELS.get(profile['style']) or _short(profile['style'])}",
+    ]
+    if profile.get('content_plan'):
+        lines.append(f"• Контент-план на {profile.get('plan_days') or DEFAULT_PLAN_DAYS} дней")
+    message.reply_text(
+        "📂 У вас есть сохранённый профиль:\n\n" + "\n".join(lines) +
+        "\n\nПродолжить с ним или заполнить анкету заново?",
+        reply_markup=create_profile_choice_keyboard(bool(profile.get('content_plan')))
+    )
+    return PROFILE_CHOICE
+
+def load_saved_profile(context: CallbackContext, chat_id: int) -> Dict[str, Any]:
+    """Prefill user_data with the saved profile. Returns the profile."""
+    profile = get_user_profile(chat_id)
+    for field in PROFILE_FIELDS:
+        if profile.get(field):
+            context.user_data[field] = profile[field]
+    return profile
+
+def regenerate_days(message, context: CallbackContext, chat_id: int, selected: List[int]) -> Optional[int]:
+    """Regenerate `selected` days of the plan in user_data, keeping the others."""
+    days = context.user_data.get('plan_days') or DEFAULT_PLAN_DAYS
+    message.reply_text(
+        f"🔄 Перегенерирую дни {format_day_selection(selected)}, остальные дни плана не изменятся..."
+    )
+    try:
+        content_plan, shared = generation_flight.do(
+            chat_id, 'plan_edit', regenerate_plan_days, context.user_data, selected
+        )
+        if shared:
+            # The first request already delivered the plan to this chat
+            return POST_NUMBER
+        context.user_data['content_plan'] = content_plan
+        save_user_data(chat_id, context.user_data)
+        history.record_plan(chat_id, content_plan, days, format_day_selection(selected))
+        send_updated_days(message, content_plan, selected, days)
+        context.user_data['waiting_for'] = 'post_number'
+        return POST_NUMBER
+    except InFlightConflict:
+        message.reply_text(STILL_WORKING_TEXT)
+        return None
+    except Exception:
+        logger.exception("Error regenerating plan days:")
+        message.reply_text(
+            "❌ Не удалось перегенерировать дни плана. Попробуйте ещё раз или выберите другие дни."
+        )
+        return PLAN_EDIT
+
+def send_generated_post(message, post_number: int, generated_post: str,
+                        days: int = DEFAULT_PLAN_DAYS) -> None:
+    """Send a generated post with the new plan button."""
+    reply_long_text(
+        message,
+        f"✨ Готово! Вот ваш пост #{post_number}:\n\n{generated_post}\n\n"
+        f"Чтобы сгенерировать другой пост, введите его номер (1-{days}):",
+        reply_markup=create_new_plan_keyboard()
+    )
+
+def send_repackaging_result(message, repackaged_content: str) -> None:
+    """Send the repackaging result and the main menu."""
+    reply_long_text(
+        message,
+        f"{repackaged_content}\n\n"
+        "Выберите следующее действие:",
+        reply_markup=create_main_menu_keyboard()
+    )
 
 def start(update: Update, context: CallbackContext) -> int:
     """Start the conversation and check subscription."""
@@ -32,14 +254,14 @@ def start(update: Update, context: CallbackContext) -> int:
 
         if not is_subscribed:
             update.message.reply_text(
-                "👋 Для использования бота необходимо подписаться на канал @expert_buyanov",
+                bot_text('subscribe'),
                 reply_markup=create_subscription_keyboard()
             )
             return SUBSCRIPTION_CHECK
 
         # Show main menu
         update.message.reply_text(
-            "👋 Выберите действие:",
+            bot_text('welcome'),
             reply_markup=create_main_menu_keyboard()
         )
         return MAIN_MENU
@@ -57,6 +279,11 @@ def handle_main_menu(update: Update, context: CallbackContext) -> int:
     query.answer()
 
     if query.data == 'content_plan':
+        # Returning users can skip the questionnaire
+        state = offer_saved_profile(query.message, update.effective_chat.id)
+        if state is not None:
+            return state
+
         # Start content plan flow
         query.message.reply_text(
             "📝 Какая тема вашего канала?\n\n"
@@ -114,7 +341,13 @@ def handle_repackage(update: Update, context: CallbackContext) -> int:
             update.message.reply_text("🔄 Генерирую переупаковку продукта...")
 
             try:
-                repackaged_content = generate_product_repackaging(context.user_data)
+                repackaged_content, shared = generation_flight.do(
+                    update.effective_chat.id, 'repackage',
+                    generate_product_repackaging, context.user_data
+                )
+                if shared:
+                    # The first request already delivered the result to this chat
+                    return MAIN_MENU
 
                 # Save preferences
                 save_user_preferences(update.effective_chat.id, {
@@ -123,13 +356,12 @@ def handle_repackage(update: Update, context: CallbackContext) -> int:
                 })
 
                 # Send result and return to main menu
-                update.message.reply_text(
-                    f"{repackaged_content}\n\n"
-                    "Выберите следующее действие:",
-                    reply_markup=create_main_menu_keyboard()
-                )
+                send_repackaging_result(update.message, repackaged_content)
                 return MAIN_MENU
 
+            except InFlightConflict:
+                update.message.reply_text(STILL_WORKING_TEXT)
+                return None
             except Exception as e:
                 logger.error(f"Error generating repackaged content: {e}")
                 update.message.reply_text(
@@ -173,8 +405,7 @@ def button_handler(update: Update, context: CallbackContext) -> int:
                 return TOPIC
             else:
                 query.message.reply_text(
-                    "❌ Вы все еще не подписаны на канал @expert_buyanov\n"
-                    "Подпишитесь и нажмите кнопку проверки ещё раз.",
+                    bot_text('not_subscribed'),
                     reply_markup=create_subscription_keyboard()
                 )
                 return SUBSCRIPTION_CHECK
@@ -248,10 +479,17 @@ def button_handler(update: Update, context: CallbackContext) -> int:
                 )
                 return EXAMPLES
 
+            query.message.reply_text(
+                "📅 На сколько дней составить контент-план?",
+                reply_markup=create_plan_days_keyboard()
+            )
+            return EXAMPLES
+
+        # Handle plan length choice: generate the plan
+        elif query.data.startswith('plan_days_'):
             try:
                 # Verify all required data is present
-                required_fields = ['topic', 'audience', 'monetization', 'style', 'emotions']
-                missing_fields = [field for field in required_fields if not context.user_data.get(field)]
+                missing_fields = missing_plan_fields(context.user_data)
 
                 if missing_fields:
                     logger.error(f"Missing required fields: {missing_fields}")
@@ -260,43 +498,32 @@ def button_handler(update: Update, context: CallbackContext) -> int:
                     )
                     return ConversationHandler.END
 
-                query.message.reply_text("🔄 Генерирую контент-план на 14 дней...")
-
-                # Extract text from examples
-                examples_text = [example['text'] for example in context.user_data.get('examples', [])]
-                context.user_data['examples_text'] = examples_text
+                days = int(query.data[len('plan_days_'):])
+                context.user_data['plan_days'] = days
+                query.message.reply_text(f"🔄 Генерирую контент-план на {days} дней...")
 
                 # Generate and save content plan
-                content_plan = generate_content_plan(context.user_data)
+                content_plan, shared = generation_flight.do(
+                    update.effective_chat.id, 'content_plan',
+                    generate_content_plan, context.user_data
+                )
+                if shared:
+                    # The first request already delivered the plan to this chat
+                    return POST_NUMBER
                 context.user_data['content_plan'] = content_plan
                 save_user_data(update.effective_chat.id, context.user_data)
+                history.record_plan(update.effective_chat.id, content_plan, days)
 
                 # Format and display content plan
-                formatted_plan = "📋 Контент-план на 14 дней:\n\n"
-                formatted_plan += content_plan
-
-                # Split long message if needed
-                if len(formatted_plan) > 4000:
-                    parts = [formatted_plan[i:i+4000] for i in range(0, len(formatted_plan), 4000)]
-                    for part in parts:
-                        query.message.reply_text(part)
-                else:
-                    query.message.reply_text(formatted_plan)
-
-                # Show options for post generation
-                query.message.reply_text(
-                    "✍️ Чтобы сгенерировать полный текст поста, "
-                    "введите его номер (от 1 до 14):",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔄 Сгенерировать новый контент-план", 
-                                           callback_data='new_plan')
-                    ]])
-                )
+                send_content_plan(query.message, content_plan, days)
                 context.user_data['waiting_for'] = 'post_number'
                 return POST_NUMBER
 
+            except InFlightConflict:
+                query.message.reply_text(STILL_WORKING_TEXT)
+                return None
             except Exception as e:
-                logger.exception("Error in finish_examples:")
+                logger.exception("Error generating content plan:")
                 query.message.reply_text(
                     "❌ Произошла ошибка при генерации контент-плана. "
                     "Пожалуйста, попробуйте еще раз или начните заново с команды /start"
@@ -306,11 +533,61 @@ def button_handler(update: Update, context: CallbackContext) -> int:
         # Handle new plan request
         elif query.data == 'new_plan':
             logger.info("User requested new content plan")
+            context.user_data.clear()
+            state = offer_saved_profile(query.message, update.effective_chat.id)
+            if state is not None:
+                return state
             query.message.reply_text("📝 Какая тема вашего канала?")
+            context.user_data['waiting_for'] = 'topic'
+            return TOPIC
+
+        # Saved profile: reuse it for a new plan
+        elif query.data == 'reuse_profile':
+            load_saved_profile(context, update.effective_chat.id)
+            query.message.reply_text(
+                "♻️ Профиль загружен. На сколько дней составить новый контент-план?",
+                reply_markup=create_plan_days_keyboard()
+            )
+            return EXAMPLES
+
+        # Saved profile: go through the questionnaire again
+        elif query.data == 'fresh_profile':
             context.user_data.clear()
+            query.message.reply_text("📝 Какая тема вашего канала?")
             context.user_data['waiting_for'] = 'topic'
             return TOPIC
 
+        # Saved profile: continue with the current plan
+        elif query.data == 'show_plan':
+            profile = load_saved_profile(context, update.effective_chat.id)
+            if not profile.get('content_plan'):
+                query.message.reply_text("❌ Сохранённый контент-план не найден. Начните заново с команды /start")
+                return ConversationHandler.END
+            send_content_plan(query.message, profile['content_plan'], context.user_data.get('plan_days') or DEFAULT_PLAN_DAYS)
+            context.user_data['waiting_for'] = 'post_number'
+            return POST_NUMBER
+
+        # Regenerate some days of the current plan
+        elif query.data == 'edit_plan':
+            profile = load_saved_profile(context, update.effective_chat.id)
+            if not profile.get('content_plan') or missing_plan_fields(context.user_data):
+                query.message.reply_text("❌ Сохранённый контент-план не найден. Начните заново с команды /start")
+                return ConversationHandler.END
+            days = context.user_data.get('plan_days') or DEFAULT_PLAN_DAYS
+            query.message.reply_text(
+                "✏️ Какие дни плана перегенерировать? Остальные останутся без изменений.\n\n"
+                f"Напишите номера дней (от 1 до {days}), например: 3, 5-7\n"
+                "или выберите этап прогрева целиком:",
+                reply_markup=create_phase_keyboard(days)
+            )
+            context.user_data['waiting_for'] = 'plan_edit'
+            return PLAN_EDIT
+
+        elif query.data.startswith('regen_phase_'):
+            days = context.user_data.get('plan_days') or DEFAULT_PLAN_DAYS
+            first, last = plan_phases(days)[query.data[len('regen_phase_'):]]
+            return regenerate_days(query.message, context, update.effective_chat.id, list(range(first, last + 1)))
+
         return ConversationHandler.END
 
     except Exception as e:
@@ -344,6 +621,19 @@ def handle_example_post(update: Update, context: CallbackContext) -> int:
             context.user_data['examples'] = []
             logger.info("Initialized examples list")
 
+        if len(context.user_data['examples']) >= MAX_EXAMPLES:
+            update.message.reply_text(
+                f"⚠️ Можно добавить не больше {MAX_EXAMPLES} примеров.\n"
+                "Нажмите «✅ Готово», чтобы продолжить.",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("✅ Готово", callback_data='finish_examples')
+                ]])
+            )
+            return EXAMPLES
+        if len(text) > MAX_EXAMPLE_CHARS:
+            logger.info(f"Example truncated from {len(text)} to {MAX_EXAMPLE_CHARS} chars")
+            text = text[:MAX_EXAMPLE_CHARS]
+
         # Add the new example with source information
         example = {'text': text, 'source': source}
         context.user_data['examples'].append(example)
@@ -374,6 +664,66 @@ def handle_example_post(update: Update, context: CallbackContext) -> int:
         )
         return EXAMPLES
 
+def handle_example_export(update: Update, context: CallbackContext) -> int:
+    """Pick example posts from a channel export (result.json) sent as a document."""
+    document = update.message.document
+    if document.file_size and document.file_size > EXPORT_MAX_MB * 1024 * 1024:
+        update.message.reply_text(
+            f"⚠️ Файл больше {EXPORT_MAX_MB:.0f} МБ, бот не может его скачать.\n"
+            "Экспортируйте историю канала за более короткий период, без фото и видео."
+        )
+        return EXAMPLES
+    examples = context.user_data.setdefault('examples', [])
+    if len(examples) >= MAX_EXAMPLES:
+        update.message.reply_text(
+            f"⚠️ Можно добавить не больше {MAX_EXAMPLES} примеров.\n"
+            "Нажмите «✅ Готово», чтобы продолжить.",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("✅ Готово", callback_data='finish_examples')
+            ]])
+        )
+        return EXAMPLES
+    update.message.reply_text("📥 Читаю экспорт канала, это может занять немного времени...")
+    try:
+        telegram_file = context.bot.get_file(document.file_id)
+        with tempfile.TemporaryDirectory() as directory:
+            # A local Bot API server hands over the path of its own copy
+            path = telegram_file.file_path if is_local_file(telegram_file.file_path) \
+                else telegram_file.download(custom_path=os.path.join(directory, 'result.json'))
+            with open(path, 'rb') as f:
+                posts, stats = sample_posts(f, MAX_EXAMPLES - len(examples), max_chars=MAX_EXAMPLE_CHARS)
+    except ExportFormatError as e:
+        logger.info(f"Rejected channel export from {update.effective_chat.id}: {e}")
+        update.message.reply_text(
+            "❌ Это не похоже на экспорт канала. Нужен файл result.json "
+            "из Telegram Desktop (Экспорт истории чата, формат JSON)."
+        )
+        return EXAMPLES
+    except Exception:
+        logger.exception("Error importing channel export:")
+        update.message.reply_text("❌ Не удалось прочитать файл. Попробуйте ещё раз.")
+        return EXAMPLES
+
+    logger.info(f"Channel export of {update.effective_chat.id}: {stats}, picked {len(posts)}")
+    if not posts:
+        update.message.reply_text(
+            f"❌ В экспорте ({stats['messages']} сообщений) не нашлось текстовых постов. "
+            "Пришлите примеры сообщениями."
+        )
+        return EXAMPLES
+    source = f"(из экспорта {stats['channel']})" if stats['channel'] else "(из экспорта канала)"
+    examples.extend({'text': text, 'source': source} for text in posts)
+    update.message.reply_text(
+        f"👍 Прочитал {stats['messages']} сообщений, из них {stats['posts']} текстовых постов. "
+        f"Выбрал {len(posts)} самых характерных, всего примеров: {len(examples)}.\n"
+        "Выберите действие:",
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton("📝 Добавить еще пост", callback_data='add_example'),
+            InlineKeyboardButton("✅ Готово", callback_data='finish_examples')
+        ]])
+    )
+    return EXAMPLES
+
 def text_handler(update: Update, context: CallbackContext) -> int:
     """Handle text input during conversation."""
     try:
@@ -471,6 +821,8 @@ def text_handler(update: Update, context: CallbackContext) -> int:
                     "После каждого поста вы сможете:\n"
                     "• Добавить еще один пример\n"
                     "• Завершить добавление примеров\n\n"
+                    "📥 Много постов? Пришлите файл result.json из экспорта канала "
+                    "(Telegram Desktop → Экспорт истории чата, формат JSON), и я сам выберу примеры.\n\n"
                     "Пришлите первый пример:"
                 )
                 update.message.reply_text(transition_message)
@@ -507,7 +859,8 @@ def text_handler(update: Update, context: CallbackContext) -> int:
                 logger.info(f"Current user data: {context.user_data}")
 
                 post_number = int(text)
-                if 1 <= post_number <= 14:
+                days = context.user_data.get('plan_days') or DEFAULT_PLAN_DAYS
+                if 1 <= post_number <= days:
                     update.message.reply_text(f"🔄 Получено число {post_number}, генерирую пост...")
                     user_data = get_user_data(update.effective_chat.id)
 
@@ -521,17 +874,22 @@ def text_handler(update: Update, context: CallbackContext) -> int:
                         return ConversationHandler.END
 
                     try:
-                        generated_post = generate_post(user_data, post_number)
+                        generated_post, shared = generation_flight.do(
+                            update.effective_chat.id, f'post:{post_number}',
+                            generate_post, user_data, post_number
+                        )
+                        if shared:
+                            # The first request already delivered this post
+                            return POST_NUMBER
                         logger.info(f"Successfully generated post #{post_number}")
-
-                        update.message.reply_text(
-                            f"✨ Готово! Вот ваш пост #{post_number}:\n\n{generated_post}\n\n"
-                            "Чтобы сгенерировать другой пост, введите его номер (1-14):",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("🔄 Сгенерировать новый контент-план", 
-                                                   callback_data='new_plan')
-                            ]])
+                        history.record_post(
+                            update.effective_chat.id, post_number, generated_post, user_data.get('content_plan')
                         )
+
+                        send_generated_post(update.message, post_number, generated_post, days)
+                        return POST_NUMBER
+                    except InFlightConflict:
+                        update.message.reply_text(STILL_WORKING_TEXT)
                         return POST_NUMBER
                     except Exception as e:
                         logger.error(f"Error generating post: {e}", exc_info=True)
@@ -540,11 +898,12 @@ def text_handler(update: Update, context: CallbackContext) -> int:
                         )
                         return POST_NUMBER
                 else:
-                    update.message.reply_text("❌ Пожалуйста, введите число от 1 до 14.")
+                    update.message.reply_text(f"❌ Пожалуйста, введите число от 1 до {days}.")
                     return POST_NUMBER
             except ValueError:
+                days = context.user_data.get('plan_days') or DEFAULT_PLAN_DAYS
                 update.message.reply_text(
-                    "❌ Пожалуйста, введите корректный номер поста (число от 1 до 14)."
+                    f"❌ Пожалуйста, введите корректный номер поста (число от 1 до {days})."
                 )
                 return POST_NUMBER
             except Exception as e:
@@ -554,6 +913,17 @@ def text_handler(update: Update, context: CallbackContext) -> int:
                 )
                 return ConversationHandler.END
 
+        elif context.user_data.get('waiting_for') == 'plan_edit':
+            days = context.user_data.get('plan_days') or DEFAULT_PLAN_DAYS
+            try:
+                selected = parse_day_selection(text, days)
+            except ValueError:
+                update.message.reply_text(
+                    f"❌ Напишите номера дней от 1 до {days} через запятую, например: 3, 5-7"
+                )
+                return PLAN_EDIT
+            return regenerate_days(update.message, context, update.effective_chat.id, selected)
+
         elif context.user_data.get('waiting_for') == 'repackage_audience' or \
              context.user_data.get('waiting_for') == 'repackage_tool' or \
              context.user_data.get('waiting_for') == 'repackage_result':
@@ -575,6 +945,43 @@ def text_handler(update: Update, context: CallbackContext) -> int:
         )
         return ConversationHandler.END
 
+def generation_key(update: Update, context: CallbackContext) -> Optional[str]:
+    """Return the single-flight key an update would generate with, if any."""
+    if update.callback_query:
+        data = update.callback_query.data or ''
+        if data.startswith('plan_days_'):
+            return 'content_plan'
+        return 'plan_edit' if data.startswith('regen_phase_') else None
+    text = (update.message.text or '').strip() if update.message else ''
+    if context.user_data.get('waiting_for') == 'plan_edit':
+        return 'plan_edit'
+    if context.user_data.get('waiting_for') == 'post_number' and text.isdigit():
+        return f'post:{int(text)}'
+    if context.user_data.get('waiting_for') == 'repackage_result':
+        return 'repackage'
+    return None
+
+def handle_while_generating(update: Update, context: CallbackContext) -> None:
+    """Handle updates that arrive while a generation for the chat is running.
+
+    Repeats of the running request are attached to it (its reply serves both),
+    anything else gets a "still working" notice. Returns None so the pending
+    conversation state is left untouched.
+    """
+    if update.callback_query:
+        update.callback_query.answer()
+
+    chat_id = update.effective_chat.id
+    key = generation_key(update, context)
+    try:
+        if key is not None and generation_flight.attach(chat_id, key):
+            return None
+    except InFlightConflict as e:
+        logger.info(f"Chat {chat_id}: {key} conflicts with in-flight {e.in_flight_key}")
+
+    update.effective_message.reply_text(STILL_WORKING_TEXT)
+    return None
+
 def cancel(update: Update, context: CallbackContext) -> int:
     """Cancel and end the conversation."""
     update.message.reply_text(
@@ -0,0 +1,262 @@
+"""History of generated plans and posts, searchable with /search.
+
+Every plan and post the bot generates is appended to generation_history.
+generation_search is an FTS5 index over it (external content, kept in sync by
+triggers, see database.init_db); its `owner` column holds one token per chat,
+so `owner:c42 AND ...` restricts a query to one user's documents inside the
+index instead of filtering a global result list. The same chat in another
+tenant's bot (tenants.py) shares the token; its rows are dropped by the join.
+Bodies are stored as plain text because snippet() reads them from the content
+table.
+
+/search <words> answers with one message: ranked results with highlighted
+snippets, page buttons that edit the same message, and a button per result
+that sends the full text.
+"""
+import os
+import re
+import html
+import sqlite3
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update
+from telegram.error import BadRequest
+from telegram.ext import (
+    CallbackContext, CallbackQueryHandler, CommandHandler, Dispatcher, DispatcherHandlerStop, Filters
+)
+from database import DB_PATH, current_tenant
+from prompts import plan_entries, plan_headline
+from postprocess import html_parts
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '5'))
+SNIPPET_TOKENS = 16
+MAX_QUERY_WORDS = 8
+# Words this long match as a prefix (кофе -> кофейный), longer ones lose
+# their ending first (продажи -> прода*); shorter ones match exactly
+PREFIX_MIN_CHARS = 3
+STEM_MIN_CHARS = 6
+# Highlight markers, replaced with <b></b> after HTML escaping
+MARK_START, MARK_END = '\x02', '\x03'
+
+KIND_ICONS = {'plan': '📋', 'post': '✍️'}
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def owner_token(chat_id: int) -> str:
+    """The token of `chat_id` in the owner column (kept in sync with the triggers)."""
+    return 'c' + str(chat_id).replace('-', 'm')
+
+def record(chat_id: int, kind: str, body: str, title: str = '', day: Optional[int] = None) -> None:
+    """Append a generated plan or post to the history. Errors are logged, never raised."""
+    conn = None
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO generation_history (tenant_id, chat_id, kind, day, title, body) VALUES (?, ?, ?, ?, ?, ?)',
+                (current_tenant(), chat_id, kind, day, title, body)
+            )
+        metrics.incr('history.recorded')
+    except Exception as e:
+        logger.error(f"Error recording {kind} for {chat_id} in history: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def record_plan(chat_id: int, content_plan: str, days: int, edited: str = '') -> None:
+    title = f"Контент-план на {days} дней" + (f" (обновлены дни {edited})" if edited else '')
+    record(chat_id, 'plan', content_plan, title)
+
+def post_title(day: int, content_plan: str = '') -> str:
+    entry = plan_entries(content_plan).get(day)
+    return f"Пост #{day}" + (f": {plan_headline(entry)}" if entry else '')
+
+def record_post(chat_id: int, day: int, text: str, content_plan: str = '') -> None:
+    record(chat_id, 'post', text, post_title(day, content_plan), day)
+
+def plan_posts(chat_id: int, content_plan: str) -> Dict[int, str]:
+    """The latest post written for each day of `content_plan`, by day.
+
+    A post belongs to the plan while its title still matches the day's
+    headline, so posts of days changed by an edit are left out.
+    """
+    titles = {day: post_title(day, content_plan) for day in plan_entries(content_plan)}
+    if not titles:
+        return {}
+    conn = None
+    try:
+        conn = _connect()
+        rows = conn.execute(f'''
+            SELECT day, title, body FROM generation_history
+            WHERE chat_id = ? AND tenant_id = ? AND kind = 'post'
+              AND day IN ({', '.join('?' * len(titles))})
+            ORDER BY id
+        ''', (chat_id, current_tenant(), *titles)).fetchall()
+        return {row['day']: row['body'] for row in rows if row['title'] == titles[row['day']]}
+    finally:
+        if conn:
+            conn.close()
+
+def build_match(query: str, chat_id: int) -> Optional[str]:
+    """FTS5 query for the user's words, or None if there are none.
+
+    Words are quoted (no FTS syntax from users) and match as prefixes, long
+    ones without their last two letters: a cheap stand-in for Russian stemming.
+    """
+    words = re.findall(r'\w+', query.lower())[:MAX_QUERY_WORDS]
+    if not words:
+        return None
+    terms = []
+    for word in words:
+        if len(word) >= STEM_MIN_CHARS:
+            word = word[:-2]
+        terms.append(f'"{word}"*' if len(word) >= PREFIX_MIN_CHARS else f'"{word}"')
+    return f"owner:{owner_token(chat_id)} AND {' AND '.join(terms)}"
+
+def search(chat_id: int, query: str, offset: int = 0,
+           limit: int = SEARCH_PAGE_SIZE) -> Tuple[int, List[Dict[str, Any]]]:
+    """(total matches, one page of results best first) for the user's own history."""
+    match = build_match(query, chat_id)
+    if match is None:
+        return 0, []
+    conn = None
+    try:
+        conn = _connect()
+        tenant_id = current_tenant()
+        total = conn.execute('''
+            SELECT COUNT(*) FROM generation_search
+            JOIN generation_history h ON h.id = generation_search.rowid
+            WHERE generation_search MATCH ? AND h.tenant_id = ?
+        ''', (match, tenant_id)).fetchone()[0]
+        if not total:
+            return 0, []
+        rows = conn.execute(f'''
+            SELECT h.id, h.kind, h.day, h.title, h.created_at,
+                   snippet(generation_search, 2, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet
+            FROM generation_search
+            JOIN generation_history h ON h.id = generation_search.rowid
+            WHERE generation_search MATCH ? AND h.tenant_id = ?
+            ORDER BY bm25(generation_search, 0.0, 2.0, 1.0)
+            LIMIT ? OFFSET ?
+        ''', (MARK_START, MARK_END, match, tenant_id, limit, offset)).fetchall()
+        return total, [dict(row) for row in rows]
+    finally:
+        if conn:
+            conn.close()
+
+def get_entry(chat_id: int, entry_id: int) -> Optional[Dict[str, Any]]:
+    conn = None
+    try:
+        conn = _connect()
+        row = conn.execute(
+            'SELECT * FROM generation_history WHERE id = ? AND chat_id = ? AND tenant_id = ?',
+            (entry_id, chat_id, current_tenant())
+        ).fetchone()
+        return dict(row) if row else None
+    finally:
+        if conn:
+            conn.close()
+
+def _highlight(text: str) -> str:
+    return html.escape(text).replace(MARK_START, '<b>').replace(MARK_END, '</b>')
+
+def format_results(query: str, total: int, results: List[Dict[str, Any]], offset: int) -> str:
+    if not total:
+        return f"🔎 По запросу «{html.escape(query)}» ничего не найдено."
+    lines = [
+        f"🔎 Результаты по запросу «{html.escape(query)}»: "
+        f"{offset + 1}–{offset + len(results)} из {total}"
+    ]
+    for number, result in enumerate(results, offset + 1):
+        date = f"{result['created_at'][8:10]}.{result['created_at'][5:7]}.{result['created_at'][:4]}"
+        lines.append(
+            f"\n{number}. {KIND_ICONS.get(result['kind'], '•')} <b>{html.escape(result['title'] or '')}</b> · {date}\n"
+            f"{_highlight(' '.join(result['snippet'].split()))}"
+        )
+    return '\n'.join(lines)
+
+def results_keyboard(total: int, results: List[Dict[str, Any]], offset: int) -> Optional[InlineKeyboardMarkup]:
+    if not results:
+        return None
+    keyboard = [[
+        InlineKeyboardButton(f"📄 {number}", callback_data=f"search_open_{result['id']}")
+        for number, result in enumerate(results, offset + 1)
+    ]]
+    pages = []
+    if offset > 0:
+        pages.append(InlineKeyboardButton("◀️ Назад", callback_data=f"search_page_{max(0, offset - SEARCH_PAGE_SIZE)}"))
+    if offset + len(results) < total:
+        pages.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"search_page_{offset + SEARCH_PAGE_SIZE}"))
+    if pages:
+        keyboard.append(pages)
+    return InlineKeyboardMarkup(keyboard)
+
+def search_command(update: Update, context: CallbackContext) -> None:
+    """/search <words> - the user's generated plans and posts, best matches first."""
+    query = ' '.join(context.args or []).strip()
+    if not query:
+        update.message.reply_text(
+            "🔎 Поиск по вашим контент-планам и постам.\n"
+            "Использование: /search <слова>, например: /search кофе продажи"
+        )
+        raise DispatcherHandlerStop()
+    total, results = search(update.effective_chat.id, query)
+    metrics.incr('history.searches')
+    context.user_data['search_query'] = query
+    update.message.reply_text(
+        format_results(query, total, results, 0),
+        parse_mode=ParseMode.HTML,
+        reply_markup=results_keyboard(total, results, 0)
+    )
+    raise DispatcherHandlerStop()
+
+def search_button(update: Update, context: CallbackContext) -> None:
+    """Page buttons edit the results message, result buttons send the full text."""
+    query = update.callback_query
+    query.answer()
+    chat_id = update.effective_chat.id
+    if query.data.startswith('search_open_'):
+        entry = get_entry(chat_id, int(query.data[len('search_open_'):]))
+        if entry is None:
+            query.message.reply_text("❌ Этот результат больше не доступен.")
+            raise DispatcherHandlerStop()
+        text = f"{KIND_ICONS.get(entry['kind'], '•')} {entry['title']}\n\n{entry['body']}"
+        for part in html_parts(text):
+            query.message.reply_text(part, parse_mode=ParseMode.HTML)
+        raise DispatcherHandlerStop()
+
+    search_query = context.user_data.get('search_query')
+    if not search_query:
+        query.message.reply_text("Поиск устарел, повторите его командой /search")
+        raise DispatcherHandlerStop()
+    offset = int(query.data[len('search_page_'):])
+    total, results = search(chat_id, search_query, offset)
+    try:
+        query.message.edit_text(
+            format_results(search_query, total, results, offset),
+            parse_mode=ParseMode.HTML,
+            reply_markup=results_keyboard(total, results, offset)
+        )
+    except BadRequest as e:
+        # "message is not modified" after a double tap
+        logger.info(f"Search page not updated: {e.message}")
+    raise DispatcherHandlerStop()
+
+def install_search(dispatcher: Dispatcher, group: int = 0) -> None:
+    """Register /search and its buttons.
+
+    Add it before the conversation handler when sharing its group:
+    MAIN_MENU answers any button.
+    """
+    dispatcher.add_handler(
+        CommandHandler('search', search_command, filters=Filters.chat_type.private), group=group
+    )
+    dispatcher.add_handler(
+        CallbackQueryHandler(search_button, pattern=r'^search_(page|open)_\d+$'), group=group
+    )
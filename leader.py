@@ -0,0 +1,75 @@
+import os
+import fcntl
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+LEADER_LOCK_PATH = os.getenv('BOT_LEADER_LOCK', '/tmp/telegram_bot_leader.lock')
+LEADER_RETRY_SECONDS = float(os.getenv('BOT_LEADER_RETRY_SECONDS', '5'))
+
+class LeaderElection:
+    """Elect one process out of several gunicorn workers to run the bot.
+
+    Uses an exclusive flock on a shared lock file. The kernel releases the
+    lock when the holder dies, so one of the waiting workers picks it up on
+    its next attempt. While leading, on_elected is called again whenever
+    is_running() reports the bot has stopped.
+    """
+
+    def __init__(
+        self,
+        on_elected: Callable[[], None],
+        is_running: Optional[Callable[[], bool]] = None,
+        lock_path: str = LEADER_LOCK_PATH,
+        retry_seconds: float = LEADER_RETRY_SECONDS
+    ):
+        self.on_elected = on_elected
+        self.is_running = is_running
+        self.lock_path = lock_path
+        self.retry_seconds = retry_seconds
+        self.is_leader = False
+        self._lock_file = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _try_acquire(self) -> bool:
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        return True
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                if not self.is_leader and self._try_acquire():
+                    self.is_leader = True
+                    logger.info(f"Process {os.getpid()} elected as bot leader")
+                    self.on_elected()
+                elif self.is_leader and self.is_running and not self.is_running():
+                    logger.warning("Bot stopped in the leader process, restarting it")
+                    self.on_elected()
+            except Exception as e:
+                logger.error(f"Leader election error: {e}", exc_info=True)
+            self._stopped.wait(self.retry_seconds)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='leader-election', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._lock_file:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
@@ -2,16 +2,24 @@ from app import app
 import logging
 import os
 import sys
+import threading
 from telegram.ext import (
     Updater, CommandHandler, MessageHandler, Filters,
     CallbackQueryHandler, ConversationHandler
 )
 from database import init_db
+from maintenance import schedule_maintenance
+from analytics import schedule_analytics, track
+from sessions import SessionManager
+from profiling import instrument, install_profiling
+from features import install_shared
 from handlers import (
     start, handle_main_menu, handle_repackage, button_handler, text_handler, cancel,
+    handle_while_generating, handle_example_export,
     SUBSCRIPTION_CHECK, MAIN_MENU, TOPIC, AUDIENCE, MONETIZATION,
     PRODUCT_DETAILS, PREFERENCES, STYLE, EMOTIONS,
-    EXAMPLES, POST_NUMBER, REPACKAGE_AUDIENCE, REPACKAGE_TOOL, REPACKAGE_RESULT
+    EXAMPLES, POST_NUMBER, REPACKAGE_AUDIENCE, REPACKAGE_TOOL, REPACKAGE_RESULT,
+    PROFILE_CHOICE, PLAN_EDIT, STATE_NAMES
 )
 
 # Set up logging
@@ -21,6 +29,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Overridable so the bot can talk to a local Bot API server (or a fake one in benchmarks)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL") or None
+
 def error_handler(update, context):
     """Log Errors caused by Updates."""
     logger.error(f"============ ERROR OCCURRED ============")
@@ -28,6 +39,118 @@ def error_handler(update, context):
     logger.error(f"Error: {context.error}")
     logger.error("========================================")
 
+def build_conversation_handler(persistent: bool = False) -> ConversationHandler:
+    """Create the main conversation handler shared by all bot runtimes."""
+    conversation = ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            SUBSCRIPTION_CHECK: [
+                CallbackQueryHandler(button_handler, pattern='^check_subscription$')
+            ],
+            MAIN_MENU: [
+                CallbackQueryHandler(handle_main_menu)
+            ],
+            TOPIC: [
+                CallbackQueryHandler(button_handler, pattern='^start_work$'),
+                MessageHandler(Filters.text & ~Filters.command, text_handler)
+            ],
+            AUDIENCE: [
+                MessageHandler(Filters.text & ~Filters.command, text_handler)
+            ],
+            MONETIZATION: [
+                CallbackQueryHandler(button_handler, pattern='^(advertising|products|services|consulting)$')
+            ],
+            PRODUCT_DETAILS: [
+                MessageHandler(Filters.text & ~Filters.command, text_handler)
+            ],
+            PREFERENCES: [
+                MessageHandler(Filters.text & ~Filters.command, text_handler)
+            ],
+            STYLE: [
+                CallbackQueryHandler(button_handler, pattern='^(aggressive|business|humorous|custom)$'),
+                MessageHandler(Filters.text & ~Filters.command, text_handler)
+            ],
+            EMOTIONS: [
+                MessageHandler(Filters.text & ~Filters.command, text_handler)
+            ],
+            EXAMPLES: [
+                MessageHandler((Filters.text | Filters.forwarded) & ~Filters.command, text_handler),
+                # A channel export to pick examples from; reading it can take a while
+                MessageHandler(Filters.document.file_extension('json'), handle_example_export, run_async=True),
+                CallbackQueryHandler(button_handler, pattern='^(add_example|finish_examples)$'),
+                # Generation runs off the dispatcher thread; see WAITING below
+                CallbackQueryHandler(button_handler, pattern=r'^plan_days_\d+$', run_async=True)
+            ],
+            POST_NUMBER: [
+                CallbackQueryHandler(button_handler, pattern='^(new_plan|edit_plan)$'),
+                MessageHandler(Filters.text & ~Filters.command, text_handler, run_async=True)
+            ],
+            # New states for product repackaging
+            REPACKAGE_AUDIENCE: [
+                MessageHandler(Filters.text & ~Filters.command, handle_repackage)
+            ],
+            REPACKAGE_TOOL: [
+                MessageHandler(Filters.text & ~Filters.command, handle_repackage)
+            ],
+            REPACKAGE_RESULT: [
+                MessageHandler(Filters.text & ~Filters.command, handle_repackage, run_async=True)
+            ],
+            # Returning users: reuse the saved profile or edit part of the plan
+            PROFILE_CHOICE: [
+                CallbackQueryHandler(button_handler, pattern='^(reuse_profile|fresh_profile|show_plan|edit_plan)$')
+            ],
+            PLAN_EDIT: [
+                CallbackQueryHandler(button_handler, pattern=r'^regen_phase_\w+$', run_async=True),
+                MessageHandler(Filters.text & ~Filters.command, text_handler, run_async=True)
+            ],
+            # While a run_async generation is pending: coalesce repeats, ask others to wait
+            ConversationHandler.WAITING: [
+                CallbackQueryHandler(handle_while_generating),
+                MessageHandler(Filters.text & ~Filters.command, handle_while_generating)
+            ],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        allow_reentry=True,
+        name="main_conversation",
+        persistent=persistent
+    )
+    # Every state change goes to the funnel event log; callbacks report to
+    # the profiler while a /profile window is open
+    return instrument(track(conversation, STATE_NAMES), STATE_NAMES)
+
+def install_handlers(dispatcher) -> None:
+    """Everything one bot handles; run for the single bot and for each tenant (tenants.py)."""
+    # Add error handler
+    dispatcher.add_error_handler(error_handler)
+    logger.info("Error handler added")
+
+    # Create conversation handler with the new states
+    conv_handler = build_conversation_handler()
+
+    # /autopost, /search, /broadcast, /funnel, plan documents (features.py); added first, MAIN_MENU answers any button
+    install_shared(dispatcher)
+
+    # Add handler to dispatcher
+    dispatcher.add_handler(conv_handler)
+    logger.info("Conversation handler added")
+
+    # Evict idle sessions so memory doesn't grow with every user ever seen
+    SessionManager(dispatcher, conv_handler).install()
+
+    # /profile for admins, PROFILE_SECONDS for a window from startup
+    install_profiling(dispatcher)
+
+def run_tenants() -> None:
+    """Run every bot listed in TENANTS in this process, until a stop signal."""
+    from tenants import TenantRuntime, load_tenants
+    runtime = TenantRuntime(load_tenants(), install_handlers)
+    # One maintenance job covers the rows of every tenant
+    schedule_maintenance(runtime.dispatchers[0].job_queue)
+    schedule_analytics(runtime.dispatchers[0].job_queue)
+    runtime.start()
+    logger.info("Tenants started successfully!")
+    runtime.idle()
+
 def run_telegram_bot():
     """Start the bot."""
     try:
@@ -35,6 +158,11 @@ def run_telegram_bot():
         init_db()
         logger.info("Database initialized")
 
+        # Several white-label bots sharing this process and database
+        if os.getenv("TENANTS"):
+            run_tenants()
+            return
+
         # Initialize the bot
         TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
         if not TOKEN:
@@ -42,83 +170,36 @@ def run_telegram_bot():
             return
 
         # Create the Updater and pass it your bot's token
-        updater = Updater(token=TOKEN, use_context=True)
+        updater = Updater(token=TOKEN, use_context=True, base_url=TELEGRAM_API_BASE_URL)
         dispatcher = updater.dispatcher
         logger.info("Bot dispatcher initialized")
 
-        # Add error handler
-        dispatcher.add_error_handler(error_handler)
-        logger.info("Error handler added")
-
-        # Create conversation handler with the new states
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', start)],
-            states={
-                SUBSCRIPTION_CHECK: [
-                    CallbackQueryHandler(button_handler, pattern='^check_subscription$')
-                ],
-                MAIN_MENU: [
-                    CallbackQueryHandler(handle_main_menu)
-                ],
-                TOPIC: [
-                    CallbackQueryHandler(button_handler, pattern='^start_work$'),
-                    MessageHandler(Filters.text & ~Filters.command, text_handler)
-                ],
-                AUDIENCE: [
-                    MessageHandler(Filters.text & ~Filters.command, text_handler)
-                ],
-                MONETIZATION: [
-                    CallbackQueryHandler(button_handler, pattern='^(advertising|products|services|consulting)$')
-                ],
-                PRODUCT_DETAILS: [
-                    MessageHandler(Filters.text & ~Filters.command, text_handler)
-                ],
-                PREFERENCES: [
-                    MessageHandler(Filters.text & ~Filters.command, text_handler)
-                ],
-                STYLE: [
-                    CallbackQueryHandler(button_handler, pattern='^(aggressive|business|humorous|custom)$'),
-                    MessageHandler(Filters.text & ~Filters.command, text_handler)
-                ],
-                EMOTIONS: [
-                    MessageHandler(Filters.text & ~Filters.command, text_handler)
-                ],
-                EXAMPLES: [
-                    MessageHandler((Filters.text | Filters.forwarded) & ~Filters.command, text_handler),
-                    CallbackQueryHandler(button_handler, pattern='^add_example$'),
-                    CallbackQueryHandler(button_handler, pattern='^finish_examples$')
-                ],
-                POST_NUMBER: [
-                    CallbackQueryHandler(button_handler, pattern='^new_plan$'),
-                    MessageHandler(Filters.text & ~Filters.command, text_handler)
-                ],
-                # New states for product repackaging
-                REPACKAGE_AUDIENCE: [
-                    MessageHandler(Filters.text & ~Filters.command, handle_repackage)
-                ],
-                REPACKAGE_TOOL: [
-                    MessageHandler(Filters.text & ~Filters.command, handle_repackage)
-                ],
-                REPACKAGE_RESULT: [
-                    MessageHandler(Filters.text & ~Filters.command, handle_repackage)
-                ],
-            },
-            fallbacks=[CommandHandler('cancel', cancel)],
-            allow_reentry=True,
-            name="main_conversation"
-        )
-
-        # Add handler to dispatcher
-        dispatcher.add_handler(conv_handler)
-        logger.info("Conversation handler added")
+        install_handlers(dispatcher)
+
+        # Periodic retention/compaction of bot.db
+        schedule_maintenance(updater.job_queue)
+
+        # Incremental funnel rollups of the analytics event log
+        schedule_analytics(updater.job_queue)
+
+        # Optional capture of live traffic for offline replay (recorder.py)
+        recorder = None
+        if os.getenv('RECORD_TRAFFIC'):
+            from recorder import TrafficRecorder, install_recorder
+            recorder = install_recorder(dispatcher, TrafficRecorder(os.getenv('RECORD_TRAFFIC')))
 
         # Start the Bot
         logger.info("Bot starting...")
         updater.start_polling(drop_pending_updates=True)
         logger.info("Bot started successfully!")
 
-        # Keep the bot running
-        updater.idle()
+        # Keep the bot running (signal handlers can only be installed from the main thread)
+        if threading.current_thread() is threading.main_thread():
+            updater.idle()
+        else:
+            updater.idle(stop_signals=())
+        if recorder:
+            recorder.close()
 
     except Exception as e:
         logger.error(f"Fatal error: {e}", exc_info=True)
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from typing import Dict, Any
+from telegram.ext import CallbackContext
+from database import DB_PATH, COMPRESS_MIN_BYTES, pack_text, save_user_examples, tenant_scope
+
+logger = logging.getLogger(__name__)
+
+# Retention settings (can be overridden from the environment)
+RETENTION_DAYS = int(os.getenv('DB_RETENTION_DAYS', '180'))
+BATCH_SIZE = int(os.getenv('DB_MAINTENANCE_BATCH_SIZE', '200'))
+ARCHIVE_EXPIRED = os.getenv('DB_ARCHIVE_EXPIRED', '0') == '1'
+# Finished API jobs (api.py) hold whole plans; the CMS fetches them within minutes
+API_JOB_RETENTION_DAYS = int(os.getenv('API_JOB_RETENTION_DAYS', '7'))
+# Analytics events are kept this long once folded into the rollups
+ANALYTICS_RETENTION_DAYS = int(os.getenv('ANALYTICS_RETENTION_DAYS', '30'))
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv('DB_MAINTENANCE_INTERVAL_HOURS', '24'))
+
+# Pause between batches so handler writes can grab the lock in between
+BATCH_PAUSE_SECONDS = 0.05
+VACUUM_PAGES_PER_STEP = 256
+
+USER_COLUMNS = [
+    'tenant_id', 'chat_id', 'channel_topic', 'target_audience', 'monetization',
+    'product_details', 'preferences', 'style', 'emotions', 'examples',
+    'content_plan', 'tone_of_voice', 'saved_audience', 'content_theme',
+    'last_interaction', 'plan_days', 'blocked_at'
+]
+
+def _database_size(conn) -> tuple:
+    """Return (file size, free page bytes) computed from the page counters."""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_size * page_count, page_size * freelist
+
+def purge_stale_users(conn, retention_days: int, batch_size: int, archive: bool) -> int:
+    """Delete (or archive) users of every tenant whose last interaction is older than the cutoff."""
+    cutoff = f'-{int(retention_days)} days'
+    columns = ', '.join(USER_COLUMNS)
+    total = 0
+    while True:
+        # (tenant_id, chat_id) pairs
+        keys = conn.execute('''
+            SELECT tenant_id, chat_id FROM users
+            WHERE last_interaction < datetime('now', ?)
+            ORDER BY last_interaction
+            LIMIT ?
+        ''', (cutoff, batch_size)).fetchall()
+        if not keys:
+            break
+
+        with conn:
+            if archive:
+                conn.executemany(
+                    f'INSERT INTO users_archive ({columns}) '
+                    f'SELECT {columns} FROM users WHERE tenant_id = ? AND chat_id = ?',
+                    keys
+                )
+            else:
+                # Archived users keep their examples, see delete_orphan_examples
+                conn.executemany('DELETE FROM user_examples WHERE tenant_id = ? AND chat_id = ?', keys)
+            conn.executemany('DELETE FROM users WHERE tenant_id = ? AND chat_id = ?', keys)
+            # Their cached plan documents (documents.py) would never be sent again
+            conn.executemany('DELETE FROM plan_documents WHERE tenant_id = ? AND chat_id = ?', keys)
+
+        total += len(keys)
+        logger.info(f"Expired {len(keys)} users (total {total})")
+        time.sleep(BATCH_PAUSE_SECONDS)
+    return total
+
+def compact_text_columns(conn, batch_size: int) -> int:
+    """Move old JSON examples to example_posts and compress long plans in place."""
+    last_key = (None, None)
+    total = 0
+    while True:
+        rows = conn.execute('''
+            SELECT tenant_id, chat_id, examples, content_plan FROM users
+            WHERE ((typeof(examples) = 'text' AND examples != '')
+                   OR (typeof(content_plan) = 'text' AND length(CAST(content_plan AS BLOB)) >= ?))
+              AND (? IS NULL OR (tenant_id, chat_id) > (?, ?))
+            ORDER BY tenant_id, chat_id
+            LIMIT ?
+        ''', (COMPRESS_MIN_BYTES, last_key[0], *last_key, batch_size)).fetchall()
+        if not rows:
+            break
+
+        with conn:
+            for tenant_id, chat_id, examples, content_plan in rows:
+                if isinstance(examples, str) and examples:
+                    try:
+                        parsed = json.loads(examples)
+                    except json.JSONDecodeError:
+                        parsed = None
+                    if isinstance(parsed, list):
+                        with tenant_scope(tenant_id):
+                            save_user_examples(conn, chat_id, parsed)
+                        conn.execute(
+                            "UPDATE users SET examples = '' WHERE tenant_id = ? AND chat_id = ?", (tenant_id, chat_id)
+                        )
+                if isinstance(content_plan, str):
+                    conn.execute(
+                        'UPDATE users SET content_plan = ? WHERE tenant_id = ? AND chat_id = ?',
+                        (pack_text(content_plan), tenant_id, chat_id)
+                    )
+
+        total += len(rows)
+        last_key = tuple(rows[-1][:2])
+        time.sleep(BATCH_PAUSE_SECONDS)
+    return total
+
+def delete_orphan_examples(conn) -> int:
+    """Remove example texts no user (or archived user) refers to any more."""
+    with conn:
+        cursor = conn.execute(
+            'DELETE FROM example_posts WHERE hash NOT IN (SELECT hash FROM user_examples)'
+        )
+    return cursor.rowcount
+
+def delete_stale_summaries(conn, retention_days: int) -> int:
+    """Drop cached field summaries older than the retention period; they're rebuilt on use."""
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM field_summaries WHERE created_at < datetime('now', ?)",
+            (f'-{retention_days} days',)
+        )
+    return cursor.rowcount
+
+def delete_stale_api_jobs(conn, retention_days: int) -> int:
+    """Drop API jobs created before the retention period."""
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM api_jobs WHERE created_at < datetime('now', ?)", (f'-{retention_days} days',)
+        )
+    return cursor.rowcount
+
+def delete_rolled_up_events(conn, retention_days: int, batch_size: int) -> int:
+    """Drop analytics events older than the retention period that are already rolled up."""
+    cutoff = time.time() - retention_days * 86400
+    deleted = 0
+    while True:
+        with conn:
+            cursor = conn.execute('''
+                DELETE FROM analytics_events WHERE id IN (
+                    SELECT id FROM analytics_events
+                    WHERE id <= (SELECT last_event_id FROM analytics_rollup WHERE id = 1) AND created_at < ?
+                    ORDER BY id LIMIT ?
+                )
+            ''', (cutoff, batch_size))
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+def delete_stale_history(conn, retention_days: int, batch_size: int) -> int:
+    """Drop generation history older than the retention period, batch by batch.
+
+    The triggers remove every row from the search index too, so the batches
+    stay small; afterwards a bounded FTS merge folds the delete markers in.
+    """
+    deleted = 0
+    while True:
+        with conn:
+            cursor = conn.execute('''
+                DELETE FROM generation_history WHERE id IN (
+                    SELECT id FROM generation_history WHERE created_at < datetime('now', ?)
+                    ORDER BY id LIMIT ?
+                )
+            ''', (f'-{retention_days} days', batch_size))
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            break
+        time.sleep(BATCH_PAUSE_SECONDS)
+    if deleted:
+        with conn:
+            conn.execute("INSERT INTO generation_search (generation_search, rank) VALUES ('merge', 500)")
+    return deleted
+
+def incremental_vacuum(conn, convert: bool = False) -> None:
+    """Return free pages to the filesystem a few at a time."""
+    mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    if mode != 2:
+        if not convert:
+            logger.warning(
+                "auto_vacuum is not INCREMENTAL for this database; "
+                "run `python maintenance.py --convert-vacuum` once to enable it"
+            )
+            return
+        # One-off full rebuild, only done on explicit request from the CLI
+        logger.info("Converting database to incremental auto_vacuum (full VACUUM)")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return
+
+    while conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+        conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})').fetchall()
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+def run_maintenance(
+    db_path: str = DB_PATH,
+    retention_days: int = RETENTION_DAYS,
+    batch_size: int = BATCH_SIZE,
+    archive: bool = ARCHIVE_EXPIRED,
+    convert_vacuum: bool = False
+) -> Dict[str, Any]:
+    """Run retention, compaction, vacuum and ANALYZE. Returns a report."""
+    conn = None
+    try:
+        conn = sqlite3.connect(db_path, timeout=30)
+        size_before, _ = _database_size(conn)
+
+        expired = purge_stale_users(conn, retention_days, batch_size, archive)
+        compacted = compact_text_columns(conn, batch_size)
+        orphans = delete_orphan_examples(conn)
+        summaries = delete_stale_summaries(conn, retention_days)
+        stale_history = delete_stale_history(conn, retention_days, batch_size)
+        api_jobs = delete_stale_api_jobs(conn, API_JOB_RETENTION_DAYS)
+        events = delete_rolled_up_events(conn, ANALYTICS_RETENTION_DAYS, batch_size)
+        incremental_vacuum(conn, convert=convert_vacuum)
+        conn.execute('ANALYZE')
+        conn.commit()
+
+        size_after, free_after = _database_size(conn)
+        report = {
+            'expired_users': expired,
+            'archived': archive,
+            'compacted_users': compacted,
+            'orphan_examples': orphans,
+            'stale_summaries': summaries,
+            'stale_history': stale_history,
+            'stale_api_jobs': api_jobs,
+            'analytics_events': events,
+            'bytes_before': size_before,
+            'bytes_after': size_after,
+            'reclaimed_bytes': size_before - size_after,
+            'free_bytes_left': free_after,
+        }
+        logger.info(f"Database maintenance finished: {report}")
+        return report
+    finally:
+        if conn:
+            conn.close()
+
+def maintenance_job(context: CallbackContext) -> None:
+    """JobQueue callback that runs the maintenance with the configured settings."""
+    try:
+        run_maintenance()
+    except Exception as e:
+        logger.error(f"Database maintenance failed: {e}", exc_info=True)
+
+def schedule_maintenance(job_queue) -> None:
+    """Register the periodic maintenance job on the Updater's JobQueue."""
+    if MAINTENANCE_INTERVAL_HOURS <= 0:
+        logger.info("Database maintenance job disabled")
+        return
+    interval = MAINTENANCE_INTERVAL_HOURS * 3600
+    job_queue.run_repeating(maintenance_job, interval=interval, first=600, name='db_maintenance')
+    logger.info(f"Database maintenance scheduled every {MAINTENANCE_INTERVAL_HOURS}h")
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Expire old users and compact bot.db")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--archive', action='store_true', default=ARCHIVE_EXPIRED)
+    parser.add_argument('--convert-vacuum', action='store_true',
+                        help="rebuild the file once with auto_vacuum=INCREMENTAL")
+    args = parser.parse_args()
+
+    try:
+        result = run_maintenance(
+            db_path=args.db,
+            retention_days=args.days,
+            batch_size=args.batch_size,
+            archive=args.archive,
+            convert_vacuum=args.convert_vacuum
+        )
+        print(json.dumps(result, indent=2))
+    except Exception:
+        logger.error("Database maintenance failed", exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,17 @@
+import threading
+from collections import Counter
+from typing import Dict
+
+# Process-wide counters, read by the /metrics route and admin commands
+_counters = Counter()
+_lock = threading.Lock()
+
+def incr(name: str, value: int = 1) -> None:
+    """Increase a named counter."""
+    with _lock:
+        _counters[name] += value
+
+def snapshot() -> Dict[str, int]:
+    """Return a copy of all counters."""
+    with _lock:
+        return dict(_counters)
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Tuple
+from telegram.ext import BasePersistence
+from database import DB_PATH, current_tenant
+
+logger = logging.getLogger(__name__)
+
+def _key_to_str(key: Tuple[int, ...]) -> str:
+    return json.dumps(list(key))
+
+def _str_to_key(value: str) -> Tuple[int, ...]:
+    return tuple(json.loads(value))
+
+class SQLitePersistence(BasePersistence):
+    """Keep user_data and conversation states in bot.db.
+
+    user_data is loaded lazily: the Dispatcher calls refresh_user_data before
+    every update, so a worker always sees the latest state written by whichever
+    process handled the previous update of that user. Rows belong to the
+    current tenant (see tenants.py).
+    """
+
+    def __init__(self, db_path: str = DB_PATH, key_filter: Optional[Callable[[Tuple[int, ...]], bool]] = None):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.db_path = db_path
+        # Limits which conversations are loaded, e.g. only the chats of one shard
+        self.key_filter = key_filter
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        # Safe with WAL; avoids an fsync on every update
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def get_user_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_chat_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_bot_data(self) -> dict:
+        return {}
+
+    def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        conn = None
+        try:
+            conn = self._connect()
+            rows = conn.execute(
+                'SELECT conversation_key, state FROM conversation_states WHERE tenant_id = ? AND name = ?',
+                (current_tenant(), name)
+            ).fetchall()
+            conversations = {}
+            for key, state in rows:
+                key = _str_to_key(key)
+                if self.key_filter is None or self.key_filter(key):
+                    conversations[key] = json.loads(state)
+            logger.info(f"Loaded {len(conversations)} conversation states for {name}")
+            return conversations
+        finally:
+            if conn:
+                conn.close()
+
+    def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        if isinstance(new_state, tuple):
+            # (old_state, Promise) while a run_async handler is pending: keep the old state
+            new_state = new_state[0]
+        conn = None
+        try:
+            conn = self._connect()
+            if new_state is None:
+                conn.execute(
+                    'DELETE FROM conversation_states WHERE tenant_id = ? AND name = ? AND conversation_key = ?',
+                    (current_tenant(), name, _key_to_str(key))
+                )
+            else:
+                conn.execute('''
+                    INSERT OR REPLACE INTO conversation_states (tenant_id, name, conversation_key, state, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (current_tenant(), name, _key_to_str(key), json.dumps(new_state)))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving conversation state {key}: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        conn = None
+        try:
+            conn = self._connect()
+            conn.execute('''
+                INSERT OR REPLACE INTO session_data (tenant_id, user_id, data, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (current_tenant(), user_id, json.dumps(data)))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving session data for user {user_id}: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        conn = None
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT data FROM session_data WHERE tenant_id = ? AND user_id = ?', (current_tenant(), user_id)
+            ).fetchone()
+            if row:
+                user_data.clear()
+                user_data.update(json.loads(row[0]))
+        except Exception as e:
+            logger.error(f"Error loading session data for user {user_id}: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    def update_bot_data(self, data: dict) -> None:
+        pass
@@ -0,0 +1,242 @@
+"""Local clean-up of generated texts, so prompt rules hold without a new generation.
+
+The post prompt forbids `*` and hashtags and asks for moderate emoji; models
+still slip. clean_text() fixes that deterministically: markdown asterisks,
+headers and hashtags are removed, emoji runs and excess inline emoji are
+dropped, whitespace is normalized. Each rule that fired is counted in metrics
+as postprocess.<rule>.
+
+finalize() applies it to every generated text. Only what can't be fixed
+locally (a post that came back in another language) is sent once more to the
+model, on the cheap 'validation' route.
+
+Texts are sent as HTML: split_message() cuts at paragraph boundaries under
+the message limit and html_parts() escapes each part.
+"""
+import re
+import html
+import logging
+from typing import Dict, List, Optional, Tuple
+from backends import get_router
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4000
+# Moderate emoji: the ones opening a line are always kept, inline ones
+# only up to one per this many characters (and at least MIN_INLINE_EMOJI)
+EMOJI_CHARS_PER_INLINE = 250
+MIN_INLINE_EMOJI = 2
+# A post with fewer Cyrillic letters than this share is in the wrong language
+MIN_CYRILLIC_SHARE = 0.5
+MIN_LETTERS_TO_CHECK = 40
+
+_EMOJI_BASE = (
+    '\U0001F300-\U0001F5FF\U0001F600-\U0001F64F\U0001F680-\U0001F6FF\U0001F900-\U0001F9FF'
+    '\U0001FA70-\U0001FAFF\u2600-\u26FF\u2700-\u27BF\u2B05-\u2B07\u2B50\u2B55\u2934\u2935'
+    '\u231A\u231B\u23E9-\u23FA\u203C\u2049\u2139\u24C2\u25AA\u25AB\u25B6\u25C0\u25FB-\u25FE'
+)
+_EMOJI_ONE = f'[{_EMOJI_BASE}]\uFE0F?[\U0001F3FB-\U0001F3FF]?'
+# One visible emoji: a flag, or a base with optional variation selector,
+# skin tone and zero-width-joiner sequence
+EMOJI = re.compile(f'(?:[\U0001F1E6-\U0001F1FF]{{2}}|{_EMOJI_ONE}(?:\u200D{_EMOJI_ONE})*)')
+EMOJI_RUN = re.compile(f'({EMOJI.pattern})(?:[ \t]*{EMOJI.pattern})+')
+
+BOLD = re.compile(r'\*\*(.+?)\*\*', re.DOTALL)
+BULLET = re.compile(r'^([ \t]*)\*[ \t]+', re.MULTILINE)
+TIMES = re.compile(r'(?<=\d) ?\* ?(?=\d)')
+HEADER = re.compile(r'^[ \t]*#{1,6}[ \t]+', re.MULTILINE)
+# #слово is a hashtag, "День #3" is not
+HASHTAG = re.compile(r'(?<![\w&#/])#(?=[^\W\d_])(\w+)')
+HASHTAG_LINE = re.compile(r'^[ \t]*(?:#[^\W\d_]\w*[ \t,]*)+$\n?', re.MULTILINE)
+INVISIBLE = re.compile('[\u200B\u200C\u2060\uFEFF]')
+
+def _fix_markdown(text: str, violations: Dict[str, int]) -> str:
+    asterisks = text.count('*')
+    if asterisks:
+        violations['asterisks'] = asterisks
+        text = BOLD.sub(r'\1', text)
+        text = BULLET.sub(r'\1• ', text)
+        text = TIMES.sub(' × ', text)
+        text = text.replace('*', '')
+    headers = len(HEADER.findall(text))
+    if headers:
+        violations['headers'] = headers
+        text = HEADER.sub('', text)
+    hashtags = len(HASHTAG.findall(text))
+    if hashtags:
+        violations['hashtags'] = hashtags
+        # A closing line of tags goes away, a tag inside a sentence stays as a word
+        text = HASHTAG_LINE.sub('', text)
+        text = HASHTAG.sub(r'\1', text)
+    return text
+
+def _fix_emoji(text: str, violations: Dict[str, int]) -> str:
+    runs = len(EMOJI_RUN.findall(text))
+    if runs:
+        violations['emoji_runs'] = runs
+        text = EMOJI_RUN.sub(r'\1', text)
+
+    allowed = max(MIN_INLINE_EMOJI, len(text) // EMOJI_CHARS_PER_INLINE)
+    lines, seen, dropped = [], 0, 0
+    for line in text.split('\n'):
+        leading = EMOJI.match(line.lstrip())
+        start = len(line) - len(line.lstrip()) + (leading.end() if leading else 0)
+        rest = []
+        for piece in re.split(f'({EMOJI.pattern})', line[start:]):
+            if EMOJI.fullmatch(piece):
+                seen += 1
+                if seen > allowed:
+                    dropped += 1
+                    continue
+            rest.append(piece)
+        lines.append(line[:start] + ''.join(rest))
+    if dropped:
+        violations['emoji_excess'] = dropped
+        text = '\n'.join(lines)
+    return text
+
+def _fix_whitespace(text: str, violations: Dict[str, int]) -> str:
+    fixed = INVISIBLE.sub('', text).replace('\r\n', '\n').replace('\t', ' ').replace('\u00A0', ' ')
+    fixed = '\n'.join(re.sub(r' {2,}', ' ', line).strip() for line in fixed.split('\n'))
+    fixed = re.sub(r'\n{3,}', '\n\n', fixed).strip()
+    if fixed != text.strip():
+        violations['whitespace'] = 1
+    return fixed
+
+def clean_text(text: str, emoji: bool = True) -> Tuple[str, Dict[str, int]]:
+    """`text` with the prompt rules enforced, and the number of fixes per rule.
+
+    Plans keep their emoji (their markers are emoji), so they pass emoji=False.
+    """
+    violations: Dict[str, int] = {}
+    text = _fix_markdown(text, violations)
+    if emoji:
+        text = _fix_emoji(text, violations)
+    text = _fix_whitespace(text, violations)
+    return text, violations
+
+def unfixable(text: str) -> Optional[str]:
+    """The rule `text` breaks that clean_text can't fix, if any."""
+    letters = [char for char in text if char.isalpha()]
+    if len(letters) < MIN_LETTERS_TO_CHECK:
+        return None
+    cyrillic = sum(1 for char in letters if 'а' <= char.lower() <= 'я' or char in 'ёЁ')
+    if cyrillic / len(letters) < MIN_CYRILLIC_SHARE:
+        return 'language'
+    return None
+
+def build_fix_prompt(text: str) -> str:
+    return f"""
+        Перепиши текст поста ниже на русском языке.
+        Сохрани смысл, структуру и абзацы, умеренно используй эмодзи.
+        Не используй символы * и хештеги.
+        Ответ только текстом поста, без вступления и пояснений.
+
+        Текст:
+        {text}
+        """
+
+def _count(violations: Dict[str, int], problem: Optional[str]) -> None:
+    metrics.incr('postprocess.texts')
+    if violations or problem:
+        metrics.incr('postprocess.fixed_texts')
+    for rule, count in violations.items():
+        metrics.incr(f'postprocess.{rule}', count)
+    if problem:
+        metrics.incr(f'postprocess.unfixable.{problem}')
+
+def finalize(text: str, kind: str = 'post') -> str:
+    """The generated `text` cleaned up; a post nothing local can fix is rewritten once."""
+    cleaned, violations = clean_text(text, emoji=kind != 'plan')
+    problem = unfixable(cleaned) if kind != 'plan' else None
+    _count(violations, problem)
+    if not problem:
+        return cleaned
+    logger.info(f"Generated {kind} breaks '{problem}', asking for a fix")
+    try:
+        fixed = get_router().complete('validation', build_fix_prompt(cleaned)).text.strip()
+        metrics.incr('postprocess.llm_fixes')
+        return clean_text(fixed)[0] or cleaned
+    except Exception as e:
+        logger.error(f"Fixing generated {kind} failed, keeping it as is: {e}")
+        return cleaned
+
+async def afinalize(text: str, kind: str = 'post') -> str:
+    """Async version of finalize."""
+    cleaned, violations = clean_text(text, emoji=kind != 'plan')
+    problem = unfixable(cleaned) if kind != 'plan' else None
+    _count(violations, problem)
+    if not problem:
+        return cleaned
+    logger.info(f"Generated {kind} breaks '{problem}', asking for a fix")
+    try:
+        completion = await get_router().acomplete('validation', build_fix_prompt(cleaned))
+        metrics.incr('postprocess.llm_fixes')
+        return clean_text(completion.text.strip())[0] or cleaned
+    except Exception as e:
+        logger.error(f"Fixing generated {kind} failed, keeping it as is: {e}")
+        return cleaned
+
+def _pieces(text: str, separator: str) -> List[str]:
+    """Cut `text` at `separator`, keeping the separator with the piece before it."""
+    parts = text.split(separator)
+    return [part + separator for part in parts[:-1]] + [parts[-1]]
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """`text` in parts under `limit`, cut between paragraphs, else lines, else sentences."""
+    text = text.strip()
+    if len(text) <= limit:
+        return [text] if text else []
+    for separator in ('\n\n', '\n', '. ', ' '):
+        pieces = _pieces(text, separator)
+        if len(pieces) > 1:
+            break
+    else:
+        # One endless word
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    parts, current = [], ''
+    for piece in pieces:
+        if len(current) + len(piece) <= limit:
+            current += piece
+            continue
+        if current.strip():
+            parts.append(current.strip())
+        current = piece
+        if len(piece) > limit:
+            # A paragraph over the limit: cut it at a finer boundary
+            *done, current = split_message(piece, limit)
+            parts.extend(done)
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+def to_html(text: str) -> str:
+    """`text` safe to send with parse_mode=HTML."""
+    return html.escape(text, quote=False)
+
+def html_parts(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """HTML-escaped parts of `text`, split before escaping so entities are never cut."""
+    return [to_html(part) for part in split_message(text, limit)]
+
+if __name__ == '__main__':
+    import json
+    import argparse
+    from collections import Counter
+    from recorder import read_events
+    parser = argparse.ArgumentParser(description="Rule violations in the completions of a traffic recording")
+    parser.add_argument('path', help="recording made with RECORD_TRAFFIC (see recorder.py)")
+    args = parser.parse_args()
+
+    report = Counter()
+    for event in read_events(args.path):
+        if event['type'] != 'completion':
+            continue
+        kind = 'plan' if '🔢 День #' in event['text'] else 'post'
+        cleaned, violations = clean_text(event['text'], emoji=kind != 'plan')
+        report['texts'] += 1
+        report['texts_fixed'] += bool(violations)
+        report.update(violations)
+        if kind != 'plan' and unfixable(cleaned):
+            report[f'unfixable.{unfixable(cleaned)}'] += 1
+    print(json.dumps(dict(report), indent=2, ensure_ascii=False))
@@ -0,0 +1,242 @@
+"""On-demand profiling of the conversation callbacks.
+
+Every callback of the conversation handler is wrapped once at startup. While
+no profiling window is open the wrapper costs one comparison per update.
+During a window (`/profile 60` from an admin, or PROFILE_SECONDS=60 at
+startup) a sample of updates (PROFILE_SAMPLE_RATE) is run under cProfile and
+a background thread samples the stacks of threads busy in a callback. When
+the window closes, PROFILE_DIR/<timestamp>-<pid>/ gets:
+
+    <handler>.<STATE>.pstats   cProfile stats per callback and state
+    all.pstats                 everything merged (snakeviz, gprof2dot)
+    stacks.collapsed           sampled stacks, input for flamegraph.pl/speedscope
+    summary.txt                wall time per callback and the top functions
+"""
+import io
+import os
+import sys
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from telegram import Update
+from telegram.ext import CallbackContext, CommandHandler, ConversationHandler, Dispatcher
+from utils import is_admin
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# Open a window of this many seconds at startup (0: only via /profile)
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '0'))
+# Share of updates run under cProfile during a window
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '1.0'))
+# Stack sampling period of the background sampler
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5')) / 1000
+MAX_PROFILE_SECONDS = 3600
+DEFAULT_PROFILE_SECONDS = 60
+TOP_FUNCTIONS = 25
+
+class Profiler:
+    """Per-callback cProfile stats and sampled stacks for a time window."""
+
+    def __init__(self, out_dir: str = PROFILE_DIR, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 sample_interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+        self.sample_interval = sample_interval
+        # monotonic end of the open window, 0.0 while disabled
+        self.deadline = 0.0
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._wall: Dict[str, List[float]] = {}
+        self._stacks: Counter = Counter()
+        # thread id -> label of the callback it's running
+        self._running: Dict[int, str] = {}
+        self._started_at = time.time()
+
+    @property
+    def active(self) -> bool:
+        return self.deadline > time.monotonic()
+
+    def start(self, seconds: float) -> None:
+        """Open (or restart) a window of `seconds`, closed by a timer."""
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            running = self.active
+            if not running:
+                self._reset()
+            self.deadline = time.monotonic() + seconds
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        if not running:
+            threading.Thread(target=self._sample_stacks, name='profiler-sampler', daemon=True).start()
+        logger.info(f"Profiling enabled for {seconds:.0f}s, sample rate {self.sample_rate}")
+
+    def stop(self) -> Optional[str]:
+        """Close the window and write the report. Returns its directory."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if not self.deadline:
+                return None
+            self.deadline = 0.0
+            stats, wall, stacks = self._stats, self._wall, self._stacks
+            started_at = self._started_at
+            self._reset()
+        path = self._dump(stats, wall, stacks, started_at)
+        logger.info(f"Profiling disabled, report written to {path}")
+        return path
+
+    def wrap(self, callback: Callable, label: str) -> Callable:
+        """Wrap a handler callback so it's profiled while a window is open."""
+        def profiled(update: Update, context: CallbackContext):
+            if self.deadline <= time.monotonic():
+                return callback(update, context)
+            return self._profile_call(callback, label, update, context)
+
+        profiled.__name__ = callback.__name__
+        profiled.__wrapped__ = callback
+        return profiled
+
+    def _profile_call(self, callback: Callable, label: str, update: Update, context: CallbackContext):
+        thread_id = threading.get_ident()
+        self._running[thread_id] = label
+        profile = None
+        if random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler owns this interpreter (3.12+ allows just one)
+                profile = None
+        started = time.perf_counter()
+        try:
+            return callback(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile:
+                profile.disable()
+            self._running.pop(thread_id, None)
+            self._record(label, elapsed, profile)
+
+    def _record(self, label: str, elapsed: float, profile: Optional[cProfile.Profile]) -> None:
+        with self._lock:
+            if not self.deadline:
+                return
+            self._wall.setdefault(label, []).append(elapsed)
+            if profile is None:
+                return
+            if label in self._stats:
+                self._stats[label].add(profile)
+            else:
+                self._stats[label] = pstats.Stats(profile)
+        metrics.incr('profiling.profiled_calls')
+
+    def _sample_stacks(self) -> None:
+        """Collapse the stacks of busy callback threads every sample_interval."""
+        own_id = threading.get_ident()
+        while self.active:
+            frames = sys._current_frames()
+            for thread_id, label in list(self._running.items()):
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(label)
+                with self._lock:
+                    self._stacks[';'.join(reversed(stack))] += 1
+            del frames
+            time.sleep(self.sample_interval)
+
+    def _dump(self, stats: Dict[str, pstats.Stats], wall: Dict[str, List[float]],
+              stacks: Counter, started_at: float) -> str:
+        path = os.path.join(
+            self.out_dir, f"{datetime.fromtimestamp(started_at):%Y%m%d-%H%M%S}-{os.getpid()}"
+        )
+        os.makedirs(path, exist_ok=True)
+
+        merged = pstats.Stats() if stats else None
+        for label, label_stats in stats.items():
+            label_stats.dump_stats(os.path.join(path, f"{label.replace(':', '.')}.pstats"))
+            merged.add(label_stats)
+        if merged:
+            merged.dump_stats(os.path.join(path, 'all.pstats'))
+
+        with open(os.path.join(path, 'stacks.collapsed'), 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(os.path.join(path, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(format_summary(wall, merged))
+        return path
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+def format_summary(wall: Dict[str, List[float]], merged: Optional[pstats.Stats]) -> str:
+    """Wall time per callback:state, then the top functions by cumulative time."""
+    lines = [f"{'callback:state':<40} {'calls':>6} {'total s':>9} {'mean ms':>9} {'p95 ms':>9}"]
+    for label, values in sorted(wall.items(), key=lambda item: -sum(item[1])):
+        lines.append(
+            f"{label:<40} {len(values):>6} {sum(values):>9.3f} "
+            f"{sum(values) / len(values) * 1000:>9.1f} {_percentile(values, 95) * 1000:>9.1f}"
+        )
+    if merged:
+        out = io.StringIO()
+        merged.stream = out
+        merged.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        lines += ['', out.getvalue()]
+    return '\n'.join(lines) + '\n'
+
+profiler = Profiler()
+
+def instrument(conversation: ConversationHandler, state_names: Dict[Any, str]) -> ConversationHandler:
+    """Route every callback of the conversation through the profiler."""
+    groups = [('entry', conversation.entry_points), ('fallback', conversation.fallbacks)]
+    groups += [(state_names.get(state, str(state)), handlers) for state, handlers in conversation.states.items()]
+    for name, handlers in groups:
+        for handler in handlers:
+            handler.callback = profiler.wrap(handler.callback, f"{handler.callback.__name__}:{name}")
+    return conversation
+
+def profile_command(update: Update, context: CallbackContext) -> None:
+    """/profile [seconds|stop] - admins only, silently ignored for everyone else."""
+    if not is_admin(update.effective_user.id):
+        return
+    arg = context.args[0] if context.args else str(DEFAULT_PROFILE_SECONDS)
+    if arg == 'stop':
+        path = profiler.stop()
+        update.message.reply_text(f"📊 Отчёт профилирования: {path}" if path else "Профилирование не запущено.")
+        return
+    if not arg.isdigit() or not 0 < int(arg) <= MAX_PROFILE_SECONDS:
+        update.message.reply_text(f"Использование: /profile <секунды 1-{MAX_PROFILE_SECONDS}> или /profile stop")
+        return
+    profiler.start(int(arg))
+    update.message.reply_text(
+        f"🔬 Профилирование включено на {arg} с. Отчёт будет записан в {profiler.out_dir}/"
+    )
+
+def install_profiling(dispatcher: Dispatcher) -> None:
+    """Register /profile and open the startup window if PROFILE_SECONDS is set."""
+    dispatcher.add_handler(CommandHandler('profile', profile_command))
+    if PROFILE_SECONDS > 0:
+        profiler.start(PROFILE_SECONDS)
@@ -1,20 +1,75 @@
 import os
 import re
-from typing import Dict, Any
-from openai import OpenAI
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import logging
+from backends import get_router
+from budget import compact_profile, acompact_profile
+from postprocess import finalize, afinalize
+from similarity import repeated_days
+import metrics
 
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-# do not change this unless explicitly requested by the user
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def generate_product_repackaging(user_data: Dict[str, Any]) -> str:
-    """Generate product repackaging content using GPT-4."""
+# Called with (prompt, answer, seconds) after every completion, e.g. by recorder.py
+completion_hooks: List[Callable[[str, str, float], None]] = []
+
+def _notify_completion(prompt: str, text: str, started: float) -> str:
+    seconds = time.monotonic() - started
+    for hook in completion_hooks:
+        try:
+            hook(prompt, text, seconds)
+        except Exception as e:
+            logger.error(f"Completion hook failed: {e}")
+    return text
+
+# Gets (task, piece of text) while a generation in streaming() is answered
+_on_token: contextvars.ContextVar[Optional[Callable[[str, str], None]]] = contextvars.ContextVar(
+    'on_token', default=None
+)
+
+@contextmanager
+def streaming(on_token: Callable[[str, str], None]):
+    """Stream the answers of the generations run inside to on_token(task, text), e.g. for api.py.
+
+    Plans of several chunks stream them at once, interleaved; the text a
+    generate_* function returns is the result, the pieces are a preview.
+    """
+    token = _on_token.set(on_token)
     try:
-        prompt = f"""
+        yield
+    finally:
+        _on_token.reset(token)
+
+def _token_callback(task: str) -> Optional[Callable[[str], None]]:
+    on_token = _on_token.get()
+    return (lambda text: on_token(task, text)) if on_token else None
+
+def _complete(prompt: str, task: str) -> str:
+    """Generate `prompt` on the task's route (see backends.py) and return the stripped text."""
+    started = time.monotonic()
+    completion = get_router().complete(task, prompt, _token_callback(task))
+    return _notify_completion(prompt, completion.text.strip(), started)
+
+async def _acomplete(prompt: str, task: str) -> str:
+    """Async counterpart of _complete."""
+    started = time.monotonic()
+    completion = await get_router().acomplete(task, prompt, _token_callback(task))
+    return _notify_completion(prompt, completion.text.strip(), started)
+
+def _map_in_threads(fn: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+    """fn over items, a thread each, run in copies of the caller's context (tenant, streaming)."""
+    with ThreadPoolExecutor(len(items)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+def build_repackaging_prompt(user_data: Dict[str, Any]) -> str:
+    """Build the product repackaging prompt."""
+    return f"""
         Ты эксперт по маркетингу. На основе следующих данных:
         Аудитория: {user_data.get('audience', '')}
         Инструмент: {user_data.get('tool', '')}
@@ -37,23 +92,115 @@ def generate_product_repackaging(user_data: Dict[str, Any]) -> str:
         - 🚀 Ценность (результат результата):
         """
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-
-        return response.choices[0].message.content.strip()
-
+def generate_product_repackaging(user_data: Dict[str, Any]) -> str:
+    """Generate product repackaging content using GPT-4."""
+    try:
+        text = _complete(build_repackaging_prompt(compact_profile(user_data)), 'repackaging')
+        return finalize(text, 'repackaging')
     except Exception as e:
         logger.error(f"Error generating product repackaging: {e}")
         raise
 
-def generate_content_plan(user_data: Dict[str, Any]) -> str:
-    """Generate a 14-day content plan using GPT-4."""
+async def agenerate_product_repackaging(user_data: Dict[str, Any]) -> str:
+    """Async version of generate_product_repackaging."""
     try:
-        prompt = f"""
-        Создай контент-план на 14 дней для Telegram канала, строго учитывая следующие детали:
+        text = await _acomplete(build_repackaging_prompt(await acompact_profile(user_data)), 'repackaging')
+        return await afinalize(text, 'repackaging')
+    except Exception as e:
+        logger.error(f"Error generating product repackaging: {e}")
+        raise
+
+DEFAULT_PLAN_DAYS = 14
+# Horizons offered in the bot; any length between MIN and MAX works elsewhere
+PLAN_HORIZONS = (7, 14, 30, 90)
+MIN_PLAN_DAYS = 4
+MAX_PLAN_DAYS = 90
+# Longer plans are generated as parallel chunks of at most this many days
+PLAN_CHUNK_DAYS = int(os.getenv('PLAN_CHUNK_DAYS', '14'))
+
+# Warm-up phases in order, weighted by their length in the original 14-day plan
+PLAN_PHASES = [
+    ('problems', 5, 'Рассказ о проблемах и болях аудитории, без упоминания продукта'),
+    ('solutions', 4, 'Обсуждение возможных решений проблем, общие советы'),
+    ('expertise', 2, 'Ваш экспертный опыт и результаты'),
+    ('offer', 3, 'Мягкое представление вашего продукта/услуги как решения'),
+]
+
+PLAN_POST_PATTERN = re.compile(r'(🔢 День #(\d+):[^\n]*(?:\n(?!🔢 День #)[^\n]*)*)', re.MULTILINE)
+
+def get_plan_days(user_data: Dict[str, Any], days: Optional[int] = None) -> int:
+    """Plan length to use: explicit value, the user's choice or the default."""
+    days = int(days or user_data.get('plan_days') or DEFAULT_PLAN_DAYS)
+    if not (MIN_PLAN_DAYS <= days <= MAX_PLAN_DAYS):
+        raise ValueError(f"Plan length must be between {MIN_PLAN_DAYS} and {MAX_PLAN_DAYS} days")
+    return days
+
+def plan_phases(days: int) -> Dict[str, Tuple[int, int]]:
+    """Scale the warm-up phases to `days`, returning {phase: (first_day, last_day)}.
+
+    Lengths are proportional to PLAN_PHASES weights (largest remainder
+    rounding, at least one day each), so 14 days gives 1-5, 6-9, 10-11, 12-14.
+    """
+    total = sum(weight for _, weight, _ in PLAN_PHASES)
+    shares = [days * weight / total for _, weight, _ in PLAN_PHASES]
+    lengths = [max(1, int(share)) for share in shares]
+    while sum(lengths) < days:
+        index = max(range(len(shares)), key=lambda i: shares[i] - lengths[i])
+        lengths[index] += 1
+
+    phases = {}
+    first_day = 1
+    for (name, _, _), length in zip(PLAN_PHASES, lengths):
+        phases[name] = (first_day, first_day + length - 1)
+        first_day += length
+    return phases
+
+def plan_chunks(days: int) -> List[Tuple[int, int]]:
+    """Day ranges generated by separate calls; short plans are a single chunk."""
+    if days <= PLAN_CHUNK_DAYS:
+        return [(1, days)]
+    chunks = []
+    for first_day, last_day in plan_phases(days).values():
+        length = last_day - first_day + 1
+        parts = -(-length // PLAN_CHUNK_DAYS)
+        for part in range(parts):
+            start = first_day + length * part // parts
+            end = first_day + length * (part + 1) // parts - 1
+            chunks.append((start, end))
+    return chunks
+
+def _day_span(days: Tuple[int, int]) -> str:
+    return f"{days[0]}-{days[1]}" if days[0] != days[1] else str(days[0])
+
+def _days_label(days: Tuple[int, int]) -> str:
+    return f"дни {days[0]}-{days[1]}" if days[0] != days[1] else f"день {days[0]}"
+
+def _plan_structure(days: int) -> str:
+    phases = plan_phases(days)
+    return "\n        ".join(
+        f"- {_days_label(phases[name]).capitalize()}: {description}"
+        for name, _, description in PLAN_PHASES
+    )
+
+def build_content_plan_prompt(user_data: Dict[str, Any], days: int = DEFAULT_PLAN_DAYS,
+                              chunk: Optional[Tuple[int, int]] = None) -> str:
+    """Build the content plan prompt for the whole plan or one chunk of days."""
+    start, end = chunk or (1, days)
+    count = end - start + 1
+    if chunk:
+        phases = plan_phases(days)
+        phase = next(
+            description for name, _, description in PLAN_PHASES
+            if phases[name][0] <= start <= phases[name][1]
+        )
+        task = (
+            f"\n        Сейчас составь только часть плана: дни {start}-{end} (этап: {phase}).\n"
+            f"        Остальные дни плана составляются отдельно.\n"
+        )
+    else:
+        task = ""
+    return f"""
+        Создай контент-план на {days} дней для Telegram канала, строго учитывая следующие детали:
         - Тема канала: {user_data.get('topic', '')}
         - Целевая аудитория: {user_data.get('audience', '')}
         - Дополнительные пожелания: {user_data.get('preferences', '')}
@@ -63,20 +210,17 @@ def generate_content_plan(user_data: Dict[str, Any]) -> str:
         - Детали продукта/услуги/курса: {user_data.get('product_details', '')}
 
         ВАЖНО: Структура прогрева аудитории:
-        - Дни 1-5: Рассказ о проблемах и болях аудитории, без упоминания продукта
-        - Дни 6-9: Обсуждение возможных решений проблем, общие советы
-        - Дни 10-11: Ваш экспертный опыт и результаты
-        - Дни 12-14: Мягкое представление вашего продукта/услуги как решения
-
-        Создай РОВНО 14 постов, пронумерованных от 1 до 14 последовательно.
+        {_plan_structure(days)}
+{task}
+        Создай РОВНО {count} постов, пронумерованных от {start} до {end} последовательно.
         Для каждого поста ОБЯЗАТЕЛЬНО укажи:
-        1. 🔢 День #[номер]: (от 1 до 14)
+        1. 🔢 День #[номер]: (от {start} до {end})
         2. 🎯 Цель: [engagement/продажи/информирование]
         3. 📢 Заголовок: [интригующий заголовок]
         4. 📝 Описание: [краткое описание темы поста в одном предложении]
 
         ВАЖНО:
-        - Строго соблюдай последовательную нумерацию от 1 до 14
+        - Строго соблюдай последовательную нумерацию от {start} до {end}
         - Каждый пост должен быть отделен пустой строкой
         - Используй эмодзи для лучшей читаемости
         - Ответ должен быть на русском языке
@@ -85,61 +229,316 @@ def generate_content_plan(user_data: Dict[str, Any]) -> str:
         - Начинай КАЖДЫЙ пост СТРОГО с "🔢 День #" и номера
         """
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
+def build_plan_repair_prompt(content_plan: str, start: int, end: int) -> str:
+    """Ask to fix the numbering and count of a malformed plan (or chunk)."""
+    return f"""
+        Исправь контент-план ниже. В нём должно быть РОВНО {end - start + 1} постов, пронумерованных от {start} до {end} последовательно.
+        Сохрани содержание существующих постов, добавь недостающие дни и убери лишние.
+        Каждый пост начинается СТРОГО с "🔢 День #" и номера и содержит строки
+        🎯 Цель:, 📢 Заголовок: и 📝 Описание:. Посты отделены пустой строкой.
+        НЕ добавляй никакого вступительного или заключительного текста.
+
+        Контент-план:
+        {content_plan}
+        """
 
-        content_plan = response.choices[0].message.content.strip()
+def _plan_is_valid(content_plan: str, start: int, end: int, renumbered: bool) -> bool:
+    numbers = [int(num) for _, num in PLAN_POST_PATTERN.findall(content_plan)]
+    if renumbered:
+        # merge_plan_chunks rewrites chunk numbers, only the count matters
+        return len(numbers) == end - start + 1
+    return sorted(numbers) == list(range(start, end + 1))
+
+def _plan_text(user_data: Dict[str, Any], days: int, chunk: Optional[Tuple[int, int]] = None) -> str:
+    """Generate a plan (or one chunk); a malformed answer gets one repair call."""
+    start, end = chunk or (1, days)
+    content_plan = _complete(build_content_plan_prompt(user_data, days, chunk), 'plan')
+    if _plan_is_valid(content_plan, start, end, renumbered=chunk is not None):
+        return content_plan
+    logger.warning(f"Plan days {start}-{end} came back malformed, asking for a repair")
+    return _complete(build_plan_repair_prompt(content_plan, start, end), 'repair')
+
+async def _aplan_text(user_data: Dict[str, Any], days: int, chunk: Optional[Tuple[int, int]] = None) -> str:
+    """Async version of _plan_text."""
+    start, end = chunk or (1, days)
+    content_plan = await _acomplete(build_content_plan_prompt(user_data, days, chunk), 'plan')
+    if _plan_is_valid(content_plan, start, end, renumbered=chunk is not None):
+        return content_plan
+    logger.warning(f"Plan days {start}-{end} came back malformed, asking for a repair")
+    return await _acomplete(build_plan_repair_prompt(content_plan, start, end), 'repair')
+
+def validate_content_plan(content_plan: str, days: int = DEFAULT_PLAN_DAYS) -> str:
+    """Clean the plan up (see postprocess.py), check it has exactly `days` sequential posts and return it."""
+    content_plan = finalize(content_plan, 'plan')
+    posts = re.findall(r'🔢 День #(\d+):[^\n]*(?:\n(?!🔢 День #)[^\n]*)*', content_plan, re.MULTILINE)
+    post_numbers = [int(num) for num in posts]
+    logger.info(f"Generated content plan. Found posts with numbers: {post_numbers}")
+
+    if len(post_numbers) != days or sorted(post_numbers) != list(range(1, days + 1)):
+        logger.error(f"Invalid content plan: Wrong number of posts or missing numbers. Found: {post_numbers}")
+        raise ValueError(f"Generated content plan does not contain exactly {days} sequential posts")
+
+    return content_plan
+
+def merge_plan_chunks(parts: List[str], chunks: List[Tuple[int, int]], days: int) -> str:
+    """Join chunk answers into one plan, numbering the days from the chunk ranges.
+
+    Each chunk must contain exactly as many posts as days it covers; their
+    numbers are rewritten, so a chunk answered as 1..n still lands in place.
+    """
+    entries = []
+    for text, (start, end) in zip(parts, chunks):
+        posts = [post.strip() for post, _ in PLAN_POST_PATTERN.findall(text)]
+        if len(posts) != end - start + 1:
+            logger.error(f"Plan chunk {start}-{end} returned {len(posts)} posts")
+            raise ValueError(f"Plan chunk {start}-{end} does not contain {end - start + 1} posts")
+        for day, post in enumerate(posts, start):
+            entries.append(re.sub(r'^🔢 День #\d+:', f'🔢 День #{day}:', post))
+    return validate_content_plan("\n\n".join(entries), days)
+
+def _plan_repeats(content_plan: str) -> Dict[int, int]:
+    """Near-duplicate days of a fresh plan (see similarity.py), counted in metrics."""
+    repeats = repeated_days(plan_entries(content_plan))
+    metrics.incr('similarity.plans_checked')
+    if repeats:
+        metrics.incr('similarity.repeated_days', len(repeats))
+        logger.info(f"Plan days {sorted(repeats)} repeat days {[repeats[day] for day in sorted(repeats)]}")
+    return repeats
+
+def _without_repeats(user_data: Dict[str, Any], days: int, content_plan: str) -> str:
+    """The plan with its near-duplicate days regenerated once, or as is if that fails."""
+    repeats = _plan_repeats(content_plan)
+    if not repeats:
+        return content_plan
+    try:
+        return regenerate_plan_days(
+            dict(user_data, content_plan=content_plan, plan_days=days), sorted(repeats), repeats
+        )
+    except Exception as e:
+        logger.error(f"Regenerating repeated plan days failed, keeping them: {e}")
+        return content_plan
 
-        # Verify the content plan format
-        posts = re.findall(r'🔢 День #(\d+):[^\n]*(?:\n(?!🔢 День #)[^\n]*)*', content_plan, re.MULTILINE)
-        post_numbers = [int(num) for num in posts]
-        logger.info(f"Generated content plan. Found posts with numbers: {post_numbers}")
+async def _awithout_repeats(user_data: Dict[str, Any], days: int, content_plan: str) -> str:
+    """Async version of _without_repeats."""
+    repeats = _plan_repeats(content_plan)
+    if not repeats:
+        return content_plan
+    try:
+        return await aregenerate_plan_days(
+            dict(user_data, content_plan=content_plan, plan_days=days), sorted(repeats), repeats
+        )
+    except Exception as e:
+        logger.error(f"Regenerating repeated plan days failed, keeping them: {e}")
+        return content_plan
 
-        if len(post_numbers) != 14 or sorted(post_numbers) != list(range(1, 15)):
-            logger.error(f"Invalid content plan: Wrong number of posts or missing numbers. Found: {post_numbers}")
-            raise ValueError("Generated content plan does not contain exactly 14 sequential posts")
+def generate_content_plan(user_data: Dict[str, Any], days: Optional[int] = None) -> str:
+    """Generate a content plan using GPT-4, long plans as parallel chunks.
 
-        return content_plan
+    Days that nearly repeat an earlier day are regenerated once.
+    """
+    try:
+        days = get_plan_days(user_data, days)
+        user_data = compact_profile(user_data)
+        chunks = plan_chunks(days)
+        if len(chunks) == 1:
+            content_plan = validate_content_plan(_plan_text(user_data, days), days)
+        else:
+            logger.info(f"Generating {days}-day content plan in {len(chunks)} chunks")
+            parts = _map_in_threads(lambda chunk: _plan_text(user_data, days, chunk), chunks)
+            content_plan = merge_plan_chunks(parts, chunks, days)
+        return _without_repeats(user_data, days, content_plan)
+    except Exception as e:
+        logger.error(f"Error generating content plan: {e}")
+        raise
 
+async def agenerate_content_plan(user_data: Dict[str, Any], days: Optional[int] = None) -> str:
+    """Async version of generate_content_plan."""
+    try:
+        days = get_plan_days(user_data, days)
+        user_data = await acompact_profile(user_data)
+        chunks = plan_chunks(days)
+        if len(chunks) == 1:
+            content_plan = validate_content_plan(await _aplan_text(user_data, days), days)
+        else:
+            logger.info(f"Generating {days}-day content plan in {len(chunks)} chunks")
+            parts = await asyncio.gather(*(_aplan_text(user_data, days, chunk) for chunk in chunks))
+            content_plan = merge_plan_chunks(list(parts), chunks, days)
+        return await _awithout_repeats(user_data, days, content_plan)
     except Exception as e:
         logger.error(f"Error generating content plan: {e}")
         raise
 
-def generate_post(user_data: Dict[str, Any], post_number: int) -> str:
-    """Generate a single post using GPT-4."""
+def plan_entries(content_plan: str) -> Dict[int, str]:
+    """Plan entries by day number."""
+    return {int(num): post.strip() for post, num in PLAN_POST_PATTERN.findall(content_plan or '')}
+
+def plan_headline(entry: str) -> str:
+    title = re.search(r'📢 Заголовок:\s*(.+)', entry)
+    return title.group(1).strip() if title else entry.splitlines()[0]
+
+def build_plan_days_prompt(user_data: Dict[str, Any], days: int, selected: List[int],
+                           kept: Dict[int, str], repeats: Optional[Dict[int, int]] = None) -> str:
+    """Build the prompt for new entries of `selected` days that fit the kept ones.
+
+    `repeats` maps days whose old entry repeated another day to that day.
+    """
+    phases = plan_phases(days)
+    targets = "\n        ".join(
+        f"- День #{day}: " + next(
+            description for name, _, description in PLAN_PHASES
+            if phases[name][0] <= day <= phases[name][1]
+        )
+        for day in selected
+    )
+    other_days = "\n        ".join(f"- День #{day}: {plan_headline(entry)}" for day, entry in sorted(kept.items()))
+    repeated = ""
+    lines = "\n        ".join(
+        f"- День #{day} повторял День #{other}: «{plan_headline(kept[other])}»"
+        for day, other in sorted((repeats or {}).items()) if day in selected and other in kept
+    )
+    if lines:
+        repeated = (
+            f"\n        Прежние версии этих дней почти повторяли другие дни плана:\n        {lines}\n"
+            "        Придумай для них темы, заметно отличающиеся от всех остальных дней.\n"
+        )
+    return f"""
+        Перепиши отдельные дни контент-плана на {days} дней для Telegram канала, строго учитывая следующие детали:
+        - Тема канала: {user_data.get('topic', '')}
+        - Целевая аудитория: {user_data.get('audience', '')}
+        - Дополнительные пожелания: {user_data.get('preferences', '')}
+        - Желаемые эмоции аудитории: {user_data.get('emotions', '')}
+        - Стиль написания: {user_data.get('style', '')}
+        - Метод монетизации: {user_data.get('monetization', '')}
+        - Детали продукта/услуги/курса: {user_data.get('product_details', '')}
+
+        Остальные дни плана остаются без изменений, не повторяй их темы:
+        {other_days or '- нет'}
+{repeated}
+        Составь новые посты ТОЛЬКО для этих дней (указан этап прогрева):
+        {targets}
+
+        Создай РОВНО {len(selected)} постов с номерами {', '.join(map(str, selected))}.
+        Для каждого поста ОБЯЗАТЕЛЬНО укажи:
+        1. 🔢 День #[номер]:
+        2. 🎯 Цель: [engagement/продажи/информирование]
+        3. 📢 Заголовок: [интригующий заголовок]
+        4. 📝 Описание: [краткое описание темы поста в одном предложении]
+
+        ВАЖНО:
+        - Каждый пост должен быть отделен пустой строкой
+        - Используй эмодзи для лучшей читаемости
+        - Ответ должен быть на русском языке
+        - НЕ добавляй никакого вступительного или заключительного текста
+        - Начинай КАЖДЫЙ пост СТРОГО с "🔢 День #" и номера
+        """
+
+def _renumbered(text: str, selected: List[int]) -> Optional[List[str]]:
+    posts = [post.strip() for post, _ in PLAN_POST_PATTERN.findall(text)]
+    if len(posts) != len(selected):
+        return None
+    return [re.sub(r'^🔢 День #\d+:', f'🔢 День #{day}:', post) for day, post in zip(selected, posts)]
+
+def _day_entries(user_data: Dict[str, Any], days: int, selected: List[int], kept: Dict[int, str],
+                repeats: Optional[Dict[int, int]] = None) -> List[str]:
+    """New entries for `selected` days; a malformed answer gets one repair call."""
+    text = _complete(build_plan_days_prompt(user_data, days, selected, kept, repeats), 'plan')
+    entries = _renumbered(text, selected)
+    if entries is None:
+        logger.warning(f"Plan days {selected} came back malformed, asking for a repair")
+        entries = _renumbered(_complete(build_plan_repair_prompt(text, 1, len(selected)), 'repair'), selected)
+    if entries is None:
+        raise ValueError(f"Regenerated plan days {selected} do not contain {len(selected)} posts")
+    return entries
+
+async def _aday_entries(user_data: Dict[str, Any], days: int, selected: List[int],
+                        kept: Dict[int, str], repeats: Optional[Dict[int, int]] = None) -> List[str]:
+    """Async version of _day_entries."""
+    text = await _acomplete(build_plan_days_prompt(user_data, days, selected, kept, repeats), 'plan')
+    entries = _renumbered(text, selected)
+    if entries is None:
+        logger.warning(f"Plan days {selected} came back malformed, asking for a repair")
+        entries = _renumbered(await _acomplete(build_plan_repair_prompt(text, 1, len(selected)), 'repair'), selected)
+    if entries is None:
+        raise ValueError(f"Regenerated plan days {selected} do not contain {len(selected)} posts")
+    return entries
+
+def _day_groups(selected: List[int]) -> List[List[int]]:
+    selected = sorted(set(selected))
+    return [selected[i:i + PLAN_CHUNK_DAYS] for i in range(0, len(selected), PLAN_CHUNK_DAYS)]
+
+def _replace_days(content_plan: str, groups: List[List[int]], parts: List[List[str]], days: int) -> str:
+    entries = plan_entries(content_plan)
+    for group, part in zip(groups, parts):
+        entries.update(zip(group, part))
+    return validate_content_plan("\n\n".join(entries[day] for day in sorted(entries)), days)
+
+def regenerate_plan_days(user_data: Dict[str, Any], selected: List[int],
+                         repeats: Optional[Dict[int, int]] = None) -> str:
+    """Regenerate only the `selected` days of user_data['content_plan'], the rest stays as is.
+
+    With `repeats` (see similarity.repeated_days) the model is told which
+    day each old entry repeated.
+    """
     try:
-        if not post_number or not (1 <= post_number <= 14):
-            logger.error(f"Invalid post number: {post_number}")
-            raise ValueError("Invalid post number")
-
-        content_plan = user_data.get('content_plan', '')
-        if not content_plan:
-            logger.error("Content plan not found in user data")
-            raise ValueError("Content plan not found")
-
-        # Extract posts using regex
-        logger.info(f"Extracting post #{post_number} from content plan")
-        posts = re.findall(r'(🔢 День #(\d+):[^\n]*(?:\n(?!🔢 День #)[^\n]*)*)', content_plan, re.MULTILINE)
-        logger.info(f"Found {len(posts)} posts in content plan")
-
-        # Find the target post
-        target_post = None
-        for post_content, post_num in posts:
-            if int(post_num) == post_number:
-                target_post = post_content.strip()
-                break
-
-        if not target_post:
-            logger.error(f"Post #{post_number} not found in content plan")
-            logger.debug(f"Available posts: {[int(num) for _, num in posts]}")
-            raise ValueError(f"Post #{post_number} not found in content plan")
-
-        logger.info(f"Found post #{post_number} in content plan")
-
-        prompt = f"""
+        days = get_plan_days(user_data)
+        content_plan = user_data['content_plan']
+        groups = _day_groups(selected)
+        kept = {day: entry for day, entry in plan_entries(content_plan).items() if day not in selected}
+        profile = compact_profile(user_data)
+        logger.info(f"Regenerating days {selected} of a {days}-day content plan")
+        parts = _map_in_threads(lambda group: _day_entries(profile, days, group, kept, repeats), groups)
+        return _replace_days(content_plan, groups, parts, days)
+    except Exception as e:
+        logger.error(f"Error regenerating content plan days: {e}")
+        raise
+
+async def aregenerate_plan_days(user_data: Dict[str, Any], selected: List[int],
+                                repeats: Optional[Dict[int, int]] = None) -> str:
+    """Async version of regenerate_plan_days."""
+    try:
+        days = get_plan_days(user_data)
+        content_plan = user_data['content_plan']
+        groups = _day_groups(selected)
+        kept = {day: entry for day, entry in plan_entries(content_plan).items() if day not in selected}
+        profile = await acompact_profile(user_data)
+        logger.info(f"Regenerating days {selected} of a {days}-day content plan")
+        parts = await asyncio.gather(*(_aday_entries(profile, days, group, kept, repeats) for group in groups))
+        return _replace_days(content_plan, groups, list(parts), days)
+    except Exception as e:
+        logger.error(f"Error regenerating content plan days: {e}")
+        raise
+
+def extract_plan_post(content_plan: str, post_number: int, days: int = DEFAULT_PLAN_DAYS) -> str:
+    """Return the plan entry for one day."""
+    if not post_number or not (1 <= post_number <= days):
+        logger.error(f"Invalid post number: {post_number}")
+        raise ValueError("Invalid post number")
+
+    if not content_plan:
+        logger.error("Content plan not found in user data")
+        raise ValueError("Content plan not found")
+
+    # Extract posts using regex
+    logger.info(f"Extracting post #{post_number} from content plan")
+    posts = PLAN_POST_PATTERN.findall(content_plan)
+    logger.info(f"Found {len(posts)} posts in content plan")
+
+    # Find the target post
+    for post_content, post_num in posts:
+        if int(post_num) == post_number:
+            logger.info(f"Found post #{post_number} in content plan")
+            return post_content.strip()
+
+    logger.error(f"Post #{post_number} not found in content plan")
+    logger.debug(f"Available posts: {[int(num) for _, num in posts]}")
+    raise ValueError(f"Post #{post_number} not found in content plan")
+
+def build_post_prompt(user_data: Dict[str, Any], post_number: int) -> str:
+    """Build the prompt for the full text of one plan day."""
+    days = get_plan_days(user_data)
+    phases = plan_phases(days)
+    target_post = extract_plan_post(user_data.get('content_plan', ''), post_number, days)
+    return f"""
         Создай полный пост для Telegram канала на основе следующей информации:
         - Тема канала: {user_data.get('topic', '')}
         - Целевая аудитория: {user_data.get('audience', '')}
@@ -159,26 +558,35 @@ def generate_post(user_data: Dict[str, Any], post_number: int) -> str:
         - Использовать реальные примеры, истории и кейсы
         - Умеренное использование эмодзи
         - НЕ использовать символы * и хештеги
-        - Если это пост о продукте (дни 12-14), делать мягкое предложение
-        - В первые дни (1-5) фокус на проблемах аудитории
-        - В середине (6-9) обсуждать возможные решения
-        - В дни 10-11 делиться экспертным опытом
-        - Только в последние дни (12-14) предлагать продукт как решение
+        - Если это пост о продукте ({_days_label(phases['offer'])}), делать мягкое предложение
+        - В первые дни ({_day_span(phases['problems'])}) фокус на проблемах аудитории
+        - В середине ({_day_span(phases['solutions'])}) обсуждать возможные решения
+        - В {_days_label(phases['expertise'])} делиться экспертным опытом
+        - Только в последние дни ({_day_span(phases['offer'])}) предлагать продукт как решение
 
         Ответ должен быть на русском языке.
         """
 
+def generate_post(user_data: Dict[str, Any], post_number: int) -> str:
+    """Generate a single post using GPT-4."""
+    try:
+        prompt = build_post_prompt(compact_profile(user_data), post_number)
         logger.info("Sending request to OpenAI for post generation")
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-
-        post_content = response.choices[0].message.content.strip()
+        post_content = finalize(_complete(prompt, 'post'))
         logger.info(f"Successfully generated full post #{post_number}")
         return post_content
+    except Exception as e:
+        logger.error(f"Error generating post: {e}")
+        raise
 
+async def agenerate_post(user_data: Dict[str, Any], post_number: int) -> str:
+    """Async version of generate_post."""
+    try:
+        prompt = build_post_prompt(await acompact_profile(user_data), post_number)
+        logger.info("Sending request to OpenAI for post generation")
+        post_content = await afinalize(await _acomplete(prompt, 'post'))
+        logger.info(f"Successfully generated full post #{post_number}")
+        return post_content
     except Exception as e:
         logger.error(f"Error generating post: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,64 @@
+import time
+import threading
+from typing import Optional
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `burst` saved up.
+
+    pause() stops handing out tokens for a while, e.g. when Telegram answers
+    429 with retry_after: every thread waits, not just the one that was told.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else 1.0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        """Seconds until `tokens` can be taken; takes them and returns 0 if available."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            return self._wait_time(tokens, time.monotonic()) == 0.0
+
+    def time_until(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` could be taken, 0 if now; takes nothing."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until `tokens` are available. Returns the seconds spent waiting."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                wait = self._wait_time(tokens, time.monotonic())
+            if wait == 0.0:
+                return time.monotonic() - started
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            # Resume at the normal pace instead of with a saved-up burst
+            self._tokens = 0.0
+            self._updated = self._paused_until
@@ -0,0 +1,361 @@
+"""Record live update traffic and replay it offline through the real handlers.
+
+Recording is enabled in main.py with RECORD_TRAFFIC=<file.ndjson.gz>. The file
+holds one JSON event per line:
+
+    {"t": 0.0, "type": "meta", "redact": true}
+    {"t": 1.25, "type": "update", "update": {...}}
+    {"t": 1.31, "type": "reply", "method": "sendMessage", "chat_id": 1000001, "text": "..."}
+    {"t": 3.02, "type": "completion", "prompt_sha": "...", "text": "...", "seconds": 1.7}
+    {"t": 0.80, "type": "member", "user_id": 1000001, "status": "member"}
+
+User and chat ids are replaced by sequential pseudonyms, names, usernames and
+other profile fields are dropped, and prompts are kept only as a hash. The
+letters of free-text messages and replies are replaced as well (commands and
+numbers are kept so the flow still replays); RECORD_REDACT_TEXT=0 records
+them verbatim, for traffic whose users agreed to it.
+
+    python recorder.py replay traffic.ndjson.gz --speed 10
+"""
+import os
+import re
+import sys
+import json
+import gzip
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterator, List, Optional
+from telegram import Update
+from telegram.ext import Dispatcher, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# Verbatim user text is opt-in
+RECORD_REDACT_TEXT = os.getenv('RECORD_REDACT_TEXT', '1') != '0'
+
+# Objects that identify a person or chat inside an update
+_ENTITY_KEYS = {'from', 'chat', 'user', 'forward_from', 'forward_from_chat', 'sender_chat'}
+_DROPPED_KEYS = {'contact', 'location', 'venue', 'photo', 'voice', 'video', 'document', 'sticker'}
+# Replies carrying a chat_id that are worth comparing on replay
+_RECORDED_METHODS = {'sendMessage', 'editMessageText', 'sendDocument'}
+FIRST_PSEUDONYM = 1_000_001
+# gzip output is flushed every this many events; a crash loses at most these
+FLUSH_EVERY = 100
+
+def redact_text(text: str) -> str:
+    """Replace letters, keep commands, digits, emoji and layout."""
+    if not text or text.startswith('/') or text.strip().isdigit():
+        return text
+    return re.sub(r'[^\W\d_]', 'x', text)
+
+def prompt_sha(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+class TrafficRecorder:
+    """Thread-safe writer of sanitized traffic events to a gzip NDJSON file."""
+
+    def __init__(self, path: str, redact: bool = RECORD_REDACT_TEXT):
+        self.path = path
+        self.redact = redact
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._pseudonyms: Dict[int, int] = {}
+        self._unflushed = 0
+        self.write({'type': 'meta', 'redact': redact})
+
+    def pseudonym(self, real_id: int) -> int:
+        with self._lock:
+            if real_id not in self._pseudonyms:
+                # Negative ids are groups/channels; keep the sign so chat types stay plausible
+                number = FIRST_PSEUDONYM + len(self._pseudonyms)
+                self._pseudonyms[real_id] = -number if real_id < 0 else number
+            return self._pseudonyms[real_id]
+
+    def write(self, event: Dict[str, Any]) -> None:
+        event = {'t': round(time.monotonic() - self._started, 3), **event}
+        line = json.dumps(event, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._unflushed += 1
+            if self._unflushed >= FLUSH_EVERY:
+                self._file.flush()
+                self._unflushed = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def _sanitize_entity(self, entity: Dict[str, Any]) -> Dict[str, Any]:
+        clean = {'id': self.pseudonym(entity['id'])}
+        for key in ('type', 'is_bot'):
+            if key in entity:
+                clean[key] = entity[key]
+        if 'type' in entity and entity['type'] != 'private':
+            clean['title'] = 'Channel'
+        if 'first_name' in entity or 'is_bot' in entity:
+            clean['first_name'] = 'User'
+        return clean
+
+    def sanitize(self, value: Any, key: Optional[str] = None) -> Any:
+        if isinstance(value, dict):
+            if key in _ENTITY_KEYS and 'id' in value:
+                return self._sanitize_entity(value)
+            # Empty lists and false flags are defaults in update JSON, skip them
+            return {
+                k: self.sanitize(v, k) for k, v in value.items()
+                if k not in _DROPPED_KEYS and v is not None and v is not False and v != []
+            }
+        if isinstance(value, list):
+            return [self.sanitize(item) for item in value]
+        if self.redact and key in ('text', 'caption') and isinstance(value, str):
+            return redact_text(value)
+        return value
+
+    def record_update(self, update: Update, context) -> None:
+        try:
+            self.write({'type': 'update', 'update': self.sanitize(update.to_dict())})
+        except Exception as e:
+            logger.error(f"Failed to record update: {e}")
+
+    def record_completion(self, prompt: str, text: str, seconds: float) -> None:
+        self.write({
+            'type': 'completion', 'prompt_sha': prompt_sha(prompt),
+            'text': text, 'seconds': round(seconds, 3)
+        })
+
+    def record_request(self, method: str, data: Dict[str, Any], result: Any) -> None:
+        if method == 'getChatMember' and isinstance(result, dict):
+            self.write({
+                'type': 'member',
+                'user_id': self.pseudonym(int(data['user_id'])),
+                'status': result.get('status'),
+            })
+        elif method in _RECORDED_METHODS and 'chat_id' in data:
+            text = data.get('text') or data.get('caption') or ''
+            self.write({
+                'type': 'reply',
+                'method': method,
+                'chat_id': self.pseudonym(int(data['chat_id'])),
+                'text': redact_text(text) if self.redact else text,
+            })
+
+def install_recorder(dispatcher: Dispatcher, recorder: TrafficRecorder) -> TrafficRecorder:
+    """Record every update, outgoing Bot API call and completion of a dispatcher."""
+    # Imported here: prompts loads database, whose DB_PATH replay() must set first
+    import prompts
+    dispatcher.add_handler(TypeHandler(Update, recorder.record_update), group=-2)
+    prompts.completion_hooks.append(recorder.record_completion)
+
+    request = dispatcher.bot.request
+    post = request.post
+
+    def recording_post(url: str, data: Dict[str, Any], timeout: float = None):
+        result = post(url, data, timeout=timeout)
+        try:
+            recorder.record_request(url.rsplit('/', 1)[-1], data, result)
+        except Exception as e:
+            logger.error(f"Failed to record request: {e}")
+        return result
+
+    request.post = recording_post
+    logger.info(f"Recording traffic to {recorder.path}")
+    return recorder
+
+def read_events(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, json.JSONDecodeError):
+            # The recording process died before closing the file; keep what was flushed
+            logger.warning(f"{path} is truncated, replaying the complete events only")
+
+class RecordedCompletions:
+    """Answers prompts with recorded completions: by prompt hash, else in order.
+
+    Each answer takes as long as it did when recorded, divided by `speed`.
+    """
+
+    def __init__(self, events: List[Dict[str, Any]], speed: float = 1.0):
+        self.speed = speed
+        self.answers: List[Dict[str, Any]] = []
+        self.by_prompt = defaultdict(deque)
+        for event in events:
+            if event['type'] == 'completion':
+                self.by_prompt[event['prompt_sha']].append(len(self.answers))
+                self.answers.append(event)
+        self.used = set()
+        self.misses = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> str:
+        from fake_openai import fake_completion_text
+        with self._lock:
+            indexes = self.by_prompt.get(prompt_sha(prompt))
+            while indexes and indexes[0] in self.used:
+                indexes.popleft()
+            if indexes:
+                index = indexes.popleft()
+            else:
+                # Prompt changed (new release or redacted input): use the next unused answer
+                self.misses += 1
+                while self._next in self.used:
+                    self._next += 1
+                if self._next >= len(self.answers):
+                    return fake_completion_text(prompt)
+                index = self._next
+            self.used.add(index)
+        answer = self.answers[index]
+        time.sleep(answer.get('seconds', 0) / self.speed)
+        return answer['text']
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def replay(path: str, speed: float = 1.0, settle: float = 5.0, timeout: float = 600.0) -> Dict[str, Any]:
+    """Feed a recording through build_conversation_handler against local stand-ins."""
+    import tempfile
+    from fake_bot_api import FakeBotAPI
+    from fake_openai import FakeOpenAI
+
+    events = list(read_events(path))
+    updates = [event for event in events if event['type'] == 'update']
+    redacted = any(event['type'] == 'meta' and event.get('redact') for event in events)
+    expected = defaultdict(list)
+    for event in events:
+        if event['type'] == 'reply':
+            expected[event['chat_id']].append(event['text'])
+
+    # Fresh database, and every generation task routed to the recorded answers
+    os.environ['BOT_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bot-replay-'), 'replay.db')
+    database = sys.modules.get('database')
+    if database is not None and database.DB_PATH != os.environ['BOT_DB_PATH']:
+        # Modules loaded before this point would write to the real database
+        raise RuntimeError(f"database was imported before replay, it would write to {database.DB_PATH}")
+    completions = RecordedCompletions(events, speed)
+    openai_server = FakeOpenAI(latency=0, responder=completions).start()
+    from backends import TASKS, OpenAIBackend, Route, Router, set_router
+    set_router(Router(
+        {'openai': OpenAIBackend(base_url=openai_server.base_url, api_key='replay')},
+        {task: Route(task) for task in TASKS}
+    ))
+    api = FakeBotAPI().start()
+    for event in events:
+        if event['type'] == 'member':
+            api.member_statuses[event['user_id']] = event['status']
+
+    from telegram.ext import Updater
+    from database import init_db
+    from main import build_conversation_handler, error_handler
+    init_db()
+    updater = Updater(token='123:replay', use_context=True, base_url=api.base_url)
+    updater.dispatcher.add_error_handler(error_handler)
+    updater.dispatcher.add_handler(build_conversation_handler())
+    updater.start_polling(poll_interval=0)
+
+    injected = defaultdict(list)
+    started = time.monotonic()
+    for event in updates:
+        delay = started + event['t'] / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        chat = (event['update'].get('message') or event['update'].get('callback_query', {}).get('message') or {}).get('chat', {})
+        injected[chat.get('id')].append(time.monotonic())
+        api.inject_update(event['update'])
+
+    expected_total = sum(len(texts) for texts in expected.values())
+    deadline = time.monotonic() + timeout
+    last_count, last_change = -1, time.monotonic()
+    while time.monotonic() < deadline:
+        count = len([call for call in api.sent if call['method'] in _RECORDED_METHODS])
+        if count != last_count:
+            last_count, last_change = count, time.monotonic()
+        if count >= expected_total and time.monotonic() - last_change > 0.5:
+            break
+        if time.monotonic() - last_change > settle:
+            break
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+    updater.stop()
+    api.stop()
+    openai_server.stop()
+
+    replies = defaultdict(list)
+    for call in api.sent:
+        if call['method'] in _RECORDED_METHODS and 'chat_id' in call['params']:
+            params = call['params']
+            text = params.get('text') or params.get('caption') or ''
+            replies[int(params['chat_id'])].append((call['time'], redact_text(text) if redacted else text))
+
+    latencies = []
+    for chat_id, times in injected.items():
+        reply_times = [reply_time for reply_time, _ in replies.get(chat_id, [])]
+        for inject_time in times:
+            later = [reply_time for reply_time in reply_times if reply_time >= inject_time]
+            if later:
+                latencies.append(later[0] - inject_time)
+
+    divergent = {}
+    for chat_id in set(expected) | set(replies):
+        got = [text for _, text in replies.get(chat_id, [])]
+        want = expected.get(chat_id, [])
+        if got != want:
+            index = next((i for i, (a, b) in enumerate(zip(got, want)) if a != b), min(len(got), len(want)))
+            divergent[chat_id] = {
+                'at_reply': index,
+                'expected': want[index][:80] if index < len(want) else None,
+                'got': got[index][:80] if index < len(got) else None,
+            }
+
+    return {
+        'updates': len(updates),
+        'chats': len(injected),
+        'speed': speed,
+        'elapsed_seconds': round(elapsed, 2),
+        'expected_replies': expected_total,
+        'replies': sum(len(texts) for texts in replies.values()),
+        'reply_latency_p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+        'reply_latency_p95_ms': round(_percentile(latencies, 95) * 1000, 1),
+        'reply_latency_max_ms': round(max(latencies, default=0.0) * 1000, 1),
+        'completion_prompt_misses': completions.misses,
+        'divergent_chats': len(divergent),
+        'divergences': dict(list(divergent.items())[:10]),
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.WARNING
+    )
+    parser = argparse.ArgumentParser(description="Replay recorded bot traffic")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    replay_parser = subparsers.add_parser('replay', help="replay a recording against local stand-ins")
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help="time acceleration factor")
+    replay_parser.add_argument('--timeout', type=float, default=600.0)
+    summary_parser = subparsers.add_parser('summary', help="count the events in a recording")
+    summary_parser.add_argument('path')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'replay':
+            report = replay(args.path, speed=args.speed, timeout=args.timeout)
+        else:
+            report = defaultdict(int)
+            for event in read_events(args.path):
+                report[event['type']] += 1
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        os._exit(0)
+    except Exception:
+        logger.error("Replay failed", exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from telegram import Update
+from telegram.ext import (
+    CallbackContext, ConversationHandler, Dispatcher, DispatcherHandlerStop, TypeHandler
+)
+from database import DB_PATH, current_tenant
+from persistence import _key_to_str
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SESSION_IDLE_SECONDS = float(os.getenv('SESSION_IDLE_SECONDS', '1800'))
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '5000'))
+# 1: idle sessions are written to the database and restored on return; 0: dropped
+SESSION_SPILL = os.getenv('SESSION_SPILL', '1') == '1'
+EVICTION_INTERVAL_SECONDS = float(os.getenv('SESSION_EVICTION_INTERVAL', '60'))
+# Sessions serialized per transaction, keeps the spill's peak memory small
+SPILL_BATCH_SIZE = 200
+
+EXPIRED_SESSION_TEXT = (
+    "⌛ Ваша сессия истекла из-за неактивности.\n"
+    "Нажмите /start, чтобы начать заново."
+)
+
+SessionKey = Tuple[int, int]
+
+class SessionManager:
+    """Bound the sessions kept in Dispatcher.user_data and the conversation dict.
+
+    Installed as a TypeHandler in group -1, so it sees every update before the
+    ConversationHandler. Sessions idle for idle_seconds, or the least recently
+    used ones beyond max_sessions, are evicted: spilled to session_data and
+    conversation_states, or dropped (the user is told on return). Eviction
+    runs from the update path at most every EVICTION_INTERVAL_SECONDS, so it
+    needs no JobQueue and works in the worker processes too.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        conversation: ConversationHandler,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        max_sessions: int = MAX_SESSIONS,
+        spill: bool = SESSION_SPILL,
+        db_path: Optional[str] = None
+    ):
+        self.dispatcher = dispatcher
+        self.conversation = conversation
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.spill = spill
+        self.db_path = db_path or DB_PATH
+        # (chat_id, user_id) -> last update time, least recently used first
+        self._last_seen: 'OrderedDict[SessionKey, float]' = OrderedDict()
+        # Dropped sessions that had an active conversation, to explain the reset
+        self._expired: 'OrderedDict[SessionKey, None]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_eviction = time.monotonic() + EVICTION_INTERVAL_SECONDS
+
+    def install(self, group: int = -1) -> 'SessionManager':
+        self.dispatcher.add_handler(TypeHandler(Update, self.touch), group=group)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def mark_active(self, key: SessionKey, now: Optional[float] = None) -> bool:
+        """Record activity for a session. Returns False if it wasn't in memory."""
+        with self._lock:
+            known = key in self._last_seen
+            self._last_seen[key] = time.monotonic() if now is None else now
+            self._last_seen.move_to_end(key)
+            return known
+
+    def touch(self, update: Update, context: CallbackContext) -> None:
+        chat, user = update.effective_chat, update.effective_user
+        if chat is None or user is None:
+            return
+        key = (chat.id, user.id)
+
+        if not self.mark_active(key):
+            if self.spill:
+                self._restore(key, context.user_data)
+            else:
+                with self._lock:
+                    expired = key in self._expired
+                    self._expired.pop(key, None)
+                text = update.message.text if update.message else ''
+                if expired and not (text or '').startswith('/start'):
+                    update.effective_message.reply_text(EXPIRED_SESSION_TEXT)
+                    raise DispatcherHandlerStop()
+
+        if time.monotonic() >= self._next_eviction or len(self._last_seen) > self.max_sessions:
+            self.evict()
+
+    def _is_pending(self, key: SessionKey) -> bool:
+        # (old_state, Promise) while a run_async generation is running
+        return isinstance(self.conversation.conversations.get(key), tuple)
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Evict idle sessions and the oldest ones above the cap. Returns the count."""
+        now = time.monotonic() if now is None else now
+        self._next_eviction = now + EVICTION_INTERVAL_SECONDS
+        # Held while writing, so a returning user can't read a half-written spill
+        with self._lock:
+            overflow = len(self._last_seen) - self.max_sessions
+            keys = []
+            for key, seen in self._last_seen.items():
+                if overflow <= 0 and now - seen < self.idle_seconds:
+                    break
+                if self._is_pending(key):
+                    continue
+                keys.append(key)
+                overflow -= 1
+            if not keys:
+                return 0
+
+            for start in range(0, len(keys), SPILL_BATCH_SIZE):
+                sessions = {}
+                with self.conversation._conversations_lock:
+                    for key in keys[start:start + SPILL_BATCH_SIZE]:
+                        del self._last_seen[key]
+                        state = self.conversation.conversations.pop(key, None)
+                        sessions[key] = (state, self.dispatcher.user_data.pop(key[1], None))
+
+                if self.spill:
+                    self._spill(sessions)
+                else:
+                    for key, (state, _) in sessions.items():
+                        if state is not None:
+                            self._expired[key] = None
+            while len(self._expired) > self.max_sessions * 10:
+                self._expired.popitem(last=False)
+
+        metrics.incr('sessions.evicted', len(keys))
+        logger.info(f"Evicted {len(keys)} idle sessions, {len(self._last_seen)} in memory")
+        return len(keys)
+
+    def _spill(self, sessions: Dict[SessionKey, Tuple[Any, Optional[dict]]]) -> None:
+        spill_sessions(self.db_path, self.conversation.name, sessions)
+
+    def _restore(self, key: SessionKey, user_data: dict) -> None:
+        """Load a spilled session back into memory, if there is one."""
+        # Without persistence the rows are only a spill; memory is the truth again
+        state, data = restore_session(
+            self.db_path, self.conversation.name, key, delete=self.dispatcher.persistence is None
+        )
+        if data and not user_data:
+            user_data.update(data)
+        if state is not None:
+            with self.conversation._conversations_lock:
+                self.conversation.conversations.setdefault(key, state)
+
+def _connect(db_path: str):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+def spill_sessions(db_path: str, name: str, sessions: Dict[SessionKey, Tuple[Any, Optional[dict]]]) -> None:
+    """Write evicted sessions, key -> (conversation state, user_data), to the database."""
+    tenant_id = current_tenant()
+    conn = None
+    try:
+        conn = _connect(db_path)
+        with conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO session_data (tenant_id, user_id, data, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', [
+                (tenant_id, key[1], json.dumps(data, ensure_ascii=False))
+                for key, (_, data) in sessions.items() if data
+            ])
+            conn.executemany('''
+                INSERT OR REPLACE INTO conversation_states (tenant_id, name, conversation_key, state, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', [
+                (tenant_id, name, _key_to_str(key), json.dumps(state))
+                for key, (state, _) in sessions.items() if state is not None
+            ])
+            conn.executemany(
+                'DELETE FROM conversation_states WHERE tenant_id = ? AND name = ? AND conversation_key = ?',
+                [(tenant_id, name, _key_to_str(key)) for key, (state, _) in sessions.items() if state is None]
+            )
+    except Exception as e:
+        logger.error(f"Error spilling {len(sessions)} sessions: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def restore_session(db_path: str, name: str, key: SessionKey, delete: bool = True) -> Tuple[Any, Optional[dict]]:
+    """(conversation state, user_data) of a spilled session, None for what wasn't spilled.
+
+    With `delete` the rows are removed once read.
+    """
+    tenant_id = current_tenant()
+    conn = None
+    try:
+        conn = _connect(db_path)
+        data = conn.execute(
+            'SELECT data FROM session_data WHERE tenant_id = ? AND user_id = ?', (tenant_id, key[1])
+        ).fetchone()
+        state = conn.execute(
+            'SELECT state FROM conversation_states WHERE tenant_id = ? AND name = ? AND conversation_key = ?',
+            (tenant_id, name, _key_to_str(key))
+        ).fetchone()
+        if (data or state) and delete:
+            with conn:
+                conn.execute('DELETE FROM session_data WHERE tenant_id = ? AND user_id = ?', (tenant_id, key[1]))
+                conn.execute(
+                    'DELETE FROM conversation_states WHERE tenant_id = ? AND name = ? AND conversation_key = ?',
+                    (tenant_id, name, _key_to_str(key))
+                )
+        if data or state:
+            metrics.incr('sessions.restored')
+        return (json.loads(state[0]) if state else None), (json.loads(data[0]) if data else None)
+    except Exception as e:
+        logger.error(f"Error restoring session {key}: {e}")
+        return None, None
+    finally:
+        if conn:
+            conn.close()
@@ -0,0 +1,133 @@
+"""Near-duplicate days in a content plan, found locally.
+
+Each day is reduced to the stems of the words in its headline and description
+and weighted by TF-IDF within the plan, so words every day shares (usually the
+channel topic) weigh nothing and a rare shared word weighs a lot. Two days
+whose cosine similarity reaches PLAN_SIMILARITY_THRESHOLD repeat each other.
+Only pairs sharing a term are scored (an inverted index over the days), so a
+90-day plan takes a few milliseconds, with no network.
+
+Entries come from prompts.plan_entries(); prompts.py regenerates only the
+repeated days, telling the model which day each of them repeated.
+
+representative() uses the same vectors to pick a few posts that stand for a
+larger set (imported example posts, see channel_export.py).
+"""
+import os
+import re
+import math
+from typing import Callable, Dict, List, Tuple
+
+PLAN_SIMILARITY_THRESHOLD = float(os.getenv('PLAN_SIMILARITY_THRESHOLD', '0.28'))
+
+TOPIC_LINE = re.compile(r'^\W*(?:Заголовок|Описание)\s*:\s*(.+)$', re.MULTILINE)
+WORD = re.compile(r'[^\W\d_]+')
+STOP_WORDS = frozenset('''
+    без больше будет был была были быть вам вас ваш ваша ваше ваши вот все всё где даже для его если есть еще
+    ещё или как какие какой когда кто либо над нас наш наша наше наши они при про раз так там тем тех что
+    чтобы эта эти это этот почему свой свои себя чем мы вы их уже
+'''.split())
+
+def topic_terms(entry: str) -> Dict[str, int]:
+    """Stem counts of the entry's headline and description.
+
+    The goal line is left out: most days share one of three goals. Stems are
+    the word without its last two letters, 4 to 5 letters long: crude, but it
+    joins "ошибки"/"ошибок" and "домашней"/"домашний".
+    """
+    lines = TOPIC_LINE.findall(entry) or entry.splitlines()[1:]
+    return word_terms(' '.join(lines))
+
+def word_terms(text: str) -> Dict[str, int]:
+    """Stem counts of every word of `text`, stemmed as in topic_terms()."""
+    terms: Dict[str, int] = {}
+    for word in WORD.findall(text.lower().replace('ё', 'е')):
+        if len(word) < 3 or word in STOP_WORDS:
+            continue
+        stem = word[:max(4, min(len(word) - 2, 5))]
+        terms[stem] = terms.get(stem, 0) + 1
+    return terms
+
+def _vectors(entries: Dict[int, str], terms_of: Callable[[str], Dict[str, int]] = topic_terms
+             ) -> Dict[int, Dict[str, float]]:
+    """Unit-length TF-IDF vectors of the entries, IDF taken over this plan."""
+    terms = {day: terms_of(entry) for day, entry in entries.items()}
+    frequency: Dict[str, int] = {}
+    for counts in terms.values():
+        for term in counts:
+            frequency[term] = frequency.get(term, 0) + 1
+    vectors = {}
+    for day, counts in terms.items():
+        weights = {
+            term: (1 + math.log(count)) * math.log(len(terms) / frequency[term])
+            for term, count in counts.items()
+        }
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        # A day made only of words every day has is left out, not matched
+        vectors[day] = {term: weight / norm for term, weight in weights.items() if weight} if norm else {}
+    return vectors
+
+def similar_days(entries: Dict[int, str],
+                 threshold: float = PLAN_SIMILARITY_THRESHOLD) -> List[Tuple[int, int, float]]:
+    """(earlier day, later day, similarity) for every pair of plan entries at or over `threshold`."""
+    postings: Dict[str, List[Tuple[int, float]]] = {}
+    for day, vector in sorted(_vectors(entries).items()):
+        for term, weight in vector.items():
+            postings.setdefault(term, []).append((day, weight))
+    scores: Dict[Tuple[int, int], float] = {}
+    for days in postings.values():
+        for index, (earlier, weight) in enumerate(days):
+            for later, other_weight in days[index + 1:]:
+                scores[earlier, later] = scores.get((earlier, later), 0.0) + weight * other_weight
+    return sorted(
+        (earlier, later, score) for (earlier, later), score in scores.items() if score >= threshold
+    )
+
+def repeated_days(entries: Dict[int, str], threshold: float = PLAN_SIMILARITY_THRESHOLD) -> Dict[int, int]:
+    """Days to regenerate, each mapped to the kept day it repeats.
+
+    The earliest day of a group of look-alikes is kept; a day that only
+    resembles days being regenerated anyway is kept too.
+    """
+    candidates: Dict[int, List[Tuple[float, int]]] = {}
+    for earlier, later, score in similar_days(entries, threshold):
+        candidates.setdefault(later, []).append((score, earlier))
+    repeats: Dict[int, int] = {}
+    for later in sorted(candidates):
+        kept = [(score, earlier) for score, earlier in candidates[later] if earlier not in repeats]
+        if kept:
+            repeats[later] = max(kept)[1]
+    return repeats
+
+def representative(texts: Dict[int, str], count: int) -> List[int]:
+    """Keys of `count` texts that together resemble the whole set most, in key order.
+
+    Greedy coverage: each step adds the text that most raises the sum, over
+    all texts, of their similarity to the closest one picked so far. The
+    first pick is the most typical text, later ones cover what it misses,
+    so one-off outliers are picked last.
+    """
+    vectors = _vectors(texts, word_terms)
+    postings: Dict[str, List[Tuple[int, float]]] = {}
+    for key, vector in vectors.items():
+        for term, weight in vector.items():
+            postings.setdefault(term, []).append((key, weight))
+    # Sparse similarity rows: only texts sharing a term
+    rows: Dict[int, Dict[int, float]] = {key: {key: 1.0} for key in vectors}
+    for keys in postings.values():
+        for index, (key, weight) in enumerate(keys):
+            for other, other_weight in keys[index + 1:]:
+                score = weight * other_weight
+                rows[key][other] = rows[key].get(other, 0.0) + score
+                rows[other][key] = rows[other].get(key, 0.0) + score
+    covered = {key: 0.0 for key in vectors}
+    picked: List[int] = []
+    while len(picked) < min(count, len(vectors)):
+        best = max(
+            (key for key in vectors if key not in picked),
+            key=lambda key: (sum(max(0.0, score - covered[other]) for other, score in rows[key].items()), -key)
+        )
+        picked.append(best)
+        for other, score in rows[best].items():
+            covered[other] = max(covered[other], score)
+    return sorted(picked)
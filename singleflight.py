@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from database import current_tenant
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class InFlightConflict(Exception):
+    """Raised when a chat asks for something different while a call is running."""
+
+    def __init__(self, in_flight_key: str):
+        super().__init__(f"Another request is in flight: {in_flight_key}")
+        self.in_flight_key = in_flight_key
+
+class _Call:
+    def __init__(self, key: str):
+        self.key = key
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Allow at most one generation per chat at a time.
+
+    An identical request made while the first one runs shares its result
+    instead of starting a second call; a different request raises
+    InFlightConflict so the caller can tell the user to wait. Chats are
+    per tenant: one user talking to two tenants' bots runs two calls.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Tuple[str, int], _Call] = {}
+        self._lock = threading.Lock()
+        # Called with (chat_id, key, error or None, seconds) after every call that ran, e.g. by analytics.py
+        self.hooks: List[Callable[[int, str, Optional[Exception], float], None]] = []
+
+    def in_flight(self, chat_id: int) -> Optional[str]:
+        """Key of the call currently running for the chat, if any."""
+        with self._lock:
+            call = self._calls.get((current_tenant(), chat_id))
+            return call.key if call else None
+
+    def attach(self, chat_id: int, key: str) -> bool:
+        """Join a running identical call without waiting for it.
+
+        Used where blocking is not allowed (the Dispatcher thread): the caller
+        relies on the running call to deliver the result.
+        """
+        with self._lock:
+            call = self._calls.get((current_tenant(), chat_id))
+            if call is None:
+                return False
+            if call.key != key:
+                metrics.incr(f'{self.name}.conflicts')
+                raise InFlightConflict(call.key)
+        metrics.incr(f'{self.name}.coalesced')
+        logger.info(f"Chat {chat_id}: attached to in-flight {key}")
+        return True
+
+    def do(self, chat_id: int, key: str, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """Run fn once per chat and key. Returns (result, shared)."""
+        slot = (current_tenant(), chat_id)
+        with self._lock:
+            call = self._calls.get(slot)
+            if call is not None and call.key != key:
+                metrics.incr(f'{self.name}.conflicts')
+                raise InFlightConflict(call.key)
+            leader = call is None
+            if leader:
+                call = _Call(key)
+                self._calls[slot] = call
+
+        if not leader:
+            metrics.incr(f'{self.name}.coalesced')
+            logger.info(f"Chat {chat_id}: waiting for in-flight {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        metrics.incr(f'{self.name}.started')
+        started = time.monotonic()
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[slot]
+            call.done.set()
+            self._notify(chat_id, key, call.error, time.monotonic() - started)
+
+    def _notify(self, chat_id: int, key: str, error: Optional[Exception], seconds: float) -> None:
+        for hook in self.hooks:
+            try:
+                hook(chat_id, key, error, seconds)
+            except Exception as e:
+                logger.error(f"{self.name} hook failed: {e}")
+
+# Shared by all handlers that call prompts.py
+generation_flight = SingleFlight('generation')
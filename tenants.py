@@ -0,0 +1,321 @@
+"""Several white-label bots in one process (TENANTS).
+
+A tenant is a bot token with its own settings: the channel users must join
+(utils.check_subscription), replaced texts (utils.TEXTS) and the model or
+routes its generations use. Tenants share everything heavy in the process:
+
+  * one pool of worker threads, FairExecutor, runs every tenant's run_async
+    handlers, JobQueue jobs and autoposts. It serves tenants in turn and caps
+    how many tasks of one tenant run at once, so a tenant with a backlog of
+    generations can't starve the others;
+  * one set of generation backends, so one OpenAI client and connection pool
+    (a tenant's own model gets a Router on the same backends);
+  * one database: the per-user tables are keyed by tenant_id and queries use
+    database.current_tenant(), set on every thread working for a tenant.
+
+TENANTS is JSON or a path to a JSON file, by tenant id:
+
+    {"acme": {"token": "123:ABC", "subscription_channel": "@acme_news",
+              "texts": {"welcome": "👋 Бот Acme. Выберите действие:"},
+              "model": "gpt-4o-mini"},
+     "beta": {"token": "456:DEF", "routes": {"post": {"temperature": 0.9}}}}
+
+A tenant without subscription_channel has no subscription check. With TENANTS
+set, main.run_telegram_bot runs the tenants instead of TELEGRAM_BOT_TOKEN;
+the rows of a single-bot deployment belong to tenant ''.
+"""
+import os
+import re
+import time
+import signal
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future
+from queue import Queue
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from apscheduler.executors.pool import BasePoolExecutor
+from telegram import Bot
+from telegram.ext import Dispatcher, DispatcherHandlerStop, JobQueue, Updater
+from telegram.ext.utils.promise import Promise
+from telegram.utils.request import Request
+from backends import _load_json_setting, get_router, set_tenant_router
+from database import current_tenant, tenant_scope
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TENANT_WORKERS = int(os.getenv('TENANT_WORKERS', '16'))
+# Tasks of one tenant running at once; the rest of the pool stays free for the others
+TENANT_MAX_RUNNING = int(os.getenv('TENANT_MAX_RUNNING', '8'))
+# Same setting as in main.py
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL") or None
+
+TENANT_ID = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+CHANNEL_USERNAME = re.compile(r'^@([A-Za-z0-9_]{5,})$')
+
+class Tenant:
+    """One white-label bot and what it does differently."""
+
+    def __init__(self, tenant_id: str, token: str, subscription_channel: Optional[str] = None,
+                 subscription_url: Optional[str] = None, texts: Optional[Dict[str, str]] = None,
+                 model: Optional[str] = None, routes: Optional[Dict[str, Dict[str, Any]]] = None):
+        if not TENANT_ID.match(tenant_id):
+            raise ValueError(f"Tenant id {tenant_id!r}: lowercase letters, digits, - and _, up to 32")
+        if not token:
+            raise ValueError(f"Tenant {tenant_id} has no token")
+        self.id = tenant_id
+        self.token = token
+        self.subscription_channel = subscription_channel or None
+        self.subscription_url = subscription_url
+        if self.subscription_channel and not subscription_url:
+            username = CHANNEL_USERNAME.match(self.subscription_channel)
+            if not username:
+                raise ValueError(f"Tenant {tenant_id}: a channel given by id needs subscription_url")
+            self.subscription_url = f"https://t.me/{username.group(1)}"
+        self.texts = texts or {}
+        self.model = model
+        self.routes = routes or {}
+
+# tenant id -> Tenant, for the tenants running in this process
+_tenants: Dict[str, Tenant] = {}
+
+def get_tenant(tenant_id: Optional[str] = None) -> Optional[Tenant]:
+    """The tenant this code runs for (or `tenant_id`); None for a single bot."""
+    return _tenants.get(current_tenant() if tenant_id is None else tenant_id)
+
+def register(tenant: Tenant) -> None:
+    _tenants[tenant.id] = tenant
+    if tenant.model or tenant.routes:
+        set_tenant_router(tenant.id, get_router().for_tenant(tenant.model, tenant.routes))
+
+def load_tenants() -> List[Tenant]:
+    """Tenants configured in TENANTS."""
+    from utils import TEXTS
+    tenants = []
+    for tenant_id, options in _load_json_setting('TENANTS').items():
+        tenant = Tenant(tenant_id, **options)
+        unknown = set(tenant.texts) - set(TEXTS)
+        if unknown:
+            raise ValueError(f"Tenant {tenant_id}: unknown texts {sorted(unknown)}, known: {sorted(TEXTS)}")
+        tenants.append(tenant)
+    return tenants
+
+class FairExecutor:
+    """Worker threads shared by every tenant, taking the tenants' tasks in turn.
+
+    Each tenant has a FIFO queue. A free worker serves the next tenant in
+    round-robin order that has a task waiting and fewer than max_running
+    running, so a tenant with a thousand queued generations delays another
+    tenant's task by at most one task per worker, never by its backlog.
+    Tasks run in their tenant's scope (database.current_tenant()).
+    """
+
+    def __init__(self, workers: int = TENANT_WORKERS, max_running: int = TENANT_MAX_RUNNING):
+        self.workers = workers
+        self.max_running = max_running
+        # tenant id -> (future, fn, args, kwargs, queued at)
+        self._queues: Dict[str, Deque[Tuple[Future, Callable, tuple, dict, float]]] = {}
+        self._running: Dict[str, int] = {}
+        # Tenants with queued tasks, in serving order
+        self._turns: Deque[str] = deque()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f'tenant-worker-{index}', daemon=True)
+            for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, tenant_id: str, fn: Callable, *args, **kwargs) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("FairExecutor is shut down")
+            queue = self._queues.setdefault(tenant_id, deque())
+            if not queue:
+                self._turns.append(tenant_id)
+            queue.append((future, fn, args, kwargs, time.monotonic()))
+            self._condition.notify()
+        return future
+
+    def executor(self, tenant_id: str) -> 'TenantExecutor':
+        return TenantExecutor(self, tenant_id)
+
+    def pending(self) -> Dict[str, Tuple[int, int]]:
+        """(queued, running) tasks by tenant."""
+        with self._condition:
+            return {
+                tenant_id: (len(self._queues.get(tenant_id, ())), self._running.get(tenant_id, 0))
+                for tenant_id in set(self._queues) | set(self._running)
+            }
+
+    def _next(self) -> Optional[Tuple[str, Tuple[Future, Callable, tuple, dict, float]]]:
+        with self._condition:
+            while True:
+                for tenant_id in self._turns:
+                    if self._running.get(tenant_id, 0) < self.max_running:
+                        # To the back of the line, if it still has tasks
+                        self._turns.remove(tenant_id)
+                        queue = self._queues[tenant_id]
+                        task = queue.popleft()
+                        if queue:
+                            self._turns.append(tenant_id)
+                        self._running[tenant_id] = self._running.get(tenant_id, 0) + 1
+                        return tenant_id, task
+                if self._shutdown:
+                    return None
+                self._condition.wait()
+
+    def _work(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            tenant_id, (future, fn, args, kwargs, queued_at) = item
+            metrics.incr(f'tenants.{tenant_id}.tasks')
+            metrics.incr(f'tenants.{tenant_id}.wait_ms', int((time.monotonic() - queued_at) * 1000))
+            if future.set_running_or_notify_cancel():
+                try:
+                    with tenant_scope(tenant_id):
+                        result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self._condition:
+                self._running[tenant_id] -= 1
+                self._condition.notify()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop taking tasks; workers leave once nothing they could run is queued."""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+class TenantExecutor(Executor):
+    """One tenant's view of a FairExecutor, for code expecting an Executor."""
+
+    def __init__(self, pool: FairExecutor, tenant_id: str):
+        self.pool = pool
+        self.tenant_id = tenant_id
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        return self.pool.submit(self.tenant_id, fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, **kwargs) -> None:
+        # The pool outlives every tenant using it, TenantRuntime shuts it down
+        pass
+
+class _PoolJobExecutor(BasePoolExecutor):
+    """APScheduler executor handing a tenant's jobs to the shared pool."""
+
+    def __init__(self, pool: Executor):
+        super().__init__(pool)
+
+class TenantDispatcher(Dispatcher):
+    """Dispatcher of one tenant's bot.
+
+    Updates are processed in the tenant's scope; run_async callbacks and
+    JobQueue jobs go to the shared FairExecutor instead of threads of its own.
+    `executor` is that pool as the tenant sees it (install_autopost uses it).
+    """
+
+    def __init__(self, tenant: Tenant, bot: Bot, pool: FairExecutor):
+        self.tenant = tenant
+        self.executor = pool.executor(tenant.id)
+        job_queue = JobQueue()
+        job_queue.scheduler.configure(executors={'default': _PoolJobExecutor(self.executor)})
+        super().__init__(bot, Queue(), workers=pool.max_running, job_queue=job_queue, use_context=True)
+        job_queue.set_dispatcher(self)
+
+    def _init_async_threads(self, base_name: str, workers: int) -> None:
+        # No pool of its own, see _run_async
+        pass
+
+    def _run_async(self, func: Callable[..., object], *args: object, update: object = None,
+                   error_handling: bool = True, **kwargs: object) -> Promise:
+        promise = Promise(func, args, kwargs, update=update, error_handling=error_handling)
+        self.executor.submit(self._run_promise, promise)
+        return promise
+
+    def _run_promise(self, promise: Promise) -> None:
+        """Dispatcher._pooled for one promise."""
+        promise.run()
+        if not promise.exception:
+            self.update_persistence(update=promise.update)
+            return
+        if isinstance(promise.exception, DispatcherHandlerStop):
+            logger.warning(f"DispatcherHandlerStop is not supported in run_async callbacks "
+                           f"({promise.pooled_function.__name__})")
+            return
+        if promise.pooled_function in self.error_handlers or not promise.error_handling:
+            logger.error(f"Uncaught error in a run_async callback: {promise.exception}")
+            return
+        try:
+            self.dispatch_error(promise.update, promise.exception, promise=promise)
+        except Exception:
+            logger.exception("An uncaught error was raised while handling the error")
+
+    def start(self, ready: threading.Event = None) -> None:
+        # The dispatcher thread only ever processes this tenant's updates
+        with tenant_scope(self.tenant.id):
+            super().start(ready)
+
+class TenantRuntime:
+    """Every tenant's bot in this process, on one FairExecutor.
+
+    `setup(dispatcher)` installs the handlers of one bot (main.install_handlers);
+    it runs in the tenant's scope, so what it resumes (broadcasts) is the
+    tenant's own. Each tenant still has its own polling, dispatcher and
+    scheduler threads: they only wait on Telegram or the clock.
+    """
+
+    def __init__(self, tenants: List[Tenant], setup: Callable[[Dispatcher], Any],
+                 workers: int = TENANT_WORKERS, max_running: int = TENANT_MAX_RUNNING):
+        if not tenants:
+            raise ValueError("TENANTS lists no tenants")
+        self.pool = FairExecutor(workers, max_running)
+        self.dispatchers: List[TenantDispatcher] = []
+        self.updaters: List[Updater] = []
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        for tenant in tenants:
+            register(tenant)
+            # Enough connections for every task the pool may run for this tenant
+            bot = Bot(tenant.token, base_url=TELEGRAM_API_BASE_URL, request=Request(con_pool_size=max_running + 4))
+            dispatcher = TenantDispatcher(tenant, bot, self.pool)
+            with tenant_scope(tenant.id):
+                setup(dispatcher)
+            self.dispatchers.append(dispatcher)
+            self.updaters.append(Updater(dispatcher=dispatcher, workers=None))
+        logger.info(f"{len(tenants)} tenants on {workers} shared workers, at most {max_running} per tenant")
+
+    def start(self) -> None:
+        for updater in self.updaters:
+            updater.start_polling(drop_pending_updates=True)
+            logger.info(f"Tenant {updater.dispatcher.tenant.id} started")
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+        for updater in self.updaters:
+            updater.stop()
+        self.pool.shutdown()
+        self._stopped.set()
+        logger.info("Tenants stopped")
+
+    def idle(self) -> None:
+        """Block until SIGINT or SIGTERM (main thread only) or stop()."""
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: self.stop())
+        while not self._stopped.wait(1):
+            pass
@@ -1,9 +1,44 @@
+import os
 import logging
+from typing import Optional
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
+from tenants import get_tenant
 
 logger = logging.getLogger(__name__)
 
+# Required channel of the single bot; each tenant sets its own (see tenants.py)
+SUBSCRIPTION_CHANNEL = "@expert_buyanov"
+SUBSCRIPTION_URL = "https://t.me/expert_buyanov"
+SUBSCRIBED_STATUSES = ['member', 'administrator', 'creator']
+# Telegram user ids allowed to run admin commands, comma separated
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').replace(',', ' ').split()}
+
+# Texts a tenant can replace in its config; {channel} stands for the required channel
+TEXTS = {
+    'welcome': "👋 Выберите действие:",
+    'subscribe': "👋 Для использования бота необходимо подписаться на канал {channel}",
+    'not_subscribed': (
+        "❌ Вы все еще не подписаны на канал {channel}\n"
+        "Подпишитесь и нажмите кнопку проверки ещё раз."
+    ),
+}
+
+def is_admin(user_id: int) -> bool:
+    """Check if the user may run admin commands."""
+    return user_id in ADMIN_IDS
+
+def subscription_channel() -> Optional[str]:
+    """Channel users must join: the current tenant's (None: no check), else SUBSCRIPTION_CHANNEL."""
+    tenant = get_tenant()
+    return tenant.subscription_channel if tenant else SUBSCRIPTION_CHANNEL
+
+def bot_text(key: str) -> str:
+    """TEXTS[key], or the current tenant's version of it."""
+    tenant = get_tenant()
+    text = (tenant.texts.get(key) if tenant else None) or TEXTS[key]
+    return text.replace('{channel}', subscription_channel() or '')
+
 def create_main_menu_keyboard() -> InlineKeyboardMarkup:
     """Create the main menu keyboard."""
     keyboard = [
@@ -37,8 +72,9 @@ def create_style_keyboard() -> InlineKeyboardMarkup:
 
 def create_subscription_keyboard() -> InlineKeyboardMarkup:
     """Create keyboard with subscription button."""
+    tenant = get_tenant()
     return InlineKeyboardMarkup([[
-        InlineKeyboardButton("📢 Подписаться на канал", url="https://t.me/expert_buyanov"),
+        InlineKeyboardButton("📢 Подписаться на канал", url=tenant.subscription_url if tenant else SUBSCRIPTION_URL),
         InlineKeyboardButton("✅ Я подписался", callback_data='check_subscription')
     ]])
 
@@ -50,9 +86,12 @@ def create_back_to_menu_keyboard() -> InlineKeyboardMarkup:
 
 def check_subscription(context: CallbackContext, user_id: int) -> bool:
     """Check if user is subscribed to the required channel."""
+    channel = subscription_channel()
+    if not channel:
+        return True
     try:
         # Проверка статуса участника
-        member = context.bot.get_chat_member(chat_id="@expert_buyanov", user_id=user_id)
+        member = context.bot.get_chat_member(chat_id=channel, user_id=user_id)
 
         # Логируем полученные данные
         logger.info("=============== SUBSCRIPTION CHECK ===============")
@@ -61,7 +100,7 @@ def check_subscription(context: CallbackContext, user_id: int) -> bool:
         logger.info("===============================================")
 
         # Проверяем только основные статусы
-        is_member = member.status in ['member', 'administrator', 'creator']
+        is_member = member.status in SUBSCRIBED_STATUSES
 
         # Возвращаем результат проверки
         return is_member
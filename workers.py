@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import zlib
+import time
+import logging
+import argparse
+import multiprocessing
+from queue import Queue
+from typing import List, Optional
+from telegram import Bot, Update
+from telegram.ext import Updater, Dispatcher, TypeHandler
+from database import init_db
+from persistence import SQLitePersistence
+
+logger = logging.getLogger(__name__)
+
+WORKER_COUNT = int(os.getenv('BOT_WORKERS', str(os.cpu_count() or 2)))
+INGRESS_MODE = os.getenv('BOT_INGRESS', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+# Threads per worker for run_async handlers
+WORKER_THREADS = int(os.getenv('BOT_WORKER_THREADS', '4'))
+SUPERVISOR_INTERVAL = 2.0
+
+def shard_for(chat_id: int, shards: int) -> int:
+    """Map a chat to a worker. Stable across processes and restarts."""
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+def _update_chat_id(update: Update) -> int:
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return 0
+
+def worker_main(index: int, shards: int, updates, token: str, base_url: Optional[str]) -> None:
+    """Process every update of one shard in arrival order."""
+    # Imported here so the parent process doesn't pay for handlers/prompts
+    from main import build_conversation_handler, error_handler
+    from sessions import SessionManager
+    from profiling import install_profiling
+    from analytics import record_generations
+
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    bot = Bot(token, base_url=base_url)
+    persistence = SQLitePersistence(
+        key_filter=lambda key: shard_for(key[0], shards) == index
+    )
+    dispatcher = Dispatcher(bot, Queue(), workers=WORKER_THREADS, persistence=persistence, use_context=True)
+    dispatcher.add_error_handler(error_handler)
+    conv_handler = build_conversation_handler(persistent=True)
+    dispatcher.add_handler(conv_handler)
+    SessionManager(dispatcher, conv_handler).install()
+    install_profiling(dispatcher)
+    # States and generations go to the shared event log; the ingress rolls it up
+    record_generations()
+    logger.info(f"Worker {index}/{shards} ready")
+
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        try:
+            dispatcher.process_update(Update.de_json(json.loads(data), bot))
+        except Exception as e:
+            logger.error(f"Worker {index} failed to process update: {e}", exc_info=True)
+    logger.info(f"Worker {index} stopped")
+
+class ShardedRuntime:
+    """Ingress Updater that routes updates to N worker processes by chat_id.
+
+    Each shard has its own queue and exactly one consumer, so updates of a
+    chat are handled in order. Conversation state lives in the database, so a
+    crashed worker is simply restarted and picks up its shard where it stopped.
+    """
+
+    def __init__(self, token: str, workers: int = WORKER_COUNT, base_url: Optional[str] = None):
+        self.token = token
+        self.shards = max(1, workers)
+        self.base_url = base_url
+        self._ctx = multiprocessing.get_context('spawn')
+        self.queues = [self._ctx.Queue() for _ in range(self.shards)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * self.shards
+        self.updater = None
+
+    def _spawn(self, index: int) -> None:
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self.shards, self.queues[index], self.token, self.base_url),
+            name=f'bot-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def route_update(self, update: Update, context) -> None:
+        """TypeHandler callback: forward the raw update to its shard."""
+        index = shard_for(_update_chat_id(update), self.shards)
+        self.queues[index].put(update.to_json())
+
+    def supervise(self, context=None) -> None:
+        """Restart workers that died so their shard keeps being served."""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                self._spawn(index)
+
+    def start(self, mode: str = INGRESS_MODE) -> None:
+        for index in range(self.shards):
+            self._spawn(index)
+
+        self.updater = Updater(token=self.token, use_context=True, base_url=self.base_url)
+        self.updater.dispatcher.add_handler(TypeHandler(Update, self.route_update))
+        self.updater.job_queue.run_repeating(self.supervise, interval=SUPERVISOR_INTERVAL)
+
+        from maintenance import schedule_maintenance
+        schedule_maintenance(self.updater.job_queue)
+        from analytics import schedule_analytics
+        schedule_analytics(self.updater.job_queue)
+
+        # Broadcasts, autoposting, /search, /funnel and plan documents work on the
+        # shared database and run in the ingress only; group -1 keeps them from the shards
+        from features import install_shared
+        install_shared(self.updater.dispatcher, group=-1)
+
+        if mode == 'webhook':
+            self.updater.start_webhook(
+                listen='0.0.0.0',
+                port=WEBHOOK_PORT,
+                url_path=self.token,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{self.token}"
+            )
+        else:
+            self.updater.start_polling(drop_pending_updates=True)
+        logger.info(f"Ingress started in {mode} mode with {self.shards} workers")
+
+    def stop(self) -> None:
+        if self.updater:
+            self.updater.stop()
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=10)
+
+def run_sharded_bot(workers: int = WORKER_COUNT, mode: str = INGRESS_MODE) -> None:
+    """Start the ingress and worker processes and block until interrupted."""
+    init_db()
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("Telegram bot token not found!")
+        return
+
+    runtime = ShardedRuntime(token, workers, base_url=os.getenv("TELEGRAM_API_BASE_URL") or None)
+    runtime.start(mode)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runtime.stop()
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - ingress - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Run the bot as N worker processes sharded by chat_id")
+    parser.add_argument('--workers', type=int, default=WORKER_COUNT)
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=INGRESS_MODE)
+    args = parser.parse_args()
+    try:
+        run_sharded_bot(args.workers, args.mode)
+    except Exception:
+        logger.error("Critical error in sharded runtime:", exc_info=True)
+        sys.exit(1)
@@ -1,5 +1,5 @@
 from app import app
-from main import run_telegram_bot
+from leader import LeaderElection
 import threading
 import logging
 import os
@@ -9,11 +9,17 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 _bot_thread = None
+_election = None
+
+def bot_is_running():
+    return _bot_thread is not None and _bot_thread.is_alive()
 
 def start_bot():
     global _bot_thread
     if _bot_thread is None or not _bot_thread.is_alive():
         try:
+            # Deferred so workers that never lead don't import telegram/openai
+            from main import run_telegram_bot
             logger.info("Starting Telegram bot thread")
             _bot_thread = threading.Thread(target=run_telegram_bot)
             _bot_thread.daemon = True
@@ -30,10 +36,17 @@ def check_required_vars():
         return False
     return True
 
-# Start bot only once when running via gunicorn
+def start_leader_election():
+    """Run the bot in exactly one gunicorn worker; the others stand by."""
+    global _election
+    if _election is None:
+        _election = LeaderElection(on_elected=start_bot, is_running=bot_is_running)
+        _election.start()
+
+# Start bot only once when running via gunicorn (don't combine with --preload)
 if __name__ != "__main__":
     if check_required_vars():
-        start_bot()
+        start_leader_election()
 
 if __name__ == "__main__":
     if check_required_vars():